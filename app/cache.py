@@ -0,0 +1,188 @@
+import json
+import logging
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import any_, bindparam, select, Text
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import ExternalCache
+
+logger = logging.getLogger(__name__)
+
+# Признак промаха: закэшированный ответ сам может быть False или None
+MISS = object()
+# Предзагрузка нашла в таблице устаревший ответ
+STALE = object()
+
+FLUSH_CHUNK_SIZE = 5000
+
+
+class SourceCache:
+    """Кэш разобранных ответов внешних источников.
+
+    Перед таблицей external_cache стоит LRU в памяти процесса. Запись
+    в таблицу накапливается и выполняется одним upsert в flush(). Ответы
+    для батча лидов читаются из таблицы одним запросом в prefetch(),
+    и get() по ним не ходит в БД.
+    """
+
+    def __init__(self, ttl: Optional[Dict[str, int]] = None, max_size: Optional[int] = None):
+        self.enabled = settings.CACHE_ENABLED
+        self.ttl = ttl or settings.CACHE_TTL
+        self.max_size = max_size or settings.CACHE_LRU_SIZE
+        self._lru = OrderedDict()
+        self._pending = {}
+        # Результат prefetch() до первого get(): (ответ, время), STALE или MISS
+        self._prefetched = {}
+        self.stats = defaultdict(lambda: {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stale': 0})
+
+    def _key(self, query: dict) -> str:
+        """Нормализованный ключ запроса"""
+        normalized = {k: str(v).strip().lower() for k, v in query.items() if v is not None}
+        return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+    def _is_fresh(self, source: str, fetched_at: datetime) -> bool:
+        ttl = self.ttl.get(source)
+        if ttl is None:
+            return False
+        return datetime.now() - fetched_at < timedelta(seconds=ttl)
+
+    def _remember(self, cache_key: tuple, value, fetched_at: datetime):
+        self._lru[cache_key] = (value, fetched_at)
+        self._lru.move_to_end(cache_key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    async def get(self, source: str, query: dict):
+        """Закэшированный ответ или MISS, если его нет или он устарел"""
+        if not self.enabled:
+            return MISS
+
+        stats = self.stats[source]
+        cache_key = (source, self._key(query))
+
+        cached = self._lru.get(cache_key)
+        if cached is not None:
+            value, fetched_at = cached
+            if self._is_fresh(source, fetched_at):
+                self._lru.move_to_end(cache_key)
+                stats['memory_hits'] += 1
+                return value
+            del self._lru[cache_key]
+            stats['stale'] += 1
+            return MISS
+
+        prefetched = self._prefetched.pop(cache_key, None)
+        if prefetched is not None:
+            if prefetched is MISS or prefetched is STALE:
+                stats['misses' if prefetched is MISS else 'stale'] += 1
+                return MISS
+            value, fetched_at = prefetched
+            self._remember(cache_key, value, fetched_at)
+            stats['db_hits'] += 1
+            return value
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ExternalCache.payload, ExternalCache.fetched_at).where(
+                    ExternalCache.source == source,
+                    ExternalCache.query_key == cache_key[1]
+                )
+            )
+            row = result.first()
+
+        if row is None:
+            stats['misses'] += 1
+            return MISS
+        if not self._is_fresh(source, row.fetched_at):
+            stats['stale'] += 1
+            return MISS
+
+        value = json.loads(row.payload)
+        self._remember(cache_key, value, row.fetched_at)
+        stats['db_hits'] += 1
+        return value
+
+    async def prefetch(self, queries: Iterable[Tuple[str, dict]]):
+        """Чтение из таблицы ответов на запросы батча одним запросом query_key = ANY(...)"""
+        if not self.enabled:
+            return
+        wanted = {(source, self._key(query)) for source, query in queries}
+        wanted = {cache_key for cache_key in wanted if cache_key not in self._lru}
+        if not wanted:
+            return
+        if len(self._prefetched) > self.max_size:
+            # Остатки батчей, лиды которых не дошли до запросов
+            self._prefetched.clear()
+        # Оба условия по первичному ключу (source, query_key): выборка идет по индексу
+        sources = bindparam('sources', sorted({source for source, _ in wanted}), type_=ARRAY(Text))
+        query_keys = bindparam('query_keys', sorted({query_key for _, query_key in wanted}), type_=ARRAY(Text))
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(ExternalCache.source, ExternalCache.query_key, ExternalCache.payload, ExternalCache.fetched_at)
+                    .where(ExternalCache.source == any_(sources), ExternalCache.query_key == any_(query_keys))
+                )
+                rows = result.all()
+        except Exception as e:
+            # Без предзагрузки get() прочитает ответы по одному
+            logger.error(f"Ошибка при предзагрузке кэша внешних источников: {e}")
+            return
+
+        found = {}
+        for row in rows:
+            cache_key = (row.source, row.query_key)
+            if cache_key not in wanted:
+                continue
+            if self._is_fresh(row.source, row.fetched_at):
+                found[cache_key] = (json.loads(row.payload), row.fetched_at)
+            else:
+                found[cache_key] = STALE
+        for cache_key in wanted:
+            self._prefetched[cache_key] = found.get(cache_key, MISS)
+
+    def set(self, source: str, query: dict, value):
+        """Сохранение разобранного ответа; в БД попадет при flush()"""
+        if not self.enabled:
+            return
+        cache_key = (source, self._key(query))
+        fetched_at = datetime.now()
+        self._remember(cache_key, value, fetched_at)
+        self._pending[cache_key] = (value, fetched_at)
+
+    async def flush(self):
+        """Запись накопленных ответов в таблицу external_cache"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        rows = [
+            {
+                'source': source,
+                'query_key': query_key,
+                'payload': json.dumps(value, ensure_ascii=False),
+                'fetched_at': fetched_at
+            }
+            for (source, query_key), (value, fetched_at) in pending.items()
+        ]
+        try:
+            async with AsyncSessionLocal() as db:
+                # Частями, чтобы не упереться в лимит параметров запроса
+                for i in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                    stmt = insert(ExternalCache).values(rows[i:i + FLUSH_CHUNK_SIZE])
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=['source', 'query_key'],
+                        set_={'payload': stmt.excluded.payload, 'fetched_at': stmt.excluded.fetched_at}
+                    )
+                    await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении кэша внешних источников: {e}")
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Счетчики попаданий и промахов по источникам"""
+        return {source: dict(counters) for source, counters in self.stats.items()}
@@ -0,0 +1,123 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update, func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.database import AsyncSessionLocal, SessionLocal
+from app.models import FileCheckpoint, PipelineJob
+
+logger = logging.getLogger(__name__)
+
+class JobCheckpoints:
+    """Чекпоинты одного задания: смещения во входных файлах и текущий этап.
+
+    Обогащение и скоринг своих чекпоинтов не ведут: после перезапуска
+    они продолжают по состоянию самих лидов (debt_amount IS NULL и аренда
+    батчей, NEEDS_SCORING), в том числе в потоковом режиме. Нормализация
+    синхронная и пишет через SessionLocal, этап - через AsyncSessionLocal.
+    """
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+
+    def get_file_offset(self, file_name: str, file_size: int) -> Tuple[int, bool]:
+        """Смещение, с которого продолжать файл, и признак его завершения"""
+        with SessionLocal() as db:
+            checkpoint = db.get(FileCheckpoint, (self.job_id, file_name))
+        if checkpoint is None:
+            return 0, False
+        if checkpoint.file_size != file_size:
+            logger.warning(f"Файл {file_name} изменился после чекпоинта, обработка начнется заново")
+            return 0, False
+        return checkpoint.byte_offset, checkpoint.completed
+
+    def save_file_offset(self, file_name: str, file_size: int, byte_offset: int, completed: bool = False):
+        stmt = insert(FileCheckpoint).values(
+            job_id=self.job_id,
+            file_name=file_name,
+            file_size=file_size,
+            byte_offset=byte_offset,
+            completed=completed
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['job_id', 'file_name'],
+            set_={
+                'file_size': stmt.excluded.file_size,
+                'byte_offset': stmt.excluded.byte_offset,
+                'completed': stmt.excluded.completed,
+                'updated_at': func.now()
+            }
+        )
+        with SessionLocal() as db:
+            db.execute(stmt)
+            db.commit()
+
+    async def get_job(self) -> Optional[PipelineJob]:
+        async with AsyncSessionLocal() as db:
+            return await db.get(PipelineJob, self.job_id)
+
+    async def set_stage(self, stage: str):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(PipelineJob).where(PipelineJob.id == self.job_id).values(stage=stage))
+            await db.commit()
+
+
+class ShardTracker:
+    """Продвижение чекпоинтов файлов при параллельной загрузке шардов.
+
+    Шард считается загруженным, когда воркер его дочитал и все его батчи
+    записаны в БД. Смещение файла сдвигается только по непрерывному
+    префиксу загруженных шардов, поэтому после перезапуска ни одна строка
+    не теряется; шард с ошибкой загрузки чекпоинт не пропускает.
+    """
+
+    def __init__(self, checkpoints: Optional[JobCheckpoints]):
+        self.checkpoints = checkpoints
+        self.files: Dict[str, dict] = {}
+        self.expected: Dict[tuple, int] = {}
+        self.loaded = defaultdict(int)
+        self.failed = set()
+        self._lock = threading.Lock()
+
+    def add_file(self, file_name: str, file_size: int, shards: List[Tuple[int, int]]):
+        self.files[file_name] = {'size': file_size, 'shards': shards, 'done': set(), 'next': 0}
+        if not shards and self.checkpoints is not None:
+            self.checkpoints.save_file_offset(file_name, file_size, file_size, completed=True)
+
+    def batch_loaded(self, key: tuple):
+        with self._lock:
+            self.loaded[key] += 1
+            self._advance(key)
+
+    def mark_failed(self, key: tuple):
+        """Шард не нормализован или не загружен хотя бы один его батч"""
+        with self._lock:
+            self.failed.add(key)
+
+    def shard_normalized(self, key: tuple, batches: int):
+        with self._lock:
+            self.expected[key] = batches
+            self._advance(key)
+
+    def failed_files(self) -> set:
+        """Файлы, у которых есть шард с ошибкой нормализации или загрузки"""
+        return {file_name for file_name, _ in self.failed}
+
+    def _advance(self, key: tuple):
+        if key in self.failed or self.expected.get(key) != self.loaded[key]:
+            return
+        file_name, index = key
+        progress = self.files[file_name]
+        progress['done'].add(index)
+        shards = progress['shards']
+        advanced = False
+        while progress['next'] in progress['done']:
+            progress['next'] += 1
+            advanced = True
+        if advanced and self.checkpoints is not None:
+            completed = progress['next'] == len(shards)
+            offset = progress['size'] if completed else shards[progress['next']][0]
+            self.checkpoints.save_file_offset(file_name, progress['size'], offset, completed)
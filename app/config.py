@@ -1,5 +1,5 @@
 import os
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -15,6 +15,97 @@ class Settings(BaseSettings):
     LOGS_PATH: str = "./data/logs"
     BATCH_SIZE: int = 10000
     MAX_CONCURRENT_REQUESTS: int = 50
+    NORMALIZATION_VECTORIZED: bool = True
+    BULK_LOAD_METHOD: str = "copy"  # copy, insert
+    INGESTION_WORKERS: int = 1
+    INGESTION_SHARD_SIZE_MB: int = 64
+    INGESTION_QUEUE_SIZE: int = 8
+    INGESTION_DB_WRITERS: int = 2
+    # Отсев уже загруженных лидов фильтром Блума до записи в БД (память фиксирована, МБ)
+    INGESTION_DEDUP_ENABLED: bool = True
+    INGESTION_DEDUP_BLOOM_MB: int = 256
+    INGESTION_DEDUP_HASHES: int = 7
+    # Сверять срабатывания фильтра с leads. Без сверки повторная загрузка не читает leads,
+    # но новый лид теряется с вероятностью ложного срабатывания (оценка пишется в лог при заполнении)
+    INGESTION_DEDUP_VERIFY: bool = True
+    SCORING_LEAN_FETCH: bool = True
+    # Адреса внешних источников (для локальных замеров - app.mock_sources)
+    SOURCE_URLS: Dict[str, str] = {
+        'fssp': "https://api.fssp.gov.ru/v1/search",
+        'fedresurs': "https://fedresurs.ru/backend/companies",
+        'rosreestr': "https://rosreestr.gov.ru/api/online/fir_objects",
+        'nalog': "https://service.nalog.ru/inn-proc.do",
+        'courts': "https://api.courts.ru/api/search"
+    }
+    # Лимиты одновременных запросов по источникам, для остальных MAX_CONCURRENT_REQUESTS
+    SOURCE_CONCURRENCY: Dict[str, int] = {
+        'fssp': 20,
+        'fedresurs': 10,
+        'rosreestr': 10,
+        'nalog': 10,
+        'courts': 5
+    }
+    CACHE_ENABLED: bool = True
+    CACHE_LRU_SIZE: int = 100000
+    # Время жизни ответов в кэше по источникам, секунды
+    CACHE_TTL: Dict[str, int] = {
+        'fssp': 86400,
+        'fedresurs': 21600,
+        'rosreestr': 604800,
+        'nalog': 604800,
+        'courts': 86400
+    }
+    # Адаптивный лимит частоты запросов на хост (AIMD), запросов в секунду
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_INITIAL_RPS: float = 5.0
+    RATE_LIMIT_MIN_RPS: float = 0.5
+    RATE_LIMIT_MAX_RPS: float = 100.0
+    RATE_LIMIT_INCREASE: float = 1.0  # прирост rps за секунду без 429
+    RATE_LIMIT_DECREASE: float = 0.5  # множитель скорости после 429
+    # Начальная скорость для отдельных хостов, например {"api.fssp.gov.ru": 10}
+    RATE_LIMIT_HOST_RPS: Dict[str, float] = {}
+    # Здоровье прокси: сглаживание EWMA и карантин после ошибок подряд, секунды
+    PROXY_EWMA_ALPHA: float = 0.2
+    PROXY_QUARANTINE_FAILURES: int = 3
+    PROXY_QUARANTINE_BASE: float = 30.0
+    PROXY_QUARANTINE_MAX: float = 900.0
+    # Успешных запросов подряд, после которых уровень карантина (длительность следующего) снижается на один
+    PROXY_QUARANTINE_RECOVERY: int = 20
+    # Продолжать задание остановленного воркера: без heartbeat дольше PIPELINE_JOB_TIMEOUT его берет другой воркер
+    PIPELINE_AUTO_RESUME: bool = True
+    # Очередь заданий: опрос очереди воркером и heartbeat с прогрессом задания, секунды
+    PIPELINE_POLL_INTERVAL: float = 2.0
+    PIPELINE_HEARTBEAT_INTERVAL: float = 5.0
+    PIPELINE_JOB_TIMEOUT: float = 60.0
+    # Брошенное задание продолжается не больше этого числа попыток, затем помечается ошибкой
+    PIPELINE_JOB_MAX_ATTEMPTS: int = 3
+    # Воркер внутри веб-приложения, для локального запуска без python -m app.worker
+    PIPELINE_EMBEDDED_WORKER: bool = False
+    # Потоковый режим: этапы работают одновременно, батчи идут через очереди
+    PIPELINE_STREAMING: bool = False
+    PIPELINE_QUEUE_SIZE: int = 4
+    PIPELINE_ENRICH_WORKERS: int = 2
+    # Обогащение арендованными батчами: воркеры в разных процессах берут лиды через FOR UPDATE SKIP LOCKED,
+    # аренда упавшего воркера истекает через ENRICHMENT_LEASE_SECONDS, после ENRICHMENT_MAX_ATTEMPTS аренд лид пропускается
+    ENRICHMENT_CLAIM_LEASES: bool = True
+    ENRICHMENT_LEASE_SECONDS: float = 300.0
+    ENRICHMENT_MAX_ATTEMPTS: int = 3
+    # Объединение лидов одного человека из разных источников перед обогащением
+    IDENTITY_RESOLUTION_ENABLED: bool = True
+    # Приоритет источников при выборе значений полей канонического лида
+    IDENTITY_SOURCE_PRECEDENCE: List[str] = ['fns', 'gosuslugi', 'bank', 'mfo', 'insurance', 'leads', 'delivery']
+    # Шардирование экспорта: "" - одним COPY, "score" - по диапазонам score, "group" - по группам
+    # (без шардов и по score COPY пишется прямо в итоговый файл; части групп и Parquet идут
+    # через временные файлы, части групп сливаются по score дополнительным проходом в Python)
+    EXPORT_SHARD_BY: str = ""
+    EXPORT_SHARDS: int = 4
+    # Формат выгрузки: csv, csv.gz, csv.zst (пакет zstandard), parquet (пакет pyarrow)
+    EXPORT_FORMAT: str = "csv"
+    EXPORT_COMPRESSION_LEVEL: int = 6
+    EXPORT_PARQUET_ROW_GROUP_SIZE: int = 100000
+    # Отдача выгрузки: размер чанка файла и очередь чанков COPY при скачивании во время экспорта
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+    DOWNLOAD_QUEUE_SIZE: int = 16
 
     class Config:
         env_file = ".env"
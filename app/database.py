@@ -51,4 +51,32 @@ async def get_async_db():
     """Асинхронная сессия для операций чтения"""
     async with AsyncSessionLocal() as session:
         yield session
-        
\ No newline at end of file
+
+async def iter_keyset_batches(db, stmt, key_column, batch_size: int, scalars: bool = False):
+    """Постраничный обход выборки по ключу (key > последний ключ) вместо OFFSET"""
+    last_key = None
+    while True:
+        page = stmt
+        if last_key is not None:
+            page = page.where(key_column > last_key)
+        result = await db.execute(page.order_by(key_column).limit(batch_size))
+        rows = result.scalars().all() if scalars else result.all()
+        if not rows:
+            break
+        yield rows
+        if len(rows) < batch_size:
+            break
+        last_key = getattr(rows[-1], key_column.key)
+
+async def stream_batches(stmt, key_column, batch_size: int):
+    """Потоковое чтение выборки серверным курсором на отдельном соединении.
+
+    Курсор живет в своей транзакции, поэтому запись результатов может
+    идти в другой сессии и коммититься по батчам.
+    """
+    async with async_engine.connect() as conn:
+        result = await conn.stream(
+            stmt.order_by(key_column).execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions(batch_size):
+            yield rows
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import List
+
+import numpy as np
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+SELECT_EXISTING = text("SELECT lead_id FROM leads WHERE lead_id = ANY(:lead_ids)")
+
+# Число единичных битов в байте, для оценки заполненности фильтра
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _digest(lead_id: str) -> bytes:
+    """16 байт хеша lead_id: lead_id из нормализации уже md5 в hex"""
+    if len(lead_id) == 32:
+        try:
+            return bytes.fromhex(lead_id)
+        except ValueError:
+            pass
+    return hashlib.md5(lead_id.encode('utf-8')).digest()
+
+
+class BloomFilter:
+    """Блочный фильтр Блума фиксированного размера по lead_id.
+
+    Все биты ключа лежат в одном 64-битном слове: на ключ одно обращение
+    к памяти, а батч обновляется векторно. Слово выбирает первая половина
+    md5, номера битов - 6-битные куски второй половины.
+    """
+
+    def __init__(self, size_mb: int, hashes: int):
+        words = 1 << max(0, (size_mb * 1024 * 1024 // 8).bit_length() - 1)
+        self.words = np.zeros(words, dtype=np.uint64)
+        self.word_mask = np.uint64(words - 1)
+        self.shifts = np.arange(min(hashes, 10), dtype=np.uint64) * np.uint64(6)
+
+    def _positions(self, lead_ids: List[str]):
+        digests = np.frombuffer(b''.join(_digest(lead_id) for lead_id in lead_ids), dtype='>u8')
+        digests = digests.reshape(-1, 2).astype(np.uint64)
+        words = (digests[:, 0] & self.word_mask).astype(np.int64)
+        bits = (digests[:, 1:2] >> self.shifts) & np.uint64(63)
+        masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), bits), axis=1)
+        return words, masks
+
+    def add(self, lead_ids: List[str]):
+        if not lead_ids:
+            return
+        words, masks = self._positions(lead_ids)
+        # Маски одного слова объединяются заранее: присваивание по индексам их бы потеряло
+        order = np.argsort(words)
+        words, masks = words[order], masks[order]
+        starts = np.flatnonzero(np.r_[True, words[1:] != words[:-1]])
+        self.words[words[starts]] |= np.bitwise_or.reduceat(masks, starts)
+
+    def contains(self, lead_ids: List[str]) -> np.ndarray:
+        if not lead_ids:
+            return np.zeros(0, dtype=bool)
+        words, masks = self._positions(lead_ids)
+        return (self.words[words] & masks) == masks
+
+    def false_positive_rate(self, chunk_words: int = 1 << 22) -> float:
+        """Оценка доли ложных срабатываний по заполненности слов: среднее (бит в слове / 64)^k"""
+        hashes = len(self.shifts)
+        total = 0.0
+        for start in range(0, len(self.words), chunk_words):
+            chunk = self.words[start:start + chunk_words].view(np.uint8)
+            bits = _BYTE_POPCOUNT[chunk].reshape(-1, 8).sum(axis=1, dtype=np.float64)
+            total += np.power(bits / 64, hashes).sum()
+        return total / len(self.words)
+
+
+class DuplicateFilter:
+    """Отсев уже загруженных лидов до записи в БД.
+
+    Фильтр заполняется lead_id из leads и lead_id каждого прошедшего
+    батча. Отрицательный ответ фильтра точен; положительные проверяются
+    запросом одних ключей к leads, поэтому ложное срабатывание или
+    незагруженный батч не теряют новых лидов.
+
+    Цена точности: при повторной загрузке почти все лиды положительные,
+    и сверка читает leads по каждому батчу, а заполнение в начале каждой
+    загрузки читает все lead_id (время пишется в лог и stats). С
+    INGESTION_DEDUP_VERIFY=false положительные отбрасываются без сверки:
+    чтений leads во время загрузки нет, но доля новых лидов, равная
+    оценке ложных срабатываний, теряется, как и лиды батча, запись
+    которого упала после проверки фильтром.
+    """
+
+    def __init__(self):
+        self.bloom = BloomFilter(settings.INGESTION_DEDUP_BLOOM_MB, settings.INGESTION_DEDUP_HASHES)
+        self.lock = threading.Lock()
+        self.verify = settings.INGESTION_DEDUP_VERIFY
+        self.stats = {
+            'seeded': 0,
+            'seed_seconds': 0.0,
+            'estimated_fp_rate': 0.0,
+            'checked': 0,
+            'filtered': 0,
+            'batch_duplicates': 0,
+            'verified': 0,
+            'false_positives': 0
+        }
+
+    def seed(self, fetch_size: int = 100000):
+        """Заполнение фильтра lead_id из leads серверным курсором"""
+        started = time.perf_counter()
+        conn = engine.raw_connection()
+        try:
+            with conn.cursor(name='dedup_seed') as cursor:
+                cursor.itersize = fetch_size
+                cursor.execute("SELECT lead_id FROM leads")
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    self.bloom.add([row[0] for row in rows])
+                    self.stats['seeded'] += len(rows)
+            conn.rollback()
+        finally:
+            conn.close()
+        self.stats['seed_seconds'] = round(time.perf_counter() - started, 2)
+        self.stats['estimated_fp_rate'] = self.bloom.false_positive_rate()
+        logger.info(
+            f"Фильтр дублей заполнен: {self.stats['seeded']} lead_id "
+            f"за {self.stats['seed_seconds']:.1f} с, оценка ложных срабатываний "
+            f"{self.stats['estimated_fp_rate']:.2e}" + ("" if self.verify else " (без сверки с БД)")
+        )
+
+    def _existing(self, lead_ids: List[str]) -> set:
+        with engine.connect() as conn:
+            result = conn.execute(SELECT_EXISTING, {'lead_ids': lead_ids})
+            return {row[0] for row in result}
+
+    def filter(self, leads: list) -> list:
+        """Лиды батча, которых еще нет в leads"""
+        unique = {}
+        for lead in leads:
+            unique.setdefault(lead['lead_id'], lead)
+        lead_ids = list(unique)
+
+        with self.lock:
+            seen = self.bloom.contains(lead_ids)
+            self.bloom.add([lead_id for lead_id, found in zip(lead_ids, seen) if not found])
+        positives = [lead_id for lead_id, found in zip(lead_ids, seen) if found]
+        if not self.verify:
+            existing = set(positives)
+        else:
+            existing = self._existing(positives) if positives else set()
+
+        batch_duplicates = len(leads) - len(lead_ids)
+        with self.lock:
+            self.stats['checked'] += len(leads)
+            self.stats['batch_duplicates'] += batch_duplicates
+            self.stats['filtered'] += batch_duplicates + len(existing)
+            if self.verify:
+                self.stats['verified'] += len(positives)
+                self.stats['false_positives'] += len(positives) - len(existing)
+        if not existing:
+            return list(unique.values())
+        return [lead for lead_id, lead in unique.items() if lead_id not in existing]
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+import aiofiles
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.config import settings
+from app.database import async_engine
+from app.export import EXPORT_FORMATS, EXPORT_HEADER, EXPORT_SELECT
+
+logger = logging.getLogger(__name__)
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Форматы, которые можно сжимать на лету во время скачивания; Parquet пишется только /export
+LIVE_FORMATS = ('csv', 'csv.gz', 'csv.zst')
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Диапазон [start, end] из заголовка Range или None для всего файла.
+
+    Поддерживается один диапазон; несколько диапазонов отдаются целым
+    файлом, как разрешает RFC 9110.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: последние N байт
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(416, headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+
+def accepts_gzip(request: Request) -> bool:
+    return 'gzip' in request.headers.get('accept-encoding', '').lower()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Сжатие потока в gzip на лету"""
+    compressor = zlib.compressobj(settings.EXPORT_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def zstd_chunks(chunks: AsyncIterator[bytes], compressor) -> AsyncIterator[bytes]:
+    """Сжатие потока в zstd на лету"""
+    stream = compressor.compressobj()
+    async for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.flush()
+
+
+async def iter_file(path: Path, start: int, length: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(settings.DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: str, filename: str, media_type: str) -> Response:
+    """Отдача готовой выгрузки с Range, If-Range и сжатием gzip для несжатых форматов"""
+    path = Path(path)
+    if not path.exists():
+        raise HTTPException(404, "Файл результатов не найден")
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    }
+
+    byte_range = parse_range(request.headers.get('range'), size)
+    if_range = request.headers.get('if-range')
+    if byte_range and if_range and if_range != etag:
+        # Файл изменился с начала скачивания: отдаем заново целиком
+        byte_range = None
+
+    if byte_range:
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file(path, start, end - start + 1), status_code=206,
+            media_type=media_type, headers=headers
+        )
+
+    if media_type == 'text/csv' and accepts_gzip(request):
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        return StreamingResponse(gzip_chunks(iter_file(path, 0, size)), media_type=media_type, headers=headers)
+
+    headers['Content-Length'] = str(size)
+    return StreamingResponse(iter_file(path, 0, size), media_type=media_type, headers=headers)
+
+
+async def iter_live_export() -> AsyncIterator[bytes]:
+    """CSV целевых лидов прямо из COPY на соединении asyncpg.
+
+    Чанки COPY передаются через ограниченную очередь: медленный клиент
+    останавливает чтение из базы, а отключение клиента отменяет COPY.
+    """
+    queue = asyncio.Queue(maxsize=settings.DOWNLOAD_QUEUE_SIZE)
+    done = object()
+
+    async def copy():
+        try:
+            async with async_engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_from_query(
+                    f"{EXPORT_SELECT} ORDER BY score DESC", output=queue.put, format='csv'
+                )
+        except asyncio.CancelledError:
+            # Клиент отключился: маркер конца читать некому, а полная очередь заблокировала бы отмену
+            raise
+        except Exception:
+            await queue.put(done)
+            raise
+        await queue.put(done)
+
+    yield (','.join(EXPORT_HEADER) + '\n').encode('utf-8')
+    task = asyncio.create_task(copy())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            yield chunk
+        # Ошибка COPY доходит до клиента обрывом ответа
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+            # Соединение возвращается в пул после остановки COPY
+            await asyncio.gather(task, return_exceptions=True)
+
+
+def live_export_response(request: Request, export_format: str = 'csv') -> Response:
+    """Выгрузка, которая формируется во время скачивания (без Range)"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Неизвестный формат экспорта: {export_format}")
+    if export_format not in LIVE_FORMATS:
+        raise HTTPException(400, f"Формат {export_format} не выгружается во время скачивания, запустите /export")
+    filename, media_type = EXPORT_FORMATS[export_format]
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    chunks = iter_live_export()
+    if export_format == 'csv.gz':
+        chunks = gzip_chunks(chunks)
+    elif export_format == 'csv.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise HTTPException(400, "Для формата csv.zst нужен пакет zstandard")
+        chunks = zstd_chunks(chunks, zstandard.ZstdCompressor(level=settings.EXPORT_COMPRESSION_LEVEL))
+    elif accepts_gzip(request):
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        chunks = gzip_chunks(chunks)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
@@ -0,0 +1,373 @@
+import csv
+import gzip
+import heapq
+import logging
+import math
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from app.config import settings
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADER = ['phone', 'fio', 'score', 'reason_1', 'reason_2', 'reason_3', 'group']
+
+# Формат выгрузки: имя файла и тип содержимого для /download
+EXPORT_FORMATS = {
+    'csv': ('scoring_ready.csv', 'text/csv'),
+    'csv.gz': ('scoring_ready.csv.gz', 'application/gzip'),
+    'csv.zst': ('scoring_ready.csv.zst', 'application/zstd'),
+    'parquet': ('scoring_ready.parquet', 'application/vnd.apache.parquet'),
+}
+
+EXPORT_SELECT = (
+    "SELECT phone, fio, score, reason_1, reason_2, reason_3, group_name AS group "
+    "FROM leads WHERE is_target = TRUE"
+)
+
+
+class _ShardPipe:
+    """Вывод COPY одного шарда, который пишется в итоговый файл в свою очередь.
+
+    copy_expert пишет в pipe из потока шарда, поток выгрузки читает
+    шарды по порядку. Очередь ограничена: шард, до которого очередь
+    еще не дошла, останавливает COPY, а выборка и сортировка в базе
+    у всех шардов идут параллельно.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    QUEUE_SIZE = 8
+    _END = object()
+
+    def __init__(self, stop_event: threading.Event):
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.buffer = bytearray()
+        self.stop_event = stop_event
+        # Ставится, когда поток выгрузки больше не читает: COPY шарда прерывается
+        self.closed = threading.Event()
+
+    def _put(self, item):
+        while True:
+            if self.closed.is_set() or self.stop_event.is_set():
+                raise RuntimeError("экспорт остановлен")
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data: bytes):
+        # copy_expert пишет по строке, в очередь идут чанки
+        self.buffer += data
+        if len(self.buffer) >= self.CHUNK_SIZE:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def finish(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        self._put(self._END)
+
+    def fail(self, error: BaseException):
+        try:
+            self._put(error)
+        except RuntimeError:
+            pass
+
+    def read_into(self, out):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    raise RuntimeError("экспорт остановлен")
+                continue
+            if item is self._END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            out.write(item)
+
+
+class TargetLeadsExporter:
+    """Выгрузка целевых лидов через COPY (SELECT ...) TO STDOUT прямо в файл.
+
+    Работает синхронно на соединениях psycopg2 и вызывается вне цикла
+    событий (asyncio.to_thread). При шардировании по диапазонам score или
+    по group_name каждый шард выгружается своим соединением, все
+    соединения читают один снимок данных (pg_export_snapshot). Вывод COPY
+    без шардов и шарды по score пишутся прямо в итоговый файл, шарды
+    по score - подряд по убыванию score. Части во временных файлах нужны
+    только для Parquet и для шардов по группам, которые сливаются по score:
+    в обоих случаях файл идет по убыванию score.
+    """
+
+    def __init__(self, shard_by: Optional[str] = None, shards: Optional[int] = None,
+                 export_format: Optional[str] = None):
+        self.shard_by = shard_by if shard_by is not None else settings.EXPORT_SHARD_BY
+        self.shards = shards or settings.EXPORT_SHARDS
+        self.export_format = export_format or settings.EXPORT_FORMAT
+        if self.shard_by not in ('', 'score', 'group'):
+            raise ValueError(f"Неизвестный способ шардирования экспорта: {self.shard_by}")
+        if self.export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат экспорта: {self.export_format}")
+        # Отмена задания: выгрузка прерывается между частями и не заменяет итоговый файл
+        self.stop_event = threading.Event()
+
+    def _check_stopped(self):
+        if self.stop_event.is_set():
+            raise RuntimeError("экспорт остановлен")
+
+    def _copy(self, conn, query: str, params: tuple, out) -> int:
+        """COPY одного запроса в файловый объект, возвращает число строк"""
+        with conn.cursor() as cursor:
+            copy_sql = cursor.mogrify(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", params or None).decode('utf-8')
+            cursor.copy_expert(copy_sql, out)
+            return cursor.rowcount
+
+    def _score_shards(self, conn) -> List[Tuple[str, tuple]]:
+        """Диапазоны score с примерно равным числом лидов, от больших к меньшим"""
+        fractions = [i / self.shards for i in range(1, self.shards)]
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY score) "
+                "FROM leads WHERE is_target = TRUE",
+                (fractions,)
+            )
+            bounds = sorted(set(b for b in (cursor.fetchone()[0] or []) if b is not None))
+        edges = [None] + bounds + [None]
+        shards = []
+        for low, high in zip(edges, edges[1:]):
+            conditions, params = [], []
+            if low is not None:
+                conditions.append("score >= %s")
+                params.append(low)
+            if high is not None:
+                conditions.append("score < %s")
+                params.append(high)
+            where = f" AND {' AND '.join(conditions)}" if conditions else ""
+            shards.append((f"{EXPORT_SELECT}{where} ORDER BY score DESC", tuple(params)))
+        return list(reversed(shards))
+
+    def _group_shards(self, conn) -> List[Tuple[str, tuple]]:
+        """По шарду на группу A/B-теста"""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT group_name FROM leads WHERE is_target = TRUE ORDER BY group_name")
+            groups = [row[0] for row in cursor.fetchall()]
+        return [
+            (f"{EXPORT_SELECT} AND group_name IS NOT DISTINCT FROM %s ORDER BY score DESC", (group,))
+            for group in groups
+        ]
+
+    def _begin_snapshot(self, conn, snapshot: Optional[str] = None):
+        """Транзакция только для чтения на общем снимке данных.
+
+        Уровень задается SET TRANSACTION, чтобы соединение вернулось
+        в пул без измененных настроек сессии.
+        """
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            if snapshot:
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+
+    def _copy_shard(self, snapshot: str, query: str, params: tuple, out) -> int:
+        self._check_stopped()
+        conn = engine.raw_connection()
+        try:
+            self._begin_snapshot(conn, snapshot)
+            rows = self._copy(conn, query, params, out)
+            conn.rollback()
+            return rows
+        finally:
+            conn.close()
+
+    def _copy_shard_to_file(self, snapshot: str, query: str, params: tuple, path: Path) -> int:
+        with open(path, 'wb') as f:
+            return self._copy_shard(snapshot, query, params, f)
+
+    def _copy_shard_to_pipe(self, snapshot: str, query: str, params: tuple, pipe: _ShardPipe) -> int:
+        try:
+            rows = self._copy_shard(snapshot, query, params, pipe)
+            pipe.finish()
+            return rows
+        except BaseException as e:
+            pipe.fail(e)
+            raise
+
+    def _copy_shards_into(self, snapshot: str, shards: List[Tuple[str, tuple]], out) -> int:
+        """Шарды параллельно, в out - подряд в порядке шардов"""
+        pipes = [_ShardPipe(self.stop_event) for _ in shards]
+        with ThreadPoolExecutor(max_workers=max(len(shards), 1)) as pool:
+            futures = [
+                pool.submit(self._copy_shard_to_pipe, snapshot, query, params, pipe)
+                for (query, params), pipe in zip(shards, pipes)
+            ]
+            try:
+                for pipe in pipes:
+                    pipe.read_into(out)
+            finally:
+                # После ошибки шарды, ждущие места в очереди, прерывают COPY
+                for pipe in pipes:
+                    pipe.closed.set()
+            return sum(future.result() for future in futures)
+
+    def _copy_shards_to_parts(self, snapshot: str, shards: List[Tuple[str, tuple]], parts: List[Path]) -> int:
+        with ThreadPoolExecutor(max_workers=max(len(shards), 1)) as pool:
+            counts = pool.map(
+                lambda args: self._copy_shard_to_file(snapshot, *args),
+                [(query, params, part) for (query, params), part in zip(shards, parts)]
+            )
+            return sum(counts)
+
+    def _open_output(self, path: Path):
+        """Файл для записи CSV с учетом сжатия"""
+        if self.export_format == 'csv.gz':
+            return gzip.open(path, 'wb', compresslevel=settings.EXPORT_COMPRESSION_LEVEL)
+        if self.export_format == 'csv.zst':
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError("Для формата csv.zst нужен пакет zstandard")
+            return zstandard.ZstdCompressor(level=settings.EXPORT_COMPRESSION_LEVEL).stream_writer(open(path, 'wb'))
+        return open(path, 'wb')
+
+    @staticmethod
+    def _iter_records(path: Path) -> Iterator[Tuple[float, bytes]]:
+        """Записи CSV-части как есть, с их score; NULL идет первым, как в ORDER BY score DESC"""
+        with open(path, 'rb') as f:
+            record, quotes = b'', 0
+            for line in f:
+                record += line
+                # Нечетное число кавычек - перевод строки внутри значения, запись продолжается
+                quotes += line.count(b'"')
+                if quotes % 2:
+                    continue
+                score = next(csv.reader([record.decode('utf-8')]))[2]
+                yield (float(score) if score else math.inf), record
+                record, quotes = b'', 0
+
+    def _merge_by_score(self, parts: List[Path], out):
+        """Слияние частей, каждая из которых отсортирована по убыванию score"""
+        records = heapq.merge(*(self._iter_records(part) for part in parts), key=lambda r: r[0], reverse=True)
+        for i, (_, record) in enumerate(records):
+            if i % 100000 == 0:
+                self._check_stopped()
+            out.write(record)
+
+    def _write_parquet(self, parts: List[Path], path: Path):
+        """Parquet из CSV-частей; части идут по убыванию score, поэтому и группы строк тоже"""
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для формата parquet нужен пакет pyarrow")
+
+        schema = pa.schema([
+            ('phone', pa.string()),
+            ('fio', pa.string()),
+            ('score', pa.float64()),
+            ('reason_1', pa.string()),
+            ('reason_2', pa.string()),
+            ('reason_3', pa.string()),
+            ('group', pa.string()),
+        ])
+        read_options = pa_csv.ReadOptions(column_names=EXPORT_HEADER)
+        convert_options = pa_csv.ConvertOptions(
+            column_types=schema,
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False
+        )
+        row_group_size = settings.EXPORT_PARQUET_ROW_GROUP_SIZE
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            # Батчи копятся до размера группы строк, чтобы группы были ровными
+            pending, pending_rows = [], 0
+            for part in parts:
+                self._check_stopped()
+                if part.stat().st_size == 0:
+                    continue
+                reader = pa_csv.open_csv(part, read_options=read_options, convert_options=convert_options)
+                for batch in reader:
+                    pending.append(batch)
+                    pending_rows += batch.num_rows
+                    while pending_rows >= row_group_size:
+                        table = pa.Table.from_batches(pending, schema)
+                        writer.write_table(table.slice(0, row_group_size), row_group_size=row_group_size)
+                        rest = table.slice(row_group_size)
+                        pending, pending_rows = rest.to_batches(), rest.num_rows
+            if pending_rows:
+                writer.write_table(pa.Table.from_batches(pending, schema), row_group_size=row_group_size)
+
+    def export(self, output_path: Path) -> int:
+        """Выгрузка в output_path через временный файл, возвращает число строк.
+
+        Временные файлы у каждой выгрузки свои: прерванная выгрузка
+        не удаляет и не перезаписывает части следующей.
+        """
+        output_path = Path(output_path)
+        prefix = f"{output_path.name}.{uuid.uuid4().hex[:8]}"
+        temp_path = output_path.with_name(f"{prefix}.tmp")
+        parts = []
+        conn = engine.raw_connection()
+        try:
+            snapshot = None
+            shards = [(f"{EXPORT_SELECT} ORDER BY score DESC", ())]
+            if self.shard_by and self.shards >= 2:
+                # Снимок держит эта транзакция, пока шарды не выгружены
+                self._begin_snapshot(conn)
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_export_snapshot()")
+                    snapshot = cursor.fetchone()[0]
+                shards = self._score_shards(conn) if self.shard_by == 'score' else self._group_shards(conn)
+
+            # Части по группам пересекаются по score и идут в файл через слияние,
+            # Parquet читает CSV из файлов; в остальных случаях COPY пишет прямо в итоговый файл
+            merge = self.shard_by == 'group' and len(shards) > 1
+            if self.export_format == 'parquet' or merge:
+                parts = [output_path.with_name(f"{prefix}.part{i}") for i in range(len(shards))]
+                if snapshot is None:
+                    with open(parts[0], 'wb') as f:
+                        rows = self._copy(conn, *shards[0], f)
+                else:
+                    rows = self._copy_shards_to_parts(snapshot, shards, parts)
+                conn.rollback()
+                if self.export_format == 'parquet':
+                    sources = parts
+                    if merge:
+                        merged = output_path.with_name(f"{prefix}.merged")
+                        with open(merged, 'wb') as out:
+                            self._merge_by_score(parts, out)
+                        sources = [merged]
+                        parts.append(merged)
+                    self._write_parquet(sources, temp_path)
+                else:
+                    with self._open_output(temp_path) as out:
+                        out.write((','.join(EXPORT_HEADER) + '\n').encode('utf-8'))
+                        self._merge_by_score(parts, out)
+            else:
+                with self._open_output(temp_path) as out:
+                    out.write((','.join(EXPORT_HEADER) + '\n').encode('utf-8'))
+                    if snapshot is None:
+                        rows = self._copy(conn, *shards[0], out)
+                    else:
+                        rows = self._copy_shards_into(snapshot, shards, out)
+                conn.rollback()
+            self._check_stopped()
+            os.replace(temp_path, output_path)
+            logger.info(
+                f"Выгружено {rows} целевых лидов в {output_path} "
+                f"({self.export_format}, {len(shards)} шардов, {len(parts)} временных частей)"
+            )
+            return rows
+        finally:
+            conn.close()
+            for path in parts + [temp_path]:
+                if path.exists():
+                    path.unlink()
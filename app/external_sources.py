@@ -2,27 +2,63 @@ import aiohttp
 import asyncio
 import random
 import logging
-from sqlalchemy import text
+from sqlalchemy import text, select
 from typing import Dict, List, Optional
 from fake_useragent import UserAgent
 from app.config import settings
-from app.database import AsyncSessionLocal
+from app.database import AsyncSessionLocal, iter_keyset_batches
 from app.models import Lead, ErrorLog
+from app.cache import SourceCache, MISS
+from app.rate_limiter import rate_limiter, parse_retry_after
+from app.proxy_pool import proxy_pool, PROXY_FAILURE_STATUSES
 import backoff
 import json
+import time
+import statistics
+from collections import defaultdict
 from datetime import datetime, timedelta
 import re
 
 logger = logging.getLogger(__name__)
 
+# Размер выборки задержек обогащения лида для расчета перцентилей
+LATENCY_SAMPLE_SIZE = 100000
+
+
+class TooManyRequestsError(aiohttp.ClientError):
+    """Ответ 429 от источника; повторяется после паузы лимитера"""
+
+
+class ProxyFailureError(aiohttp.ClientError):
+    """Отказ прокси; повтор пойдет через другой прокси из пула"""
+
+
+def _count_retry(details: dict):
+    """Учет повторной попытки запроса (обработчик backoff)"""
+    args, kwargs = details['args'], details['kwargs']
+    source = args[3] if len(args) > 3 else kwargs.get('source')
+    args[0].request_stats[source]['retries'] += 1
+
+
 class ExternalDataEnricher:
     def __init__(self):
         self.ua = UserAgent()
         self.proxies = self._load_proxies()
+        proxy_pool.load(self.proxies)
         self.session = None
-        self.semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_REQUESTS)
+        # Свой лимит на каждый источник: медленный источник не занимает слоты остальных
+        self.semaphores = defaultdict(
+            lambda: asyncio.Semaphore(settings.MAX_CONCURRENT_REQUESTS),
+            {source: asyncio.Semaphore(limit) for source, limit in settings.SOURCE_CONCURRENCY.items()}
+        )
         self.batch_size = settings.BATCH_SIZE
         self.total_enriched = 0
+        self.cache = SourceCache()
+        self.lead_latencies = []
+        self.latency_count = 0
+        self.request_stats = defaultdict(lambda: defaultdict(int))
+        # Выполняющиеся запросы по (адрес, параметры) для объединения одинаковых
+        self.in_flight: Dict[tuple, asyncio.Future] = {}
 
     def _load_proxies(self) -> List[str]:
         """Загрузка списка прокси"""
@@ -35,7 +71,8 @@ class ExternalDataEnricher:
         if self.session is None or self.session.closed:
             headers = {'User-Agent': self.ua.random}
             
-            connector = aiohttp.TCPConnector(limit_per_host=20)
+            limits = list(settings.SOURCE_CONCURRENCY.values()) or [settings.MAX_CONCURRENT_REQUESTS]
+            connector = aiohttp.TCPConnector(limit=sum(limits), limit_per_host=max(limits))
             timeout = aiohttp.ClientTimeout(total=settings.REQUEST_TIMEOUT)
             
             self.session = aiohttp.ClientSession(
@@ -47,26 +84,101 @@ class ExternalDataEnricher:
 
     @backoff.on_exception(backoff.expo,
                           (aiohttp.ClientError, asyncio.TimeoutError),
-                          max_tries=settings.MAX_RETRIES)
-    async def safe_request(self, url: str, params: dict) -> dict:
+                          max_tries=settings.MAX_RETRIES,
+                          on_backoff=_count_retry)
+    async def safe_request(self, url: str, params: dict, source: str = None) -> dict:
         """Безопасный запрос с повторными попытками"""
-        async with self.semaphore:
+        bucket = rate_limiter.get(url) if settings.RATE_LIMIT_ENABLED else None
+        if bucket:
+            await bucket.acquire()
+        async with self.semaphores[source]:
             session = await self._get_session()
-            proxy = random.choice(self.proxies) if settings.PROXY_ROTATION_ENABLED and self.proxies else None
+            proxy = proxy_pool.choose() if settings.PROXY_ROTATION_ENABLED else None
+            stats = self.request_stats[source]
+            stats['requests'] += 1
+            started = time.perf_counter()
             
             try:
                 async with session.get(url, params=params, proxy=proxy) as response:
+                    if proxy and response.status in PROXY_FAILURE_STATUSES:
+                        proxy_pool.report_failure(proxy)
+                        raise ProxyFailureError(f"Proxy error {response.status}")
+                    proxy_pool.report_success(proxy, time.perf_counter() - started)
                     if response.status == 200:
+                        if bucket:
+                            bucket.on_success()
                         return await response.json()
                     elif response.status == 429:
-                        await asyncio.sleep(random.uniform(1, 3))
-                        raise Exception("Too many requests")
+                        stats['throttled'] += 1
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        if bucket:
+                            bucket.on_throttle(retry_after)
+                        else:
+                            await asyncio.sleep(retry_after or random.uniform(1, 3))
+                        raise TooManyRequestsError("Too many requests")
                     else:
                         raise Exception(f"HTTP error {response.status}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                proxy_pool.report_failure(proxy)
+                stats['errors'] += 1
+                logger.warning(f"Ошибка запроса к {url} через {proxy or 'прямое соединение'}: {e}")
+                raise
             except Exception as e:
+                stats['errors'] += 1
                 logger.warning(f"Ошибка запроса к {url}: {e}")
                 raise
 
+    async def cached_request(self, source: str, url: str, params: dict, parse):
+        """Запрос к источнику; одинаковые одновременные запросы выполняются один раз"""
+        key = (url, json.dumps(params, sort_keys=True, ensure_ascii=False))
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._cached_fetch(source, url, params, parse))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.request_stats[source]['deduplicated'] += 1
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    async def _cached_fetch(self, source: str, url: str, params: dict, parse):
+        """Запрос к источнику с кэшированием разобранного ответа"""
+        result = await self.cache.get(source, params)
+        if result is MISS:
+            result = parse(await self.safe_request(url, params, source))
+            self.cache.set(source, params, result)
+        return result
+
+    @staticmethod
+    def _fssp_query(inn: str = None, fio: str = None, dob: str = None) -> Optional[dict]:
+        """Параметры запроса к ФССП: по ИНН, иначе по ФИО и дате рождения"""
+        if inn:
+            return {'inn': inn}
+        if fio and dob:
+            return {'fio': fio, 'dob': dob}
+        return None
+
+    @staticmethod
+    def _court_query(fio: str) -> Optional[dict]:
+        """Параметры поиска судебных приказов: фамилия и инициалы"""
+        name_parts = fio.split()
+        if len(name_parts) < 2:
+            return None
+        search_name = f"{name_parts[0]} {name_parts[1][0]}."
+        if len(name_parts) > 2:
+            search_name += f".{name_parts[2][0]}."
+        return {'query': search_name, 'type': 'individual'}
+
+    def _lead_queries(self, lead: Lead) -> List[tuple]:
+        """Запросы (источник, параметры), которые enrich_lead_data сделает для лида"""
+        queries = [
+            ('fssp', self._fssp_query(lead.inn, lead.fio, lead.dob.strftime('%Y-%m-%d') if lead.dob else None)),
+            ('courts', self._court_query(lead.fio))
+        ]
+        if lead.inn:
+            queries += [(source, {'inn': lead.inn}) for source in ('fedresurs', 'rosreestr', 'nalog')]
+        return [(source, query) for source, query in queries if query]
+
     async def enrich_fssp_data(self, inn: str = None, fio: str = None, dob: str = None) -> Dict:
         """Обогащение данными из ФССП"""
         result = {
@@ -78,23 +190,16 @@ class ExternalDataEnricher:
         }
         
         try:
-            # Формируем запрос
-            search_params = {}
-            if inn:
-                search_params['inn'] = inn
-            elif fio and dob:
-                search_params['fio'] = fio
-                search_params['dob'] = dob
-            
+            search_params = self._fssp_query(inn, fio, dob)
             if not search_params:
                 return result
                 
-            data = await self.safe_request(
-                "https://api.fssp.gov.ru/v1/search",
-                search_params
+            return await self.cached_request(
+                'fssp',
+                settings.SOURCE_URLS['fssp'],
+                search_params,
+                self._parse_fssp_response
             )
-            
-            return self._parse_fssp_response(data)
         except Exception as e:
             logger.error(f"Ошибка при обращении к ФССП: {e}")
             return result
@@ -146,12 +251,12 @@ class ExternalDataEnricher:
     async def check_fedresurs_bankruptcy(self, inn: str) -> bool:
         """Проверка банкротства через Федресурс"""
         try:
-            data = await self.safe_request(
-                "https://fedresurs.ru/backend/companies",
-                {'inn': inn}
+            return await self.cached_request(
+                'fedresurs',
+                settings.SOURCE_URLS['fedresurs'],
+                {'inn': inn},
+                self._parse_fedresurs_response
             )
-            
-            return self._parse_fedresurs_response(data)
         except Exception as e:
             logger.error(f"Ошибка при проверке Федресурс: {e}")
             return False
@@ -167,12 +272,12 @@ class ExternalDataEnricher:
     async def check_rosreestr_property(self, inn: str) -> bool:
         """Проверка недвижимости через Росреестр"""
         try:
-            data = await self.safe_request(
-                "https://rosreestr.gov.ru/api/online/fir_objects",
-                {'inn': inn}
+            return await self.cached_request(
+                'rosreestr',
+                settings.SOURCE_URLS['rosreestr'],
+                {'inn': inn},
+                lambda data: len(data.get('objects', [])) > 0
             )
-            
-            return len(data.get('objects', [])) > 0
         except Exception as e:
             logger.error(f"Ошибка при проверке Росреестр: {e}")
             return False
@@ -180,21 +285,16 @@ class ExternalDataEnricher:
     async def check_court_orders(self, fio: str) -> bool:
         """Проверка судебных приказов"""
         try:
-            # Упрощенное имя для поиска (только фамилия и инициалы)
-            name_parts = fio.split()
-            if len(name_parts) < 2:
+            search_params = self._court_query(fio)
+            if not search_params:
                 return False
-                
-            search_name = f"{name_parts[0]} {name_parts[1][0]}."
-            if len(name_parts) > 2:
-                search_name += f".{name_parts[2][0]}."
-                
-            data = await self.safe_request(
-                "https://api.courts.ru/api/search",
-                {'query': search_name, 'type': 'individual'}
+
+            return await self.cached_request(
+                'courts',
+                settings.SOURCE_URLS['courts'],
+                search_params,
+                self._parse_court_response
             )
-            
-            return self._parse_court_response(data)
         except Exception as e:
             logger.error(f"Ошибка при проверке судебных приказов: {e}")
             return False
@@ -214,41 +314,76 @@ class ExternalDataEnricher:
     async def check_inn_status(self, inn: str) -> bool:
         """Проверка статуса ИНН"""
         try:
-            data = await self.safe_request(
-                "https://service.nalog.ru/inn-proc.do",
-                {'inn': inn}
+            return await self.cached_request(
+                'nalog',
+                settings.SOURCE_URLS['nalog'],
+                {'inn': inn},
+                lambda data: data.get('status') == 'active'
             )
-            
-            return data.get('status') == 'active'
         except Exception as e:
             logger.error(f"Ошибка при проверке ИНН: {e}")
             return True  # По умолчанию считаем активным
     
+    def _record_latency(self, seconds: float):
+        """Учет задержки обогащения лида (выборка фиксированного размера)"""
+        self.latency_count += 1
+        if len(self.lead_latencies) < LATENCY_SAMPLE_SIZE:
+            self.lead_latencies.append(seconds)
+        else:
+            index = random.randrange(self.latency_count)
+            if index < LATENCY_SAMPLE_SIZE:
+                self.lead_latencies[index] = seconds
+
+    def get_request_stats(self) -> Dict[str, dict]:
+        """Счетчики запросов, ошибок, 429, повторов и объединенных запросов по источникам"""
+        return {source: dict(counters) for source, counters in self.request_stats.items()}
+
+    def get_latency_stats(self) -> Dict[str, float]:
+        """p50/p95 задержки обогащения одного лида, мс"""
+        if len(self.lead_latencies) < 2:
+            return {}
+        percentiles = statistics.quantiles(self.lead_latencies, n=100)
+        return {
+            'p50_ms': round(percentiles[49] * 1000, 1),
+            'p95_ms': round(percentiles[94] * 1000, 1)
+        }
+
     async def enrich_lead_data(self, lead: Lead):
         """Обогащение данных одного лида"""
+        started = time.perf_counter()
         try:
-            # Получаем данные из ФССП
-            fssp_data = await self.enrich_fssp_data(
-                inn=lead.inn,
-                fio=lead.fio,
-                dob=lead.dob.strftime('%Y-%m-%d') if lead.dob else None
-            )
+            # Независимые источники опрашиваются одновременно
+            checks = {
+                'fssp': self.enrich_fssp_data(
+                    inn=lead.inn,
+                    fio=lead.fio,
+                    dob=lead.dob.strftime('%Y-%m-%d') if lead.dob else None
+                ),
+                'court_order': self.check_court_orders(lead.fio)
+            }
+            if lead.inn:
+                checks['bankrupt'] = self.check_fedresurs_bankruptcy(lead.inn)
+                checks['property'] = self.check_rosreestr_property(lead.inn)
+                checks['inn_active'] = self.check_inn_status(lead.inn)
+            results = dict(zip(checks, await asyncio.gather(*checks.values())))
             
             # Обновляем поля лида
+            fssp_data = results['fssp']
             lead.debt_amount = fssp_data['debt_amount']
             lead.debt_type = fssp_data['debt_type']
             lead.creditor = fssp_data['creditor']
             lead.debt_count = fssp_data['debt_count']
             
-            # Проверяем банкротство
             if lead.inn:
-                lead.is_bankrupt = await self.check_fedresurs_bankruptcy(lead.inn)
-                lead.has_property = await self.check_rosreestr_property(lead.inn)
-                lead.inn_active = await self.check_inn_status(lead.inn)
+                lead.is_bankrupt = results['bankrupt']
+                lead.has_property = results['property']
+                lead.inn_active = results['inn_active']
             
-            # Проверяем судебные приказы
-            lead.has_court_order = await self.check_court_orders(lead.fio)
+            lead.has_court_order = results['court_order']
+            # Лид попадет в следующий скоринг (NEEDS_SCORING)
+            lead.scoring_dirty = True
             
+            self._record_latency(time.perf_counter() - started)
             self.total_enriched += 1
             if self.total_enriched % 1000 == 0:
                 logger.info(f"Обогащено {self.total_enriched} лидов")
@@ -264,10 +399,13 @@ class ExternalDataEnricher:
             try:
                 # Получаем лиды для обогащения
                 result = await db.execute(
-                    text("SELECT * FROM leads WHERE lead_id IN :ids"),
-                    {'ids': tuple(lead_ids)}
+                    select(Lead).where(
+                        Lead.lead_id.in_(lead_ids), Lead.debt_amount == None, Lead.canonical_lead_id == None
+                    )
                 )
                 leads = result.scalars().all()
+                # Ответы из кэша для всего батча одним запросом, а не по запросу на промах LRU
+                await self.cache.prefetch(query for lead in leads for query in self._lead_queries(lead))
                 
                 # Асинхронное обогащение
                 tasks = [self.enrich_lead_data(lead) for lead in leads]
@@ -275,23 +413,73 @@ class ExternalDataEnricher:
                 
                 # Сохраняем изменения
                 await db.commit()
+                await self.cache.flush()
                 return True
             except Exception as e:
                 await db.rollback()
                 logger.error(f"Ошибка при обогащении батча: {e}")
                 return False
 
+    async def enrich_claimed_leads(self, worker_id: str, wait_for_others: bool = True,
+                                   stopping: Optional[asyncio.Event] = None) -> int:
+        """Обогащение батчами, арендованными через FOR UPDATE SKIP LOCKED.
+
+        Так же батчи берут воркеры в других процессах (python -m app.worker
+        --enrichment). С wait_for_others воркер задания после последнего
+        батча ждет, пока допишут остальные, и забирает батчи с истекшей
+        арендой; возвращает число взятых лидов.
+        """
+        from app.leases import EnrichmentLeases
+        leases = EnrichmentLeases(worker_id)
+        claimed = 0
+        while stopping is None or not stopping.is_set():
+            lead_ids = await leases.claim(self.batch_size)
+            if not lead_ids:
+                if not wait_for_others or not await leases.has_active():
+                    break
+                await asyncio.sleep(settings.PIPELINE_POLL_INTERVAL)
+                continue
+            claimed += len(lead_ids)
+            logger.info(f"Воркер {worker_id}: батч {lead_ids[0]}..{lead_ids[-1]} ({len(lead_ids)} лидов)")
+            await self.enrich_leased_batch(leases, lead_ids)
+        return claimed
+
+    async def enrich_leased_batch(self, leases, lead_ids: List[str]) -> bool:
+        """Обогащение арендованного батча: аренда продлевается до записи и затем снимается"""
+        renewal = asyncio.create_task(leases.keep_alive(lead_ids))
+        try:
+            return await self.enrich_batch(lead_ids)
+        finally:
+            renewal.cancel()
+            await leases.release(lead_ids)
+
     async def enrich_all_leads(self):
         """Обогащение всех лидов в базе"""
         logger.info("Начато обогащение данных")
         self.total_enriched = 0
+        self.lead_latencies = []
+        self.latency_count = 0
+        self.request_stats.clear()
+        
+        if settings.ENRICHMENT_CLAIM_LEASES:
+            # Состояние обогащения хранится в самих лидах: перезапуск продолжает с необогащенных
+            from app.jobs import default_worker_id
+            from app.leases import EnrichmentLeases
+            worker_id = default_worker_id()
+            await EnrichmentLeases(worker_id).reset_attempts()
+            claimed = await self.enrich_claimed_leads(worker_id)
+            logger.info(f"Обогащение завершено. Взято батчами {claimed}, обогащено этим воркером {self.total_enriched} лидов")
+            self._log_stats()
+            return
         
-        from sqlalchemy import select, func
+        from sqlalchemy import func
         async with AsyncSessionLocal() as db:
-            # Получаем общее количество лидов для обогащения
-            result = await db.execute(
-                select(func.count()).select_from(Lead).where(Lead.debt_amount == None)
+            # Получаем общее количество лидов для обогащения; обогащенные до перезапуска
+            # лиды сюда не попадают, отдельный чекпоинт не нужен
+            count_query = select(func.count()).select_from(Lead).where(
+                Lead.debt_amount == None, Lead.canonical_lead_id == None
             )
+            result = await db.execute(count_query)
             total_count = result.scalar()
             if total_count == 0:
                 logger.info("Нет лидов для обогащения")
@@ -299,20 +487,29 @@ class ExternalDataEnricher:
             logger.info(f"Всего лидов для обогащения: {total_count}")
             # Разбиваем на батчи
             batch_count = (total_count // self.batch_size) + 1
-            for i in range(batch_count):
-                offset = i * self.batch_size
-                result = await db.execute(
-                    select(Lead.lead_id).where(Lead.debt_amount == None).order_by(Lead.lead_id).limit(self.batch_size).offset(offset)
-                )
-                lead_ids = [row[0] for row in result.all()]
-                if not lead_ids:
-                    break
-                logger.info(f"Обработка батча {i+1}/{batch_count} ({len(lead_ids)} лидов)")
+            batches = iter_keyset_batches(
+                db,
+                select(Lead.lead_id).where(Lead.debt_amount == None, Lead.canonical_lead_id == None),
+                Lead.lead_id,
+                self.batch_size
+            )
+            i = 0
+            async for rows in batches:
+                lead_ids = [row.lead_id for row in rows]
+                i += 1
+                logger.info(f"Обработка батча {i}/{batch_count} ({len(lead_ids)} лидов)")
                 await self.enrich_batch(lead_ids)
         logger.info(f"Обогащение завершено. Всего обработано: {self.total_enriched} лидов")
+        self._log_stats()
+
+    def _log_stats(self):
+        logger.info(f"Задержка обогащения лида: {self.get_latency_stats()}")
+        logger.info(f"Запросы к внешним источникам: {self.get_request_stats()}")
+        logger.info(f"Кэш внешних источников: {self.cache.get_stats()}")
     
     async def close(self):
         """Закрытие сессии"""
+        await self.cache.flush()
         if self.session:
             await self.session.close()
             
\ No newline at end of file
@@ -0,0 +1,319 @@
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text
+
+from app.config import settings
+from app.database import AsyncSessionLocal, iter_keyset_batches
+from app.models import Lead
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые объединяются из записей разных источников
+IDENTITY_FIELDS = ['fio', 'phone', 'inn', 'dob', 'address', 'email']
+
+# Поля, по которым идет обогащение: при их изменении канонический лид обогащается заново
+ENRICHMENT_KEY_FIELDS = ('fio', 'inn', 'dob')
+
+# Приоритет источников для отдельных полей, для остальных IDENTITY_SOURCE_PRECEDENCE
+FIELD_PRECEDENCE = {
+    # Телефон из согласия на звонок и кредитных анкет надежнее справочного
+    'phone': ['leads', 'bank', 'mfo', 'gosuslugi', 'insurance', 'fns', 'delivery'],
+    'address': ['gosuslugi', 'insurance', 'delivery', 'fns', 'bank', 'mfo', 'leads'],
+    'email': ['gosuslugi', 'leads', 'bank', 'mfo', 'insurance', 'fns', 'delivery'],
+}
+
+INN_PATTERN = re.compile(r'^\d{10}(\d{2})?$')
+
+# Ключ pg_advisory_xact_lock: батчи разрешаются по одному, иначе два батча
+# с одним человеком создали бы два канонических лида
+IDENTITY_LOCK_KEY = 0x1D3E7
+
+LEAD_COLUMNS = "lead_id, source, canonical_lead_id, identity_sources, debt_amount, " + ", ".join(IDENTITY_FIELDS)
+
+SELECT_UNRESOLVED = text(f"SELECT {LEAD_COLUMNS} FROM leads WHERE lead_id = ANY(:lead_ids) AND resolved_at IS NULL")
+
+SELECT_LEADS = text(f"SELECT {LEAD_COLUMNS} FROM leads WHERE lead_id = ANY(:lead_ids)")
+
+# Блокировка: кандидаты ищутся только среди разрешенных лидов по индексам
+# ix_leads_phone, ix_leads_inn и ix_leads_fio_dob. ФИО и дата рождения
+# сравниваются парами: ANY по каждому полю дает условие для индекса,
+# unnest оставляет только пары из батча, а не все их сочетания
+FIND_CANDIDATES = text(f"""
+    SELECT {LEAD_COLUMNS} FROM leads
+    WHERE resolved_at IS NOT NULL AND (
+        phone = ANY(:phones)
+        OR inn = ANY(:inns)
+        OR (
+            lower(fio) = ANY(CAST(:fios AS text[])) AND dob = ANY(CAST(:dobs AS date[]))
+            AND (lower(fio), dob) IN (SELECT * FROM unnest(CAST(:fios AS text[]), CAST(:dobs AS date[])))
+        )
+    )
+""")
+
+UPDATE_CANONICAL = text("""
+    UPDATE leads SET
+        fio = :fio, phone = :phone, inn = :inn, dob = :dob, address = :address, email = :email,
+        identity_sources = :identity_sources,
+        resolved_at = now(),
+        debt_amount = CASE WHEN :reenrich THEN NULL ELSE debt_amount END,
+        scoring_dirty = TRUE
+    WHERE lead_id = :lead_id
+""")
+
+# Дубли не обогащаются, не оцениваются и не попадают в выгрузку
+MARK_DUPLICATES = text("""
+    UPDATE leads SET
+        canonical_lead_id = data.canonical_lead_id,
+        resolved_at = now(),
+        score = NULL,
+        is_target = FALSE
+    FROM unnest(
+        CAST(:lead_ids AS varchar[]),
+        CAST(:canonical_lead_ids AS varchar[])
+    ) AS data(lead_id, canonical_lead_id)
+    WHERE leads.lead_id = data.lead_id
+""")
+
+# Дубли канонического лида, который сам стал дублем, переходят к новому
+REPOINT_DUPLICATES = text("""
+    UPDATE leads SET canonical_lead_id = data.canonical_lead_id
+    FROM unnest(
+        CAST(:old_lead_ids AS varchar[]),
+        CAST(:canonical_lead_ids AS varchar[])
+    ) AS data(old_lead_id, canonical_lead_id)
+    WHERE leads.canonical_lead_id = data.old_lead_id
+""")
+
+MARK_RESOLVED = text("UPDATE leads SET resolved_at = now() WHERE lead_id = ANY(:lead_ids)")
+
+SELECT_CANONICAL_IDS = text(
+    "SELECT DISTINCT coalesce(canonical_lead_id, lead_id) FROM leads WHERE lead_id = ANY(:lead_ids)"
+)
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+
+    def find(self, item: str) -> str:
+        self.parent.setdefault(item, item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: str, b: str):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+
+class IdentityResolver:
+    """Объединение лидов одного человека из разных источников.
+
+    Новые лиды (resolved_at IS NULL) блокируются по нормализованному
+    телефону, ИНН и паре ФИО + дата рождения и сравниваются только с
+    лидами того же блока. Связанные записи сводятся к одному каноническому
+    лиду (canonical_lead_id IS NULL), остальные помечаются дублями со
+    ссылкой на него. Поля канонического лида берутся из источника с
+    наибольшим приоритетом, источник каждого поля хранится в identity_sources,
+    поэтому следующие файлы объединяются инкрементально.
+    """
+
+    def __init__(self):
+        self.precedence = settings.IDENTITY_SOURCE_PRECEDENCE
+        self.batch_size = settings.BATCH_SIZE
+        self.stats = {'processed': 0, 'merged': 0, 'bridged': 0, 'canonical': 0, 'reenriched': 0}
+
+    def _rank(self, field: Optional[str], source: str) -> int:
+        order = FIELD_PRECEDENCE.get(field, self.precedence)
+        return order.index(source) if source in order else len(order)
+
+    def _sources(self, lead) -> Dict[str, str]:
+        """Источник каждого поля лида"""
+        sources = json.loads(lead['identity_sources']) if lead['identity_sources'] else {}
+        return {field: sources.get(field, lead['source']) for field in IDENTITY_FIELDS}
+
+    def _blocking_keys(self, lead) -> List[tuple]:
+        keys = []
+        if lead['phone']:
+            keys.append(('phone', lead['phone']))
+        if lead['inn'] and INN_PATTERN.match(lead['inn']):
+            keys.append(('inn', lead['inn']))
+        if lead['fio'] and lead['dob']:
+            keys.append(('fio_dob', lead['fio'].lower(), lead['dob']))
+        return keys
+
+    def _names_compatible(self, a, b) -> bool:
+        """Совпадение телефона объединяет лиды, только если у них общее слово в ФИО.
+
+        Один телефон бывает у членов семьи; у доставки вместо ФИО только имя.
+        """
+        if not a['fio'] or not b['fio']:
+            return True
+        return bool(set(a['fio'].lower().split()) & set(b['fio'].lower().split()))
+
+    def _merge_fields(self, canonical, members: list) -> Tuple[dict, Dict[str, str]]:
+        """Значения полей канонического лида по приоритету источников"""
+        values = {field: canonical[field] for field in IDENTITY_FIELDS}
+        sources = self._sources(canonical)
+        for member in members:
+            member_sources = self._sources(member)
+            for field in IDENTITY_FIELDS:
+                value = member[field]
+                if value is None:
+                    continue
+                if values[field] is None or self._rank(field, member_sources[field]) < self._rank(field, sources[field]):
+                    values[field] = value
+                    sources[field] = member_sources[field]
+        return values, sources
+
+    async def _find_candidates(self, db, leads: list) -> list:
+        keys = [key for lead in leads for key in self._blocking_keys(lead)]
+        result = await db.execute(FIND_CANDIDATES, {
+            'phones': [key[1] for key in keys if key[0] == 'phone'],
+            'inns': [key[1] for key in keys if key[0] == 'inn'],
+            'fios': [key[1] for key in keys if key[0] == 'fio_dob'],
+            'dobs': [key[2] for key in keys if key[0] == 'fio_dob'],
+        })
+        return result.mappings().all()
+
+    def _clusters(self, nodes: Dict[str, dict]) -> List[list]:
+        """Связные группы лидов по общим ключам блокировки"""
+        union_find = _UnionFind()
+        blocks = defaultdict(list)
+        for lead_id, lead in nodes.items():
+            union_find.find(lead_id)
+            if lead['canonical_lead_id'] in nodes:
+                union_find.union(lead['canonical_lead_id'], lead_id)
+            for key in self._blocking_keys(lead):
+                blocks[key].append(lead)
+
+        for key, leads in blocks.items():
+            for i, lead in enumerate(leads[1:], 1):
+                for previous in leads[:i]:
+                    if key[0] != 'phone' or self._names_compatible(previous, lead):
+                        union_find.union(previous['lead_id'], lead['lead_id'])
+                        break
+
+        clusters = defaultdict(list)
+        for lead_id, lead in nodes.items():
+            clusters[union_find.find(lead_id)].append(lead)
+        return list(clusters.values())
+
+    async def resolve_lead_ids(self, lead_ids: List[str]) -> List[str]:
+        """Объединение батча лидов, возвращает канонические lead_id батча"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': IDENTITY_LOCK_KEY})
+            result = await db.execute(SELECT_UNRESOLVED, {'lead_ids': lead_ids})
+            new_leads = [dict(row) for row in result.mappings().all()]
+            if new_leads:
+                await self._resolve(db, new_leads)
+            result = await db.execute(SELECT_CANONICAL_IDS, {'lead_ids': lead_ids})
+            canonical_ids = [row[0] for row in result.all()]
+            await db.commit()
+        return canonical_ids
+
+    async def _resolve(self, db, new_leads: list):
+        new_ids = {lead['lead_id'] for lead in new_leads}
+        nodes = {lead['lead_id']: lead for lead in new_leads}
+        for lead in await self._find_candidates(db, new_leads):
+            nodes.setdefault(lead['lead_id'], dict(lead))
+        # Канонические лиды найденных дублей
+        missing = {
+            lead['canonical_lead_id'] for lead in nodes.values()
+            if lead['canonical_lead_id'] and lead['canonical_lead_id'] not in nodes
+        }
+        if missing:
+            result = await db.execute(SELECT_LEADS, {'lead_ids': list(missing)})
+            for lead in result.mappings().all():
+                nodes[lead['lead_id']] = dict(lead)
+
+        singles, canonical_updates, duplicates, repoints = [], [], [], []
+        for cluster in self._clusters(nodes):
+            cluster_new = [lead for lead in cluster if lead['lead_id'] in new_ids]
+            if not cluster_new:
+                continue
+            roots = [
+                lead for lead in cluster
+                if lead['lead_id'] not in new_ids and lead['canonical_lead_id'] is None
+            ]
+            if not roots and len(cluster_new) == 1:
+                singles.append(cluster_new[0]['lead_id'])
+                continue
+
+            # Уже обогащенный канонический лид остается каноническим
+            canonical = min(
+                roots or cluster_new,
+                key=lambda lead: (lead['debt_amount'] is None, self._rank(None, lead['source']), lead['lead_id'])
+            )
+            others = [lead for lead in roots + cluster_new if lead is not canonical]
+            values, sources = self._merge_fields(canonical, others)
+            reenrich = canonical['debt_amount'] is not None and any(
+                values[field] != canonical[field] for field in ENRICHMENT_KEY_FIELDS
+            )
+            canonical_updates.append({
+                **values,
+                'lead_id': canonical['lead_id'],
+                'identity_sources': json.dumps(sources),
+                'reenrich': reenrich
+            })
+            duplicates.extend((lead['lead_id'], canonical['lead_id']) for lead in others)
+            repoints.extend(
+                (lead['lead_id'], canonical['lead_id']) for lead in roots if lead is not canonical
+            )
+            self.stats['reenriched'] += int(reenrich)
+            self.stats['canonical'] += int(not roots)
+
+        if repoints:
+            await db.execute(REPOINT_DUPLICATES, {
+                'old_lead_ids': [old for old, _ in repoints],
+                'canonical_lead_ids': [canonical for _, canonical in repoints]
+            })
+        if duplicates:
+            await db.execute(MARK_DUPLICATES, {
+                'lead_ids': [lead_id for lead_id, _ in duplicates],
+                'canonical_lead_ids': [canonical for _, canonical in duplicates]
+            })
+        if canonical_updates:
+            await db.execute(UPDATE_CANONICAL, canonical_updates)
+        if singles:
+            await db.execute(MARK_RESOLVED, {'lead_ids': singles})
+
+        self.stats['processed'] += len(new_leads)
+        self.stats['merged'] += len(duplicates) - len(repoints)
+        self.stats['bridged'] += len(repoints)
+        self.stats['canonical'] += len(singles)
+
+    async def resolve_pending(self) -> dict:
+        """Объединение всех лидов, которые еще не проходили этот этап"""
+        logger.info("Начато объединение лидов из разных источников")
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            batches = iter_keyset_batches(
+                db,
+                select(Lead.lead_id).where(Lead.resolved_at == None),
+                Lead.lead_id,
+                self.batch_size
+            )
+            async for rows in batches:
+                await self.resolve_lead_ids([row.lead_id for row in rows])
+        elapsed = time.perf_counter() - started
+        processed = self.stats['processed']
+        logger.info(
+            f"Объединение завершено: {processed} лидов, дублей {self.stats['merged']} "
+            f"({self.get_merge_rate():.1%}), новых канонических {self.stats['canonical']}, "
+            f"слияний канонических {self.stats['bridged']}, заново на обогащение {self.stats['reenriched']}, "
+            f"{processed / elapsed if elapsed else 0:.0f} лидов/с"
+        )
+        return self.stats
+
+    def get_merge_rate(self) -> float:
+        """Доля обработанных лидов, ставших дублями"""
+        processed = self.stats['processed']
+        return self.stats['merged'] / processed if processed else 0.0
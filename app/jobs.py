@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import socket
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import select, update, func, or_, and_, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.database import AsyncSessionLocal, async_engine
+from app.models import PipelineJob, WorkerState
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock: задания пишут общие leads.score/is_target и файл
+# выгрузки, поэтому выполняются по одному, даже если воркеров несколько
+PIPELINE_JOB_LOCK_KEY = 0x1D3E8
+
+
+def default_worker_id() -> str:
+    """Имя воркера в очереди заданий и аренде лидов: хост и pid процесса"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def enqueue_job(filters: dict = None, export_format: str = None, kind: str = 'scoring') -> int:
+    """Новое задание в очереди; его возьмет первый свободный воркер"""
+    async with AsyncSessionLocal() as db:
+        job = PipelineJob(
+            status='queued',
+            kind=kind,
+            filters=json.dumps(filters) if filters is not None else None,
+            export_format=export_format or settings.EXPORT_FORMAT,
+            progress=0,
+            message='Задание в очереди'
+        )
+        db.add(job)
+        await db.commit()
+        return job.id
+
+
+async def claim_job(worker_id: str) -> Optional[PipelineJob]:
+    """Следующее задание очереди для воркера.
+
+    Строка блокируется FOR UPDATE SKIP LOCKED: воркеры в других процессах
+    не ждут друг друга и не получают одно задание дважды. Выполняемое
+    задание без heartbeat дольше PIPELINE_JOB_TIMEOUT считается брошенным
+    остановленным воркером и продолжается с сохраненного этапа. Задание,
+    брошенное PIPELINE_JOB_MAX_ATTEMPTS раз (например, воркер падает на нем
+    по нехватке памяти), помечается ошибкой и больше не берется.
+    """
+    pending = PipelineJob.status == 'queued'
+    if settings.PIPELINE_AUTO_RESUME:
+        stale_before = func.now() - timedelta(seconds=settings.PIPELINE_JOB_TIMEOUT)
+        pending = or_(pending, and_(
+            PipelineJob.status == 'running',
+            func.coalesce(PipelineJob.heartbeat_at, PipelineJob.updated_at) < stale_before
+        ))
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(PipelineJob)
+                .where(pending)
+                .order_by(PipelineJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalars().first()
+            if job is None:
+                return None
+            if job.status != 'running':
+                break
+            if (job.attempts or 0) < settings.PIPELINE_JOB_MAX_ATTEMPTS:
+                logger.warning(f"Задание {job.id} брошено воркером {job.worker_id}, продолжение с этапа {job.stage}")
+                break
+            logger.error(f"Задание {job.id} брошено {job.attempts} раз, помечено ошибкой")
+            job.status = 'error'
+            job.error_message = f"Задание прервано {job.attempts} раз без завершения"
+            job.message = f"Ошибка: задание прервано {job.attempts} раз без завершения"
+            job.finished_at = func.now()
+            await db.commit()
+        job.status = 'running'
+        job.worker_id = worker_id
+        job.attempts = (job.attempts or 0) + 1
+        job.started_at = job.started_at or func.now()
+        job.heartbeat_at = func.now()
+        await db.commit()
+        await db.refresh(job)
+        return job
+
+
+@asynccontextmanager
+async def job_lock():
+    """Блокировка на время выполнения задания; следующее задание ждет ее в своем воркере"""
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': PIPELINE_JOB_LOCK_KEY})
+            yield
+        finally:
+            # Сессионная блокировка снимается закрытием соединения, в том числе
+            # при отмене во время ожидания: соединение не возвращается в пул
+            await conn.invalidate()
+
+
+async def heartbeat_job(job_id: int, worker_id: str, stage: str, progress: int, message: str) -> bool:
+    """Прогресс и heartbeat задания; False - задание отменено или перешло к другому воркеру"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(PipelineJob)
+            .where(
+                PipelineJob.id == job_id,
+                PipelineJob.worker_id == worker_id,
+                PipelineJob.status == 'running'
+            )
+            .values(stage=stage, progress=progress, message=message, heartbeat_at=func.now())
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+
+async def finish_job(job_id: int, status: str, error_message: str = None, message: str = None,
+                     result: dict = None):
+    values = {'status': status, 'error_message': error_message, 'finished_at': func.now()}
+    if message is not None:
+        values['message'] = message
+    if result is not None:
+        values['result'] = json.dumps(result, default=str)
+    if status == 'completed':
+        values['progress'] = 100
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(PipelineJob).where(PipelineJob.id == job_id).values(values))
+        await db.commit()
+
+
+async def cancel_job(job_id: int) -> bool:
+    """Отмена ожидающего или выполняемого задания; воркер заметит ее по heartbeat"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(PipelineJob)
+            .where(PipelineJob.id == job_id, PipelineJob.status.in_(['queued', 'running']))
+            .values(status='cancelled', message='Задание отменено', finished_at=func.now())
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+
+async def get_job_status(job_id: int = None) -> Optional[dict]:
+    """Статус задания по id, без id - последнего созданного"""
+    # Длительность считается в БД: started_at и finished_at ставит now() сервера
+    duration = func.extract('epoch', func.coalesce(PipelineJob.finished_at, func.now()) - PipelineJob.started_at)
+    stmt = select(PipelineJob, duration.label('duration'))
+    if job_id is not None:
+        stmt = stmt.where(PipelineJob.id == job_id)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(stmt.order_by(PipelineJob.id.desc()).limit(1))
+        row = result.first()
+    if row is None:
+        return None
+    job, duration = row
+    return {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress or 0,
+        'stage': job.stage or '',
+        'message': job.message or '',
+        'duration': float(duration or 0),
+        'result': json.loads(job.result) if job.result else None,
+        'worker_id': job.worker_id
+    }
+
+
+async def get_active_jobs() -> list:
+    """Задания в очереди и в работе, в порядке очереди"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(PipelineJob)
+            .where(PipelineJob.status.in_(['queued', 'running']))
+            .order_by(PipelineJob.id)
+        )
+        return [
+            {
+                'job_id': job.id,
+                'kind': job.kind,
+                'status': job.status,
+                'stage': job.stage,
+                'progress': job.progress or 0,
+                'worker_id': job.worker_id,
+                'created_at': job.created_at,
+                'heartbeat_at': job.heartbeat_at
+            }
+            for job in result.scalars()
+        ]
+
+
+async def get_export_file(export_format: str) -> Optional[str]:
+    """Файл последней завершенной выгрузки в формате"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(PipelineJob.result)
+            .where(PipelineJob.status == 'completed', PipelineJob.result.is_not(None))
+            .order_by(PipelineJob.id.desc())
+            .limit(100)
+        )
+        for payload in result.scalars():
+            output_file = json.loads(payload).get('exports', {}).get(export_format)
+            if output_file:
+                return output_file
+    return None
+
+
+async def publish_worker_state(worker_id: str, rate_limits: dict, proxies: dict):
+    """Состояние лимитов частоты и прокси процесса воркера: веб-приложение не видит его память"""
+    values = {
+        'rate_limits': json.dumps(rate_limits),
+        'proxies': json.dumps(proxies),
+        'updated_at': func.now()
+    }
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            insert(WorkerState)
+            .values(worker_id=worker_id, **values)
+            .on_conflict_do_update(index_elements=['worker_id'], set_=values)
+        )
+        await db.commit()
+
+
+async def get_worker_states(field: str) -> dict:
+    """Опубликованное состояние живых воркеров по worker_id; field - rate_limits или proxies"""
+    column = getattr(WorkerState, field)
+    alive_after = func.now() - timedelta(seconds=settings.PIPELINE_JOB_TIMEOUT)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(WorkerState.worker_id, column)
+            .where(WorkerState.updated_at >= alive_after, column.is_not(None))
+            .order_by(WorkerState.worker_id)
+        )
+        return {worker_id: json.loads(payload) for worker_id, payload in result}
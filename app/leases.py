@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import List
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Батч необогащенных лидов без действующей аренды. FOR UPDATE SKIP LOCKED держится
+# только на время выборки: воркеры не ждут строк друг друга, а дальше лиды защищает аренда
+CLAIM_LEADS_SQL = """
+    UPDATE leads
+    SET enrich_worker = :worker_id,
+        enrich_lease_until = now() + make_interval(secs => :lease_seconds),
+        enrich_attempts = enrich_attempts + 1
+    WHERE lead_id IN (
+        SELECT lead_id FROM leads
+        WHERE {candidates}
+          AND debt_amount IS NULL
+          AND canonical_lead_id IS NULL
+          AND (enrich_lease_until IS NULL OR enrich_lease_until < now())
+          AND enrich_attempts < :max_attempts
+        ORDER BY lead_id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING lead_id
+"""
+
+CLAIM_LEADS = text(CLAIM_LEADS_SQL.format(candidates="TRUE"))
+
+# С объединением лидов необъединенный лид может оказаться дублем: его берут
+# только после этапа объединения, иначе обогащение ушло бы на будущий дубль
+CLAIM_RESOLVED_LEADS = text(CLAIM_LEADS_SQL.format(candidates="resolved_at IS NOT NULL"))
+
+# Аренда конкретного батча (потоковый режим): лиды, взятые другими воркерами, пропускаются
+CLAIM_LEAD_IDS = text(CLAIM_LEADS_SQL.format(candidates="lead_id = ANY(:lead_ids)"))
+
+RENEW_LEASES = text("""
+    UPDATE leads SET enrich_lease_until = now() + make_interval(secs => :lease_seconds)
+    WHERE lead_id = ANY(:lead_ids) AND enrich_worker = :worker_id
+""")
+
+RELEASE_LEADS = text("""
+    UPDATE leads SET enrich_worker = NULL, enrich_lease_until = NULL
+    WHERE lead_id = ANY(:lead_ids) AND enrich_worker = :worker_id
+""")
+
+HAS_ACTIVE_LEASES = text("""
+    SELECT EXISTS (
+        SELECT 1 FROM leads
+        WHERE debt_amount IS NULL AND enrich_lease_until IS NOT NULL AND enrich_lease_until >= now()
+    )
+""")
+
+RESET_ATTEMPTS = text("""
+    UPDATE leads SET enrich_attempts = 0
+    WHERE debt_amount IS NULL AND enrich_attempts > 0 AND (enrich_lease_until IS NULL OR enrich_lease_until < now())
+""")
+
+
+class EnrichmentLeases:
+    """Аренда батчей лидов на обогащение для воркеров в разных процессах.
+
+    Воркер берет батч, продлевает аренду, пока его обогащает, и снимает
+    ее после записи результатов. Аренда упавшего воркера истекает через
+    ENRICHMENT_LEASE_SECONDS, и батч берет другой воркер. Лид, не
+    обогащенный за ENRICHMENT_MAX_ATTEMPTS аренд, до следующего задания
+    больше не выдается. При IDENTITY_RESOLUTION_ENABLED выдаются только
+    прошедшие объединение лиды.
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.lease_seconds = settings.ENRICHMENT_LEASE_SECONDS
+
+    async def claim(self, batch_size: int) -> List[str]:
+        query = CLAIM_RESOLVED_LEADS if settings.IDENTITY_RESOLUTION_ENABLED else CLAIM_LEADS
+        return await self._claim(query, {'batch_size': batch_size})
+
+    async def claim_ids(self, lead_ids: List[str]) -> List[str]:
+        """Аренда лидов из lead_ids, которые еще не обогащены и не взяты другими воркерами"""
+        return await self._claim(CLAIM_LEAD_IDS, {'lead_ids': lead_ids, 'batch_size': len(lead_ids)})
+
+    async def _claim(self, query, params: dict) -> List[str]:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(query, {
+                'worker_id': self.worker_id,
+                'lease_seconds': self.lease_seconds,
+                'max_attempts': settings.ENRICHMENT_MAX_ATTEMPTS,
+                **params
+            })
+            lead_ids = sorted(result.scalars().all())
+            await db.commit()
+        return lead_ids
+
+    async def renew(self, lead_ids: List[str]):
+        async with AsyncSessionLocal() as db:
+            await db.execute(RENEW_LEASES, {
+                'lead_ids': lead_ids, 'worker_id': self.worker_id, 'lease_seconds': self.lease_seconds
+            })
+            await db.commit()
+
+    async def keep_alive(self, lead_ids: List[str]):
+        """Продление аренды батча, пока его обогащает воркер; отменяется после записи"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.renew(lead_ids)
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды батча {lead_ids[0]}..{lead_ids[-1]}: {e}")
+
+    async def release(self, lead_ids: List[str]):
+        """Снятие аренды: необогащенные лиды батча снова доступны воркерам"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(RELEASE_LEADS, {'lead_ids': lead_ids, 'worker_id': self.worker_id})
+            await db.commit()
+
+    async def has_active(self) -> bool:
+        """Есть ли батчи в работе у других воркеров"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(HAS_ACTIVE_LEASES)
+            return result.scalar()
+
+    async def reset_attempts(self):
+        """Новое задание снова пробует лиды, исчерпавшие попытки в прошлых"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(RESET_ATTEMPTS)
+            await db.commit()
@@ -1,16 +1,17 @@
-from fastapi import FastAPI, Request, Form, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Request, Form, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
-from datetime import datetime
+from fastapi.responses import HTMLResponse, JSONResponse
 import asyncio
 import logging
 from typing import List
 from app.config import settings
 from app.utils import PipelineManager
 from app.models import StatusResponse, ScoringRequest
-from app.database import Base, engine
-import time
+from app.jobs import enqueue_job, cancel_job, get_job_status, get_active_jobs, get_export_file, get_worker_states
+from app.worker import PipelineWorker
+from app.export import EXPORT_FORMATS
+from app.downloads import LIVE_FORMATS, file_response, live_export_response
 import os
 
 # Настройка логгера
@@ -38,45 +39,41 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Инициализация компонентов
 pipeline = PipelineManager()
 
-# Состояние обработки
-class ProcessingState:
-    def __init__(self):
-        self.status = "idle"  # idle, running, completed, error
-        self.progress = 0
-        self.current_stage = ""
-        self.message = ""
-        self.start_time = None
-        self.result = None
-        self.filters = None
-
-state = ProcessingState()
+# Задания выполняет воркер (python -m app.worker), веб-приложение ставит их в очередь
+worker = PipelineWorker(pipeline=pipeline) if settings.PIPELINE_EMBEDDED_WORKER else None
+IDLE_STATUS = {"job_id": None, "status": "idle", "progress": 0, "stage": "", "message": "", "duration": 0.0, "result": None}
 
 
 @app.on_event("startup")
-def startup_event():
-    """Инициализация при запуске"""
-    # Создание таблиц (если не используются миграции)
-    with engine.begin() as conn:
-        Base.metadata.create_all(conn)
+async def startup_event():
+    """Инициализация при запуске (схема базы создается миграциями: alembic upgrade head)"""
     logger.info("Application started")
     pipeline.file_manager.ensure_directories()
+    if worker is not None:
+        app.state.worker_task = asyncio.create_task(worker.run())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if worker is not None:
+        worker.stop()
+        await app.state.worker_task
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """Главная страница"""
     files = pipeline.file_manager.get_input_files_info()
+    job = await get_job_status() or IDLE_STATUS
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "status": state.status,
-        "progress": state.progress,
-        "stage": state.current_stage,
-        "message": state.message,
+        "status": job["status"],
+        "progress": job["progress"],
+        "stage": job["stage"],
+        "message": job["message"],
         "files": files
     })
 
 @app.post("/start-scoring")
 async def start_scoring(
-    background_tasks: BackgroundTasks,
     regions: List[str] = Form([]),
     min_debt_amount: int = Form(settings.MIN_DEBT_AMOUNT),
     exclude_bankrupts: bool = Form(True),
@@ -84,10 +81,11 @@ async def start_scoring(
     only_with_property: bool = Form(False),
     only_bank_mfo_debt: bool = Form(False),
     only_recent_court_orders: bool = Form(False),
-    only_active_inn: bool = Form(True)
+    only_active_inn: bool = Form(True),
+    export_format: str = Form(settings.EXPORT_FORMAT)
 ):
-    if state.status == "running":
-        raise HTTPException(400, "Обработка уже запущена")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Неизвестный формат экспорта: {export_format}")
     
     filters = {
         'regions': regions,
@@ -100,86 +98,60 @@ async def start_scoring(
         'only_active_inn': only_active_inn
     }
     
-    state.status = "running"
-    state.progress = 0
-    state.current_stage = ""
-    state.message = "Запуск обработки"
-    state.start_time = time.time()
-    state.result = None
-    state.filters = filters
-    
-    background_tasks.add_task(run_processing_pipeline, filters)
-    return {"status": "running", "message": "Обработка запущена"}
-
-async def run_processing_pipeline(filters: dict):
-    stages = [
-        ("normalization", "Нормализация данных", {}),
-        ("enrichment", "Обогащение данных", {}),
-        ("scoring", "Расчет скоринга", {"filters": filters}),
-        ("export", "Экспорт результатов", {})
-    ]
-    
-    total_stages = len(stages)
-    state.progress = 0
-    
-    try:
-        for i, (stage_name, stage_message, stage_args) in enumerate(stages):
-            state.current_stage = stage_name
-            state.message = stage_message
-            state.progress = int((i / total_stages) * 100)
-            
-            func = getattr(pipeline, f"run_{stage_name}")
-            if asyncio.iscoroutinefunction(func):
-                await func(**stage_args)
-            else:
-                func(**stage_args)
-            
-            state.progress = int(((i + 1) / total_stages) * 100)
-        
-        # Получаем результат экспорта
-        output_file = await pipeline.run_export()
-        if not output_file:
-            raise Exception("Ошибка при экспорте результатов")
-        
-        # Получаем статистику
-        stats = await pipeline.get_database_stats()
-        
-        state.status = "completed"
-        state.message = f"Обработка завершена. Найдено {stats['target_leads']} целевых лидов"
-        state.result = {
-            "output_file": output_file,
-            "target_count": stats['target_leads'],
-            "stats": stats
-        }
-    
-    except Exception as e:
-        state.status = "error"
-        state.message = f"Ошибка: {str(e)}"
-        state.result = None
-        logger.exception("Ошибка в процессе обработки")
+    job_id = await enqueue_job(filters, export_format)
+    return {"status": "queued", "message": "Задание поставлено в очередь", "job_id": job_id}
 
 @app.get("/status", response_model=StatusResponse)
-async def get_status():
-    duration = time.time() - state.start_time if state.start_time else 0
-    return StatusResponse(
-        status=state.status,
-        progress=state.progress,
-        stage=state.current_stage,
-        message=state.message,
-        duration=duration,
-        result=state.result
-    )
+async def get_status(job_id: int = None):
+    """Статус задания по id, без id - последнего созданного"""
+    job = await get_job_status(job_id)
+    if job is None:
+        if job_id is not None:
+            raise HTTPException(404, f"Задание {job_id} не найдено")
+        job = IDLE_STATUS
+    return StatusResponse(**job)
+
+@app.get("/jobs")
+async def get_jobs():
+    """Задания в очереди и в работе"""
+    return await get_active_jobs()
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel(job_id: int):
+    if not await cancel_job(job_id):
+        raise HTTPException(404, f"Задание {job_id} не найдено или уже завершено")
+    return {"job_id": job_id, "status": "cancelled"}
 
 @app.get("/download")
-async def download_results():
-    if not state.result or not state.result.get("output_file"):
-        raise HTTPException(404, "Файл результатов не найден")
+async def download_results(request: Request, format: str = None, live: bool = False):
+    """Скачивание выгрузки с поддержкой Range; во время экспорта или с live=true - прямо из базы.
+
+    Прямо из базы выгружаются CSV, csv.gz и csv.zst; Parquet во время экспорта
+    отдается из предыдущей выгрузки.
+    """
+    job = await get_job_status() or IDLE_STATUS
+    exporting = job["status"] == "running" and job["stage"] == "export"
+    if live or (exporting and (format or 'csv') in LIVE_FORMATS):
+        return live_export_response(request, format or 'csv')
+
+    export_format = format or (job["result"] or {}).get("export_format", settings.EXPORT_FORMAT)
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Неизвестный формат экспорта: {export_format}")
+    output_file = await get_export_file(export_format)
+    if not output_file:
+        raise HTTPException(404, f"Выгрузка в формате {export_format} не найдена, запустите /export")
+    
+    filename, media_type = EXPORT_FORMATS[export_format]
+    return file_response(request, output_file, filename, media_type)
+
+@app.post("/export")
+async def export_results(export_format: str = Form(settings.EXPORT_FORMAT)):
+    """Повторная выгрузка результатов в другом формате без пересчета: задание воркеру"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Неизвестный формат экспорта: {export_format}")
     
-    return FileResponse(
-        state.result["output_file"],
-        filename="scoring_ready.csv",
-        media_type="text/csv"
-    )
+    job_id = await enqueue_job(export_format=export_format, kind="export")
+    return {"status": "queued", "export_format": export_format, "job_id": job_id}
 
 @app.get("/logs")
 async def get_logs(limit: int = 100):
@@ -191,6 +163,15 @@ async def get_stats():
     stats = await pipeline.get_database_stats()
     return stats
 
+@app.get("/rate-limits")
+async def get_rate_limits():
+    # Обогащение идет в процессах воркеров, состояние они публикуют в worker_states
+    return await get_worker_states('rate_limits')
+
+@app.get("/proxies")
+async def get_proxies():
+    return await get_worker_states('proxies')
+
 @app.get("/files")
 async def get_files():
     files = pipeline.file_manager.get_input_files_info()
@@ -0,0 +1,278 @@
+"""Локальная замена внешних источников для замеров обогащения.
+
+Поднимает aiohttp-серверы с путями ФССП, Федресурса, Росреестра,
+nalog.ru и API судов, каждый источник на своем порту. Задержка ответа
+берется из логнормального распределения, часть ответов может быть 429
+(с Retry-After) или 500. Ответы детерминированы по параметрам запроса.
+Опционально поднимает HTTP-прокси с заданной задержкой и долей отказов
+(502) на портах после источников, для проверки пула прокси.
+
+    python -m app.mock_sources --port 8100 --latency-ms 80 --rate-429 0.01 --error-rate 0.01
+    python -m app.mock_sources --port 8100 --proxy 10 --proxy 300 --proxy 20:0.5
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+logger = logging.getLogger(__name__)
+
+SOURCE_PATHS = {
+    'fssp': '/v1/search',
+    'fedresurs': '/backend/companies',
+    'rosreestr': '/api/online/fir_objects',
+    'nalog': '/inn-proc.do',
+    'courts': '/api/search',
+}
+
+
+@dataclass
+class MockSourceConfig:
+    latency_ms: float = 50.0
+    latency_sigma: float = 0.5  # разброс логнормального распределения
+    rate_429: float = 0.0
+    error_rate: float = 0.0
+    rps_limit: float = 0.0  # 0 - без ограничения
+    retry_after: float = 1.0
+
+
+def _seed(params) -> int:
+    key = '&'.join(f'{k}={v}' for k, v in sorted(params.items()))
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _fssp(rnd: random.Random) -> dict:
+    debts = [
+        {
+            'debt_sum': round(rnd.uniform(5000, 800000), 2),
+            'debt_type': rnd.choice(['bank', 'mfo', 'tax', 'utility']),
+            'creditor': rnd.choice(['Сбербанк', 'Тинькофф', 'ФНС', 'МосЭнергоСбыт'])
+        }
+        for _ in range(rnd.choice([0, 0, 1, 2, 3]))
+    ]
+    return {'result': debts}
+
+
+def _fedresurs(rnd: random.Random) -> dict:
+    return {'data': [{'status': 'active'}] if rnd.random() < 0.05 else []}
+
+
+def _rosreestr(rnd: random.Random) -> dict:
+    return {'objects': [{'type': 'flat'}] if rnd.random() < 0.3 else []}
+
+
+def _nalog(rnd: random.Random) -> dict:
+    return {'status': 'active' if rnd.random() < 0.95 else 'inactive'}
+
+
+def _courts(rnd: random.Random) -> dict:
+    if rnd.random() > 0.2:
+        return {'results': []}
+    order_date = datetime.now() - timedelta(days=rnd.randint(1, 200))
+    return {'results': [{'type': 'court_order', 'status': 'active', 'date': order_date.strftime('%Y-%m-%d')}]}
+
+
+RESPONSES = {
+    'fssp': _fssp,
+    'fedresurs': _fedresurs,
+    'rosreestr': _rosreestr,
+    'nalog': _nalog,
+    'courts': _courts,
+}
+
+
+class MockSource:
+    """Один источник: задержка, отказы, ограничение частоты и счетчики"""
+
+    def __init__(self, name: str, config: MockSourceConfig):
+        self.name = name
+        self.config = config
+        self.stats = {'requests': 0, 'ok': 0, 'throttled': 0, 'errors': 0}
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _over_limit(self) -> bool:
+        if not self.config.rps_limit:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count > self.config.rps_limit
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        config = self.config
+        median = config.latency_ms / 1000
+        await asyncio.sleep(random.lognormvariate(math.log(median), config.latency_sigma) if median > 0 else 0)
+
+        if self._over_limit() or random.random() < config.rate_429:
+            self.stats['throttled'] += 1
+            return web.json_response(
+                {'error': 'too many requests'}, status=429,
+                headers={'Retry-After': str(config.retry_after)}
+            )
+        if random.random() < config.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response({'error': 'internal error'}, status=500)
+
+        self.stats['ok'] += 1
+        rnd = random.Random(_seed(request.query))
+        return web.json_response(RESPONSES[self.name](rnd))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+@dataclass
+class MockProxyConfig:
+    latency_ms: float = 10.0
+    failure_rate: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> 'MockProxyConfig':
+        """Разбор строки вида LATENCY_MS[:FAILURE_RATE]"""
+        latency, _, failure_rate = spec.partition(':')
+        return cls(latency_ms=float(latency), failure_rate=float(failure_rate or 0))
+
+
+class MockProxy:
+    """Прокси-заглушка: добавляет задержку, часть запросов отвечает 502"""
+
+    def __init__(self, config: MockProxyConfig):
+        self.config = config
+        self.stats = {'requests': 0, 'ok': 0, 'failures': 0}
+        self.session = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        await asyncio.sleep(self.config.latency_ms / 1000)
+        if random.random() < self.config.failure_rate:
+            self.stats['failures'] += 1
+            return web.Response(status=502, text='bad gateway')
+        if self.session is None:
+            self.session = ClientSession()
+        # Клиент присылает абсолютный адрес источника в строке запроса
+        async with self.session.get(request.url) as response:
+            body = await response.read()
+            headers = {k: v for k, v in response.headers.items() if k in ('Content-Type', 'Retry-After')}
+        self.stats['ok'] += 1
+        return web.Response(status=response.status, body=body, headers=headers)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def close(self, app: web.Application):
+        if self.session is not None:
+            await self.session.close()
+
+
+def create_proxy_app(config: MockProxyConfig) -> web.Application:
+    proxy = MockProxy(config)
+    app = web.Application()
+    app.router.add_get('/_stats', proxy.handle_stats)
+    app.router.add_route('GET', '/{tail:.*}', proxy.handle)
+    app.on_cleanup.append(proxy.close)
+    return app
+
+
+def create_app(name: str, config: MockSourceConfig) -> web.Application:
+    source = MockSource(name, config)
+    app = web.Application()
+    app.router.add_get(SOURCE_PATHS[name], source.handle)
+    app.router.add_get('/_stats', source.handle_stats)
+    return app
+
+
+def source_urls(host: str, port: int) -> Dict[str, str]:
+    """Адреса источников для settings.SOURCE_URLS: каждый источник на своем порту"""
+    return {
+        name: f'http://{host}:{port + index}{path}'
+        for index, (name, path) in enumerate(SOURCE_PATHS.items())
+    }
+
+
+def proxy_urls(host: str, port: int, count: int) -> List[str]:
+    """Адреса прокси-заглушек: порты сразу после источников"""
+    return [f'http://{host}:{port + len(SOURCE_PATHS) + index}' for index in range(count)]
+
+
+async def start(host: str, port: int, configs: Dict[str, MockSourceConfig],
+                proxies: Optional[List[MockProxyConfig]] = None) -> list:
+    """Запуск всех источников и прокси в текущем цикле событий, возвращает раннеры для остановки"""
+    apps = [create_app(name, configs[name]) for name in SOURCE_PATHS]
+    apps += [create_proxy_app(config) for config in proxies or []]
+    runners = []
+    for index, app in enumerate(apps):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port + index).start()
+        runners.append(runner)
+    return runners
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100, help='порт первого источника, остальные следом')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='медиана задержки ответа')
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--rps-limit', type=float, default=0.0, help='лимит запросов в секунду на источник')
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument(
+        '--source-latency', action='append', default=[], metavar='SOURCE=MS',
+        help='медиана задержки для отдельного источника, например courts=400'
+    )
+    parser.add_argument(
+        '--proxy', action='append', default=[], metavar='MS[:FAILURE_RATE]',
+        help='прокси-заглушка с задержкой и долей ответов 502, например 20:0.3'
+    )
+    args = parser.parse_args(argv)
+
+    configs = {
+        name: MockSourceConfig(
+            latency_ms=args.latency_ms,
+            latency_sigma=args.latency_sigma,
+            rate_429=args.rate_429,
+            error_rate=args.error_rate,
+            rps_limit=args.rps_limit,
+            retry_after=args.retry_after
+        )
+        for name in SOURCE_PATHS
+    }
+    for override in args.source_latency:
+        name, latency = override.split('=', 1)
+        configs[name].latency_ms = float(latency)
+
+    async def serve():
+        proxies = [MockProxyConfig.parse(spec) for spec in args.proxy]
+        runners = await start(args.host, args.port, configs, proxies)
+        for name, url in source_urls(args.host, args.port).items():
+            print(f'{name}: {url}', flush=True)
+        for url in proxy_urls(args.host, args.port, len(proxies)):
+            print(f'proxy: {url}', flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            for runner in runners:
+                await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, Boolean, Text, DateTime, Integer, func, Date
+from sqlalchemy import Column, String, Float, Boolean, Text, DateTime, Integer, BigInteger, func, Date, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from app.database import Base
 from pydantic import BaseModel
@@ -19,7 +19,8 @@ class Lead(Base):
     email = Column(String(255))
     
     # Обогащенные данные
-    debt_amount = Column(Float, default=0.0)
+    # NULL - лид еще не обогащен
+    debt_amount = Column(Float)
     debt_type = Column(String(50))
     creditor = Column(String(255))
     debt_count = Column(Integer, default=0)
@@ -38,11 +39,50 @@ class Lead(Base):
     reason_2 = Column(String(255))
     reason_3 = Column(String(255))
     group_name = Column(String(50))
+    # Состояние скоринга: данные изменились после скоринга (ставят обогащение и объединение),
+    # версия правил и фильтров, свежесть судебного приказа на момент скоринга
+    scoring_dirty = Column(Boolean, default=True, server_default=text('true'), nullable=False)
+    scoring_version = Column(String(32))
+    scored_recent_order = Column(Boolean, default=False, server_default=text('false'), nullable=False)
+    
+    # Объединение лидов из разных источников
+    # NULL - лид канонический, иначе lead_id канонического лида, дубль не обрабатывается
+    canonical_lead_id = Column(String(50))
+    resolved_at = Column(DateTime)  # NULL - лид еще не проходил объединение
+    identity_sources = Column(Text)  # JSON: источник значения каждого поля канонического лида
+    
+    # Аренда батча на обогащение: воркер и срок, после которого батч может взять другой воркер
+    enrich_worker = Column(String(100))
+    enrich_lease_until = Column(DateTime)
+    enrich_attempts = Column(Integer, default=0, server_default='0', nullable=False)
     
     # Метаданные обработки
     processed_at = Column(DateTime)
     last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
 
+# Индексы создаются миграциями 0002, 0004, 0006 и 0008
+Index('ix_leads_not_enriched', Lead.lead_id, postgresql_where=text('debt_amount IS NULL'))
+Index(
+    'ix_leads_target_score', Lead.score.desc(),
+    postgresql_include=['phone', 'fio', 'reason_1', 'reason_2', 'reason_3', 'group_name'],
+    postgresql_where=text('is_target = TRUE')
+)
+Index('ix_leads_inn', Lead.inn, postgresql_where=text('inn IS NOT NULL'))
+Index('ix_leads_phone', Lead.phone, postgresql_where=text('phone IS NOT NULL'))
+Index('ix_leads_unresolved', Lead.lead_id, postgresql_where=text('resolved_at IS NULL'))
+Index('ix_leads_fio_dob', func.lower(Lead.fio), Lead.dob, postgresql_where=text('dob IS NOT NULL'))
+Index('ix_leads_canonical', Lead.canonical_lead_id, postgresql_where=text('canonical_lead_id IS NOT NULL'))
+Index(
+    'ix_leads_enrich_lease', Lead.enrich_lease_until,
+    postgresql_where=text('debt_amount IS NULL AND enrich_lease_until IS NOT NULL')
+)
+Index('ix_leads_scoring_dirty', Lead.lead_id, postgresql_where=text('scoring_dirty AND canonical_lead_id IS NULL'))
+Index('ix_leads_scoring_version', Lead.scoring_version, postgresql_where=text('canonical_lead_id IS NULL'))
+Index(
+    'ix_leads_scored_recent_order', Lead.court_order_date,
+    postgresql_where=text('scored_recent_order AND canonical_lead_id IS NULL')
+)
+
 class ScoringHistory(Base):
     __tablename__ = "scoring_history"
     
@@ -66,6 +106,59 @@ class ErrorLog(Base):
     lead_id = Column(String(50))
     retry_count = Column(Integer, default=0)
 
+class ExternalCache(Base):
+    __tablename__ = "external_cache"
+    
+    source = Column(String(50), primary_key=True)
+    query_key = Column(String(512), primary_key=True)
+    payload = Column(Text)  # JSON разобранного ответа
+    fetched_at = Column(DateTime, default=func.now())
+
+class PipelineJob(Base):
+    __tablename__ = "pipeline_jobs"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String(20), default='queued')  # queued, running, completed, error, cancelled
+    kind = Column(String(20), default='scoring')  # scoring - полная обработка, export - только выгрузка
+    stage = Column(String(50))  # текущий или последний этап
+    filters = Column(Text)  # JSON фильтров скоринга
+    export_format = Column(String(20))
+    # Прогресс для /status: воркер пишет его в таблицу вместе с heartbeat
+    progress = Column(Integer, default=0)
+    message = Column(Text)
+    result = Column(Text)  # JSON результата: файлы выгрузки, статистика, тайминги
+    # Воркер, взявший задание; без heartbeat дольше PIPELINE_JOB_TIMEOUT задание берет другой
+    worker_id = Column(String(100))
+    attempts = Column(Integer, default=0)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    error_message = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime)
+
+Index('ix_pipeline_jobs_pending', PipelineJob.id, postgresql_where=text("status IN ('queued', 'running')"))
+
+class WorkerState(Base):
+    """Лимиты частоты и здоровье прокси процесса воркера для /rate-limits и /proxies"""
+    __tablename__ = "worker_states"
+
+    worker_id = Column(String(100), primary_key=True)
+    rate_limits = Column(Text)  # JSON rate_limiter.get_state()
+    proxies = Column(Text)  # JSON proxy_pool.get_stats()
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class FileCheckpoint(Base):
+    __tablename__ = "file_checkpoints"
+    
+    job_id = Column(Integer, primary_key=True)
+    file_name = Column(String(255), primary_key=True)
+    file_size = Column(BigInteger)
+    # Все строки до этого смещения в байтах уже загружены в leads
+    byte_offset = Column(BigInteger, default=0)
+    completed = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
 # Pydantic модели для API
 class ScoringRequest(BaseModel):
     regions: List[str] = []
@@ -78,6 +171,7 @@ class ScoringRequest(BaseModel):
     only_active_inn: bool = True
 
 class StatusResponse(BaseModel):
+    job_id: Optional[int] = None
     status: str
     progress: int
     stage: str
@@ -1,26 +1,66 @@
 import pandas as pd
+import numpy as np
 import re
 import logging
 from pathlib import Path
 import hashlib
-from typing import List, Optional
-from app.database import SessionLocal
+from typing import List, Optional, Tuple
+from app.database import SessionLocal, engine
 from app.models import Lead
+from sqlalchemy import select
+from sqlalchemy.sql import table, column
 from sqlalchemy.dialects.postgresql import insert
 from app.config import settings
+from app.checkpoints import ShardTracker
+from app.dedup import DuplicateFilter
 import os
+import io
 import csv
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Колонки, которые заполняет нормализация и грузит COPY
+LEAD_COPY_COLUMNS = ['lead_id', 'fio', 'phone', 'inn', 'dob', 'address', 'source', 'tags', 'email', 'created_at']
+
+# Временная таблица живет в рамках соединения, строки очищаются при коммите
+STAGING_TABLE_DDL = (
+    "CREATE TEMP TABLE IF NOT EXISTS leads_staging "
+    "(LIKE leads INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+)
+
+_staging = table('leads_staging', *[column(name) for name in LEAD_COPY_COLUMNS])
+
+# Остальные колонки получают те же значения по умолчанию, что и при insert(Lead)
+STAGING_INSERT = insert(Lead).from_select(
+    LEAD_COPY_COLUMNS, select(*_staging.c)
+).on_conflict_do_nothing(index_elements=['lead_id'])
+
 class DataNormalizer:
-    def __init__(self):
+    def __init__(self, checkpoints=None):
         self.phone_pattern = re.compile(r'[^\d]')
         self.inn_pattern = re.compile(r'^\d{10,12}$')
         self.batch_size = settings.BATCH_SIZE
+        self.vectorized = settings.NORMALIZATION_VECTORIZED
+        self.bulk_load_method = settings.BULK_LOAD_METHOD
+        self.workers = settings.INGESTION_WORKERS
         self.processed_files = set()
+        # JobCheckpoints задания: смещения в файлах переживают перезапуск
+        self.checkpoints = checkpoints
+        # Вызывается с lead_id каждого загруженного батча (потоковый режим)
+        self.on_batch_loaded = None
+        # Фильтр уже загруженных лидов; создается в process_all_files, не в воркерах пула
+        self.duplicate_filter = None
+        # Вызывается с обработанными и общими байтами входных файлов (прогресс для /status)
+        self.on_progress = None
+        # Остановка извне (отмена задания, ошибка этапа потокового режима): загрузка прерывается на следующем чанке
+        self.stop_event = threading.Event()
+        self._file_progress = {}
+        self._total_bytes = 0
 
     def normalize_phone(self, phone: str) -> Optional[str]:
         """Нормализация телефона к формату +7XXXXXXXXXX"""
@@ -85,12 +125,148 @@ class DataNormalizer:
         # Генерация lead_id после нормализации
         normalized['lead_id'] = self._generate_lead_id(normalized)
         return normalized
+
+    def _normalize_phone_column(self, phones: pd.Series) -> np.ndarray:
+        """Векторная версия normalize_phone"""
+        digits = phones.fillna('').astype(str).str.replace(r'[^\d]', '', regex=True)
+        length = digits.str.len()
+        digits = digits.mask(digits.str.startswith('8') & (length == 11), '7' + digits.str[1:])
+
+        full = (digits.str.startswith('7') & (length == 11)).to_numpy()
+        short = (length == 10).to_numpy()
+        empty = (phones.isna() | (phones == '')).to_numpy()
+
+        result = np.full(len(phones), None, dtype=object)
+        result[full] = ('+' + digits[full]).to_numpy()
+        result[short] = ('+7' + digits[short]).to_numpy()
+        result[empty] = None
+        return result
+
+    def _normalize_fio_column(self, fios: pd.Series) -> np.ndarray:
+        """Векторная версия normalize_fio"""
+        # После схлопывания пробелов ФИО - это первые три слова в title case,
+        # что совпадает с результатом normalize_fio для любого числа слов
+        normalized = (
+            fios.fillna('').astype(str)
+            .str.strip()
+            .str.replace(r'\s+', ' ', regex=True)
+            .str.split(' ', n=3).str[:3].str.join(' ')
+            .str.title()
+        )
+        result = normalized.to_numpy(dtype=object)
+        result[(fios.isna() | (fios == '')).to_numpy()] = None
+        return result
+
+    def _normalize_inn_column(self, inns: pd.Series) -> np.ndarray:
+        """Векторная версия приведения ИНН из normalize_row"""
+        # Как и в normalize_row, пропуск (NaN) приводится к строке 'nan', а None и '' - к None
+        result = inns.astype(str).str.strip().to_numpy(dtype=object)
+        result[(inns == '').to_numpy() | np.equal(inns.to_numpy(dtype=object), None)] = None
+        return result
+
+    def normalize_chunk(self, chunk: pd.DataFrame, source: str) -> List[dict]:
+        """Векторная нормализация чанка, результат совпадает с normalize_row для каждой строки"""
+        size = len(chunk)
+        missing = np.full(size, None, dtype=object)
+
+        def column(name: str) -> np.ndarray:
+            return chunk[name].to_numpy(dtype=object) if name in chunk.columns else missing
+
+        fio = self._normalize_fio_column(chunk['fio']) if 'fio' in chunk.columns else missing
+        phone = self._normalize_phone_column(chunk['phone']) if 'phone' in chunk.columns else missing
+        inn = self._normalize_inn_column(chunk['inn']) if 'inn' in chunk.columns else missing
+
+        # lead_id считается по той же строке, что и в _generate_lead_id (None -> 'None')
+        base = (
+            pd.Series(fio, dtype=object).astype(str)
+            + pd.Series(phone, dtype=object).astype(str)
+            + pd.Series(inn, dtype=object).astype(str)
+        )
+        lead_ids = [hashlib.md5(value.encode('utf-8')).hexdigest() for value in base]
+
+        return [
+            {
+                'fio': row[0],
+                'phone': row[1],
+                'inn': row[2],
+                'dob': row[3],
+                'address': row[4],
+                'source': source,
+                'tags': row[5],
+                'email': row[6],
+                'created_at': row[7],
+                'lead_id': row[8]
+            }
+            for row in zip(
+                fio, phone, inn,
+                column('dob'), column('address'), column('tags'),
+                column('email'), column('created_at'), lead_ids
+            )
+        ]
+
+    def _normalize_rows(self, chunk: pd.DataFrame, source: str):
+        """Построчная нормализация чанка"""
+        for _, row in chunk.iterrows():
+            try:
+                yield self.normalize_row(row.to_dict(), source)
+            except Exception as e:
+                logger.warning(f"Ошибка при обработке строки: {e}")
     
-    def bulk_insert_leads(self, leads: list):
+    def _check_stopped(self):
+        if self.stop_event.is_set():
+            raise RuntimeError("загрузка остановлена")
+
+    def bulk_insert_leads(self, leads: list) -> bool:
         """Массовая вставка лидов в БД с обработкой дубликатов"""
+        self._check_stopped()
+        if self.duplicate_filter is not None:
+            leads = self.duplicate_filter.filter(leads)
         if not leads:
-            return
-            
+            return True
+
+        loaded = False
+        if self.bulk_load_method == 'copy':
+            try:
+                self.copy_insert_leads(leads)
+                loaded = True
+            except Exception as e:
+                logger.warning(f"Ошибка COPY-загрузки, используется INSERT: {e}")
+        if not loaded:
+            loaded = self.insert_leads(leads)
+        if loaded and self.on_batch_loaded:
+            self.on_batch_loaded([lead['lead_id'] for lead in leads])
+        return loaded
+
+    def _copy_value(self, value):
+        """Значение для COPY: пропуски передаются как NULL"""
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return '\\N'
+        return value
+
+    def copy_insert_leads(self, leads: list):
+        """Загрузка лидов через COPY во временную таблицу и INSERT ... SELECT"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for lead in leads:
+            writer.writerow([self._copy_value(lead.get(name)) for name in LEAD_COPY_COLUMNS])
+        buffer.seek(0)
+
+        with engine.begin() as conn:
+            conn.exec_driver_sql(STAGING_TABLE_DDL)
+            cursor = conn.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f"COPY leads_staging ({', '.join(LEAD_COPY_COLUMNS)}) "
+                    f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                    buffer
+                )
+            finally:
+                cursor.close()
+            conn.execute(STAGING_INSERT)
+        logger.info(f"Loaded {len(leads)} leads into database via COPY")
+
+    def insert_leads(self, leads: list) -> bool:
+        """Вставка лидов одним INSERT ... VALUES"""
         db = SessionLocal()
         try:
             # Используем bulk insert с обработкой конфликтов
@@ -99,9 +275,11 @@ class DataNormalizer:
             db.execute(stmt)
             db.commit()
             logger.info(f"Inserted {len(leads)} leads into database")
+            return True
         except Exception as e:
             db.rollback()
             logger.error(f"Ошибка при вставке данных: {e}")
+            return False
         finally:
             db.close()
     
@@ -182,65 +360,304 @@ class DataNormalizer:
         else:
             return 'leads'
     
+    def _normalize_csv(self, csv_source, source: str, emit, on_chunk=None) -> int:
+        """Нормализация CSV по чанкам, готовые батчи передаются в emit"""
+        column_mapping = self._get_column_mapping(source)
+        batch = []
+        rows = 0
+        # Всегда используем on_bad_lines='skip' для пропуска некорректных строк
+        for chunk in pd.read_csv(
+            csv_source,
+            chunksize=10000,
+            dtype=str,
+            encoding='utf-8',
+            quoting=csv.QUOTE_MINIMAL,
+            on_bad_lines='skip'
+        ):
+            self._check_stopped()
+            chunk = chunk.rename(columns=column_mapping)
+            if self.vectorized:
+                normalized_rows = self.normalize_chunk(chunk, source)
+            else:
+                normalized_rows = self._normalize_rows(chunk, source)
+            for normalized_row in normalized_rows:
+                if normalized_row['fio']:
+                    batch.append(normalized_row)
+                    rows += 1
+                    if len(batch) >= self.batch_size:
+                        emit(batch)
+                        batch = []
+            if on_chunk:
+                on_chunk(chunk)
+        # Оставшиеся данные
+        if batch:
+            emit(batch)
+        return rows
+
+    def _report_progress(self, name: str, processed_bytes: int):
+        """Обработанные байты файла; общий прогресс передается в on_progress"""
+        self._file_progress[name] = processed_bytes
+        if self.on_progress:
+            self.on_progress(sum(self._file_progress.values()), self._total_bytes)
+
     def process_file(self, file_path: Path):
         """Потоковая обработка CSV файла"""
+        if self.checkpoints is not None:
+            return self.process_file_resumable(file_path)
         source = self._detect_source(file_path.name)
-        column_mapping = self._get_column_mapping(source)
-        batch = []
         file_size = os.path.getsize(file_path)
-        processed_bytes = 0
+
         try:
-            # Всегда используем on_bad_lines='skip' для пропуска некорректных строк
-            for chunk in pd.read_csv(
-                file_path,
-                chunksize=10000,
-                dtype=str,
-                encoding='utf-8',
-                quoting=csv.QUOTE_MINIMAL,
-                on_bad_lines='skip'
-            ):
-                chunk = chunk.rename(columns=column_mapping)
-                for _, row in chunk.iterrows():
-                    try:
-                        normalized_row = self.normalize_row(row.to_dict(), source)
-                        if normalized_row['fio']:
-                            batch.append(normalized_row)
-                            if len(batch) >= self.batch_size:
-                                self.bulk_insert_leads(batch)
-                                batch = []
-                    except Exception as e:
-                        logger.warning(f"Ошибка при обработке строки: {e}")
-                processed_bytes += chunk.memory_usage(index=True, deep=True).sum()
-                progress = min(100, int(processed_bytes / file_size * 100))
-                logger.info(f"File {file_path.name}: {progress}% processed")
-            # Вставка оставшихся данных
-            if batch:
-                self.bulk_insert_leads(batch)
+            with open(file_path, 'rb') as f:
+                def log_progress(chunk: pd.DataFrame):
+                    # Позиция в файле опережает разобранные строки на буфер парсера
+                    processed_bytes = min(f.tell(), file_size)
+                    self._report_progress(file_path.name, processed_bytes)
+                    logger.info(f"File {file_path.name}: {int(processed_bytes / file_size * 100)}% processed")
+
+                self._normalize_csv(f, source, self.bulk_insert_leads, log_progress)
+            self._report_progress(file_path.name, file_size)
             self.processed_files.add(file_path.name)
             return True
         except Exception as e:
             logger.error(f"Ошибка при обработке файла {file_path}: {e}")
             return False
-    
+
+    def process_file_resumable(self, file_path: Path) -> bool:
+        """Обработка файла шардами с сохранением смещения после каждого шарда"""
+        name = file_path.name
+        file_size = os.path.getsize(file_path)
+        offset, completed = self.checkpoints.get_file_offset(name, file_size)
+        if completed:
+            logger.info(f"File {name}: already processed, skipped")
+            self._report_progress(name, file_size)
+            self.processed_files.add(name)
+            return True
+        if offset:
+            logger.info(f"File {name}: resuming from byte {offset}")
+            self._report_progress(name, offset)
+
+        failed = []
+
+        def emit(batch: list):
+            if not self.bulk_insert_leads(batch):
+                failed.append(len(batch))
+
+        try:
+            shard_size = settings.INGESTION_SHARD_SIZE_MB * 1024 * 1024
+            header, shards = self.split_file(file_path, shard_size, offset)
+            for start, end in shards:
+                self.process_shard(file_path, header, start, end, emit)
+                if failed:
+                    raise RuntimeError(f"не загружено батчей: {len(failed)}")
+                self.checkpoints.save_file_offset(name, file_size, end, completed=end >= file_size)
+                self._report_progress(name, end)
+                logger.info(f"File {name}: {int(end / file_size * 100)}% processed")
+            self.checkpoints.save_file_offset(name, file_size, file_size, completed=True)
+            self.processed_files.add(name)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при обработке файла {file_path}: {e}")
+            return False
+
+    def split_file(self, file_path: Path, shard_size: int, offset: int = 0) -> Tuple[bytes, List[Tuple[int, int]]]:
+        """Разбиение файла на диапазоны байт по границам строк.
+
+        Возвращает строку заголовка и список диапазонов [start, end),
+        начиная с offset (граница строки из чекпоинта). Поля с переводом
+        строки внутри кавычек на границе шарда будут отброшены как
+        некорректные строки.
+        """
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            header = f.readline()
+            bounds = [max(f.tell(), offset)]
+            while bounds[-1] + shard_size < file_size:
+                f.seek(bounds[-1] + shard_size)
+                f.readline()
+                if f.tell() >= file_size:
+                    break
+                bounds.append(f.tell())
+        bounds.append(file_size)
+        return header, [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def process_shard(self, file_path: Path, header: bytes, start: int, end: int, emit) -> int:
+        """Нормализация одного шарда файла"""
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return self._normalize_csv(io.BytesIO(header + data), self._detect_source(file_path.name), emit)
+
+    def _load_from_queue(self, queue, tracker: ShardTracker):
+        """Загрузка батчей из очереди воркеров в БД"""
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            key, batch = item
+            try:
+                loaded = self.bulk_insert_leads(batch)
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке батча: {e}")
+                loaded = False
+            if loaded:
+                tracker.batch_loaded(key)
+            else:
+                tracker.mark_failed(key)
+
+    def process_files_parallel(self, files: List[Path]) -> int:
+        """Параллельная нормализация файлов пулом процессов.
+
+        Файлы режутся на шарды, воркеры нормализуют их и кладут батчи
+        в ограниченную очередь. Потоки-загрузчики в основном процессе
+        пишут батчи в БД через bulk_insert_leads; при заполненной очереди
+        воркеры ждут. Если задан чекпоинт задания, смещения файлов
+        сдвигаются по мере загрузки шардов (ShardTracker).
+        """
+        ctx = multiprocessing.get_context('spawn')
+        queue = ctx.Queue(maxsize=settings.INGESTION_QUEUE_SIZE)
+        tracker = ShardTracker(self.checkpoints)
+        loaders = [
+            threading.Thread(target=self._load_from_queue, args=(queue, tracker), daemon=True)
+            for _ in range(settings.INGESTION_DB_WRITERS)
+        ]
+        for loader in loaders:
+            loader.start()
+
+        shard_size = settings.INGESTION_SHARD_SIZE_MB * 1024 * 1024
+        progress = {}
+        failed = set()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_ingestion_worker,
+                initargs=(queue,)
+            ) as pool:
+                futures = {}
+                shard_sizes = {}
+                for file_path in files:
+                    file_size = os.path.getsize(file_path)
+                    offset = 0
+                    if self.checkpoints is not None:
+                        offset, completed = self.checkpoints.get_file_offset(file_path.name, file_size)
+                        if completed:
+                            logger.info(f"File {file_path.name}: already processed, skipped")
+                            self._report_progress(file_path.name, file_size)
+                            self.processed_files.add(file_path.name)
+                            continue
+                    self._report_progress(file_path.name, offset)
+                    header, shards = self.split_file(file_path, shard_size, offset)
+                    tracker.add_file(file_path.name, file_size, shards)
+                    progress[file_path.name] = {'shards': len(shards), 'done': 0, 'rows': 0}
+                    logger.info(f"Начата обработка файла: {file_path.name} ({len(shards)} шардов)")
+                    for index, (start, end) in enumerate(shards):
+                        key = (file_path.name, index)
+                        future = pool.submit(_normalize_shard, str(file_path), header, start, end, key)
+                        futures[future] = key
+                        shard_sizes[key] = end - start
+
+                for future in as_completed(futures):
+                    if self.stop_event.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                    key = futures[future]
+                    name, index = key
+                    file_progress = progress[name]
+                    file_progress['done'] += 1
+                    try:
+                        rows, batches = future.result()
+                        tracker.shard_normalized(key, batches)
+                        file_progress['rows'] += rows
+                        self._report_progress(name, self._file_progress.get(name, 0) + shard_sizes[key])
+                        logger.info(
+                            f"File {name}: shard {index + 1}/{file_progress['shards']} "
+                            f"normalized ({rows} rows), "
+                            f"{file_progress['done']}/{file_progress['shards']} shards done"
+                        )
+                    except Exception as e:
+                        failed.add(name)
+                        tracker.mark_failed(key)
+                        logger.error(f"Ошибка при обработке шарда {index + 1} файла {name}: {e}")
+        finally:
+            for _ in loaders:
+                queue.put(None)
+            for loader in loaders:
+                loader.join()
+
+        for name, file_progress in progress.items():
+            if name in tracker.failed_files():
+                failed.add(name)
+            if name not in failed:
+                self.processed_files.add(name)
+                logger.info(f"File {name}: 100% processed ({file_progress['rows']} rows)")
+        return len(progress) - len(failed)
+
     def process_all_files(self, input_path: str):
         """Обработка всех файлов в папке"""
-        file_count = 0
-        processed_count = 0
         input_path = Path(input_path)
-        
+
         if not input_path.exists():
             logger.error(f"Input path does not exist: {input_path}")
             return 0
-        
-        for file_path in input_path.glob("*.csv"):
-            if not file_path.is_file() or file_path.name in self.processed_files:
-                continue
-                
-            logger.info(f"Начата обработка файла: {file_path.name}")
-            if self.process_file(file_path):
-                processed_count += 1
-            file_count += 1
-            
-        logger.info(f"Обработано файлов: {processed_count}/{file_count}")
+
+        files = [
+            file_path for file_path in input_path.glob("*.csv")
+            if file_path.is_file() and file_path.name not in self.processed_files
+        ]
+
+        self._file_progress = {}
+        self._total_bytes = sum(os.path.getsize(file_path) for file_path in files)
+
+        if settings.INGESTION_DEDUP_ENABLED and files and self.duplicate_filter is None:
+            self.duplicate_filter = DuplicateFilter()
+            self.duplicate_filter.seed()
+
+        if self.workers > 1 and files:
+            processed_count = self.process_files_parallel(files)
+        else:
+            processed_count = 0
+            for file_path in files:
+                if self.stop_event.is_set():
+                    logger.warning("Загрузка остановлена, оставшиеся файлы пропущены")
+                    break
+                logger.info(f"Начата обработка файла: {file_path.name}")
+                if self.process_file(file_path):
+                    processed_count += 1
+
+        logger.info(f"Обработано файлов: {processed_count}/{len(files)}")
+        if self.duplicate_filter is not None:
+            stats = self.duplicate_filter.stats
+            logger.info(
+                f"Отсеяно дублей до записи в БД: {stats['filtered']} из {stats['checked']} "
+                f"(внутри батчей {stats['batch_duplicates']}, проверено в БД {stats['verified']}, "
+                f"ложных срабатываний фильтра {stats['false_positives']}); "
+                f"заполнение фильтра {stats['seeded']} lead_id за {stats['seed_seconds']:.1f} с"
+            )
         return processed_count
-    
\ No newline at end of file
+
+
+# Очередь загрузки в процессе-воркере, задается инициализатором пула
+_load_queue = None
+
+
+def _init_ingestion_worker(queue):
+    global _load_queue
+    _load_queue = queue
+
+
+def _normalize_shard(file_path: str, header: bytes, start: int, end: int, key: tuple) -> Tuple[int, int]:
+    """Задача пула: нормализация шарда с передачей батчей в очередь загрузки.
+
+    Возвращает число строк и число батчей, отправленных в очередь.
+    """
+    normalizer = DataNormalizer()
+    batches = 0
+
+    def emit(batch: list):
+        nonlocal batches
+        _load_queue.put((key, batch))
+        batches += 1
+
+    rows = normalizer.process_shard(Path(file_path), header, start, end, emit)
+    return rows, batches
@@ -0,0 +1,93 @@
+"""Секционирование leads по хешу lead_id на базе, уже обновленной до head.
+
+Миграция 0003 секционирует leads только при первом проходе upgrade
+с -x leads_partitions=N: на базе после head она больше не выполняется,
+а откат до 0002 удалил бы колонки и таблицы следующих миграций. Скрипт
+делает то же пересоздание таблицы на текущей схеме: переносит данные,
+первичный ключ и все индексы leads (определения берутся из pg_indexes),
+версия alembic не меняется. Таблица заблокирована на время переноса,
+запускают в окно обслуживания при остановленных воркерах.
+
+    python -m app.partition_leads --partitions 16
+    python -m app.partition_leads --partitions 0    # обратно в обычную таблицу
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy import text
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+
+def current_partitions(conn) -> int:
+    """Число секций leads, 0 - таблица не секционирована"""
+    partitioned = conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'leads'::regclass)"
+    )).scalar()
+    if not partitioned:
+        return 0
+    return conn.execute(text("SELECT count(*) FROM pg_inherits WHERE inhparent = 'leads'::regclass")).scalar()
+
+
+def rebuild_leads(conn, partitions: int):
+    """Пересоздание leads (секционированной при partitions > 0) с переносом данных и индексов"""
+    indexes = conn.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = 'leads' AND indexname <> 'leads_pkey'"
+    )).all()
+    old_partitions = conn.execute(text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'leads'::regclass"
+    )).scalars().all()
+
+    conn.execute(text("LOCK TABLE leads IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text("ALTER TABLE leads RENAME TO leads_old"))
+    conn.execute(text("ALTER INDEX leads_pkey RENAME TO leads_old_pkey"))
+    for name, _ in indexes:
+        conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}_old"))
+    # Имена секций освобождаются для новой таблицы
+    for name in old_partitions:
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_old"))
+
+    partition_clause = " PARTITION BY HASH (lead_id)" if partitions else ""
+    conn.execute(text(f"CREATE TABLE leads (LIKE leads_old INCLUDING DEFAULTS){partition_clause}"))
+    for remainder in range(partitions):
+        conn.execute(text(
+            f"CREATE TABLE leads_p{remainder} PARTITION OF leads "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        ))
+
+    # Индексы строятся после переноса: так быстрее, чем обновлять их по строке
+    conn.execute(text("INSERT INTO leads SELECT * FROM leads_old"))
+    conn.execute(text("ALTER TABLE leads ADD CONSTRAINT leads_pkey PRIMARY KEY (lead_id)"))
+    for name, definition in indexes:
+        # Индекс секционированной таблицы в pg_indexes записан как ON ONLY
+        conn.execute(text(definition.replace(" ON ONLY ", " ON ")))
+    conn.execute(text("DROP TABLE leads_old"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--partitions', type=int, required=True, help='число секций, 0 - без секционирования')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.partitions == 1 or args.partitions < 0:
+        parser.error("число секций должно быть 0 или не меньше 2")
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        current = current_partitions(conn)
+        if current == args.partitions:
+            logger.info(f"leads уже в нужном виде ({current} секций), изменений нет")
+            return
+        logger.info(f"Пересоздание leads: {current} -> {args.partitions} секций")
+        rebuild_leads(conn, args.partitions)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE leads"))
+    logger.info(f"leads пересоздана за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ответы, которые говорят о неисправности самого прокси, а не источника
+PROXY_FAILURE_STATUSES = {407, 502, 504}
+
+
+class ProxyState:
+    """Здоровье одного прокси: сглаженные задержка и доля ошибок, карантин"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency = None  # EWMA задержки ответа, секунды
+        self.error_rate = 0.0  # EWMA доли неудачных запросов
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.quarantine_level = 0
+        self.quarantined_until = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.quarantined_until
+
+    def get_stats(self, now: float) -> dict:
+        return {
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'failures': self.failures,
+            'quarantined_for': round(max(0.0, self.quarantined_until - now), 1),
+            'quarantine_level': self.quarantine_level
+        }
+
+
+class ProxyPool:
+    """Пул прокси с учетом здоровья.
+
+    Прокси выбирается случайно с весом (1 - доля ошибок) / задержка, так что
+    быстрые прокси получают больше запросов, а медленные все же проверяются.
+    После PROXY_QUARANTINE_FAILURES ошибок подряд прокси уходит в карантин;
+    каждый следующий карантин вдвое длиннее. Уровень снижается на один после
+    PROXY_QUARANTINE_RECOVERY успешных запросов подряд: прокси, который
+    отвечает через раз, не возвращается сразу к самому короткому карантину.
+    """
+
+    def __init__(self):
+        self.proxies: Dict[str, ProxyState] = {}
+
+    def load(self, urls: List[str]):
+        """Обновление списка прокси с сохранением накопленной статистики"""
+        self.proxies = {url: self.proxies.get(url) or ProxyState(url) for url in urls}
+
+    def choose(self) -> Optional[str]:
+        """Прокси для очередного запроса или None, если пул пуст"""
+        if not self.proxies:
+            return None
+        now = time.monotonic()
+        available = [state for state in self.proxies.values() if state.is_available(now)]
+        if not available:
+            # Все в карантине: берем тот, что выйдет из него раньше остальных
+            return min(self.proxies.values(), key=lambda state: state.quarantined_until).url
+
+        known = [state.latency for state in available if state.latency is not None]
+        # Непроверенные прокси считаем не хуже самого быстрого, чтобы их опробовать
+        default_latency = min(known) if known else 1.0
+        weights = [
+            max(1.0 - state.error_rate, 0.01) / max(state.latency or default_latency, 0.001)
+            for state in available
+        ]
+        return random.choices(available, weights=weights)[0].url
+
+    def report_success(self, url: Optional[str], latency: float):
+        state = self.proxies.get(url)
+        if state is None:
+            return
+        alpha = settings.PROXY_EWMA_ALPHA
+        state.requests += 1
+        state.latency = latency if state.latency is None else alpha * latency + (1 - alpha) * state.latency
+        state.error_rate = (1 - alpha) * state.error_rate
+        state.consecutive_failures = 0
+        # Ответы на запросы, ушедшие до карантина, уровень не снижают
+        if state.quarantine_level and state.is_available(time.monotonic()):
+            state.consecutive_successes += 1
+            if state.consecutive_successes >= settings.PROXY_QUARANTINE_RECOVERY:
+                state.quarantine_level -= 1
+                state.consecutive_successes = 0
+
+    def report_failure(self, url: Optional[str]):
+        state = self.proxies.get(url)
+        if state is None:
+            return
+        alpha = settings.PROXY_EWMA_ALPHA
+        state.requests += 1
+        state.failures += 1
+        state.error_rate = alpha + (1 - alpha) * state.error_rate
+        state.consecutive_failures += 1
+        state.consecutive_successes = 0
+        if state.consecutive_failures >= settings.PROXY_QUARANTINE_FAILURES:
+            cooldown = min(
+                settings.PROXY_QUARANTINE_BASE * 2 ** state.quarantine_level,
+                settings.PROXY_QUARANTINE_MAX
+            )
+            state.quarantined_until = time.monotonic() + cooldown
+            state.quarantine_level += 1
+            state.consecutive_failures = 0
+            logger.warning(f"Прокси {url} отправлен в карантин на {cooldown:.0f} с")
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Статистика по прокси"""
+        now = time.monotonic()
+        return {url: state.get_stats(now) for url, state in self.proxies.items()}
+
+
+proxy_pool = ProxyPool()
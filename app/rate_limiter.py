@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах (число или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Токен-бакет для одного хоста с AIMD-подстройкой скорости.
+
+    Каждый успешный ответ прибавляет increase / rate к скорости, то есть
+    около increase запросов в секунду за секунду работы без отказов.
+    Ответ 429 умножает скорость на decrease (не чаще раза в секунду)
+    и, если есть Retry-After, останавливает выдачу токенов до этого момента.
+    """
+
+    def __init__(self, host: str, rate: float, min_rate: float, max_rate: float,
+                 increase: float, decrease: float):
+        self.host = host
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.stats = {'acquired': 0, 'throttled': 0, 'decreases': 0, 'wait_seconds': 0.0}
+        # asyncio.Lock привязывается к циклу событий, а бакет общий для процесса и
+        # переживает asyncio.run каждого этапа воркера: замок свой для каждого цикла
+        self._locks = weakref.WeakKeyDictionary()
+
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = self._locks.get(loop)
+        if lock is None:
+            lock = self._locks[loop] = asyncio.Lock()
+        return lock
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ожидание токена; запросы к хосту выходят по очереди"""
+        started = time.monotonic()
+        async with self._lock():
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        self.stats['acquired'] += 1
+        self.stats['wait_seconds'] += time.monotonic() - started
+
+    def on_success(self):
+        """Аддитивное увеличение скорости"""
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+        self.capacity = max(1.0, self.rate)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Мультипликативное уменьшение скорости после 429"""
+        now = time.monotonic()
+        self.stats['throttled'] += 1
+        if now - self.last_decrease >= 1.0:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.capacity = max(1.0, self.rate)
+            self.last_decrease = now
+            self.stats['decreases'] += 1
+            logger.info(f"Скорость запросов к {self.host} снижена до {self.rate:.2f} rps")
+        self.tokens = 0.0
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def get_state(self) -> dict:
+        return {
+            'rate': round(self.rate, 3),
+            'tokens': round(self.tokens, 3),
+            'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            **{key: round(value, 3) for key, value in self.stats.items()}
+        }
+
+
+class RateLimiterRegistry:
+    """Токен-бакеты по хостам внешних источников"""
+
+    def __init__(self):
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def get(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(
+                host,
+                rate=settings.RATE_LIMIT_HOST_RPS.get(host, settings.RATE_LIMIT_INITIAL_RPS),
+                min_rate=settings.RATE_LIMIT_MIN_RPS,
+                max_rate=settings.RATE_LIMIT_MAX_RPS,
+                increase=settings.RATE_LIMIT_INCREASE,
+                decrease=settings.RATE_LIMIT_DECREASE
+            )
+            self.buckets[host] = bucket
+        return bucket
+
+    def get_state(self) -> Dict[str, dict]:
+        """Текущее состояние бакетов по хостам"""
+        return {host: bucket.get_state() for host, bucket in self.buckets.items()}
+
+
+rate_limiter = RateLimiterRegistry()
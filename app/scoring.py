@@ -1,16 +1,78 @@
 from typing import Dict, List, Tuple
 import logging
-from datetime import datetime, timedelta
-from app.database import AsyncSessionLocal
+from datetime import date, datetime, timedelta
+from app.database import AsyncSessionLocal, iter_keyset_batches, stream_batches
 from app.models import Lead, ScoringHistory
 import asyncio
-from sqlalchemy import text, update
+from sqlalchemy import text, update, select, func
+from sqlalchemy.engine import Row
 from sqlalchemy.dialects.postgresql import insert
 import json
+import hashlib
+import numpy as np
+import pandas as pd
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Поля лида, которые читает скоринг
+SCORING_FIELDS = [
+    'debt_amount', 'debt_type', 'has_property', 'has_court_order',
+    'court_order_date', 'is_bankrupt', 'inn_active', 'debt_count'
+]
+
+# Канонические лиды, которые еще не оценивались или у которых изменились входные данные
+# (scoring_dirty ставят обогащение и объединение), версия правил и фильтров или
+# устарел судебный приказ. Каждое условие идет по своему частичному индексу
+# (миграция 0008), без чтения всей таблицы; "<> версия" записано двумя
+# диапазонами, чтобы его можно было искать по индексу
+NEEDS_SCORING = text("""
+    leads.canonical_lead_id IS NULL AND (
+        leads.scoring_dirty
+        OR leads.scoring_version IS NULL
+        OR leads.scoring_version < CAST(:rules_version AS varchar)
+        OR leads.scoring_version > CAST(:rules_version AS varchar)
+        OR (leads.scored_recent_order AND leads.court_order_date < CAST(:recent_since AS date))
+    )
+""")
+
+# Оценка числа канонических лидов: строки leads (и секций) по статистике
+# планировщика минус дубли по частичному индексу ix_leads_canonical, без чтения таблицы
+CANONICAL_LEADS_ESTIMATE = text("""
+    SELECT greatest(
+        coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint
+            - (SELECT count(*) FROM leads WHERE canonical_lead_id IS NOT NULL),
+        0
+    )
+    FROM pg_class c
+    WHERE c.oid = 'leads'::regclass
+       OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'leads'::regclass)
+""")
+
+BULK_UPDATE_LEADS = text("""
+    UPDATE leads SET
+        score = data.score,
+        is_target = data.is_target,
+        reason_1 = data.reason_1,
+        reason_2 = data.reason_2,
+        reason_3 = data.reason_3,
+        group_name = data.group_name,
+        -- Флаг снова ставит обогащение, когда у лида появятся данные
+        scoring_dirty = FALSE,
+        scoring_version = CAST(:rules_version AS varchar),
+        scored_recent_order = coalesce(leads.court_order_date >= CAST(:recent_since AS date), FALSE)
+    FROM unnest(
+        CAST(:lead_ids AS varchar[]),
+        CAST(:scores AS float8[]),
+        CAST(:is_targets AS boolean[]),
+        CAST(:reasons_1 AS varchar[]),
+        CAST(:reasons_2 AS varchar[]),
+        CAST(:reasons_3 AS varchar[]),
+        CAST(:group_names AS varchar[])
+    ) AS data(lead_id, score, is_target, reason_1, reason_2, reason_3, group_name)
+    WHERE leads.lead_id = data.lead_id
+""")
+
 class ScoringEngine:
     def __init__(self):
         self.scoring_rules = {
@@ -49,7 +111,10 @@ class ScoringEngine:
             # Проверяем, что приказ не старше 3 месяцев
             if 'court_order_date' in lead_data and lead_data['court_order_date']:
                 order_date = lead_data['court_order_date']
-                if datetime.now() - order_date < timedelta(days=90):
+                # В базе court_order_date - дата, сравнение идет по дням
+                if isinstance(order_date, datetime):
+                    order_date = order_date.date()
+                if order_date >= self.recent_order_since():
                     score += self.scoring_rules['recent_court_order']['score']
                     reasons.append("Судебный приказ (последние 3 мес.)")
         
@@ -127,138 +192,308 @@ class ScoringEngine:
         
         return True
     
+    def rules_version(self, filters: Dict) -> str:
+        """Версия правил скоринга, фильтров и порога целевого лида"""
+        payload = json.dumps(
+            {'rules': self.scoring_rules, 'filters': filters, 'threshold': settings.MIN_SCORE_THRESHOLD},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    def recent_order_since(self) -> date:
+        """Самая ранняя дата судебного приказа, который еще считается свежим"""
+        return date.today() - timedelta(days=self.scoring_rules['recent_court_order']['days'])
+
+    def version_params(self, filters: Dict) -> Dict:
+        """Версия правил и граница свежести судебного приказа для NEEDS_SCORING и BULK_UPDATE_LEADS"""
+        return {
+            'rules_version': self.rules_version(filters),
+            'recent_since': self.recent_order_since()
+        }
+
     def is_target(self, score: float, filters: Dict) -> bool:
         """Определение целевого лида"""
         threshold = filters.get('min_score_threshold', settings.MIN_SCORE_THRESHOLD)
         return score >= threshold
 
+    def score_columns(self, columns: Dict[str, np.ndarray], filters: Dict) -> Dict[str, np.ndarray]:
+        """Фильтры и скоринг для батча в колоночном виде.
+
+        Принимает массивы полей лида (SCORING_FIELDS) и возвращает массивы
+        passed, score, is_target, reason_1..reason_3 и group_name. Для строк,
+        прошедших фильтры, результат совпадает с calculate_score; строки
+        без debt_amount (не обогащены) фильтры не проходят.
+        """
+        rules = self.scoring_rules
+        size = len(columns['debt_amount'])
+
+        debt = np.array(columns['debt_amount'], dtype=float)
+        debt_types = pd.Series(columns['debt_type'], dtype=object)
+        bank_mfo = debt_types.isin(['bank', 'mfo']).to_numpy()
+        tax_utility = debt_types.isin(['tax', 'utility']).to_numpy()
+        has_property = np.asarray(columns['has_property'], dtype=object).astype(bool)
+        has_court_order = np.asarray(columns['has_court_order'], dtype=object).astype(bool)
+        is_bankrupt = np.asarray(columns['is_bankrupt'], dtype=object).astype(bool)
+        inn_active = np.asarray(columns['inn_active'], dtype=object).astype(bool)
+        debt_count = np.nan_to_num(np.array(columns['debt_count'], dtype=float)).astype(np.int64)
+
+        # Фильтры
+        passed = ~np.isnan(debt) & ~(debt < filters.get('min_debt_amount', 0))
+        if filters.get('exclude_bankrupts', False):
+            passed &= ~is_bankrupt
+        if filters.get('exclude_no_debt', False):
+            passed &= debt != 0
+        if filters.get('only_with_property', False):
+            passed &= has_property
+        if filters.get('only_bank_mfo_debt', False):
+            passed &= bank_mfo
+        if filters.get('only_recent_court_orders', False):
+            passed &= has_court_order
+        if filters.get('only_active_inn', False):
+            passed &= inn_active
+
+        # Правила считаются только для строк, прошедших фильтры
+        rows = np.flatnonzero(passed)
+        debt, debt_count = debt[rows], debt_count[rows]
+        bank_mfo, tax_utility = bank_mfo[rows], tax_utility[rows]
+        has_property, has_court_order = has_property[rows], has_court_order[rows]
+        is_bankrupt, inn_active = is_bankrupt[rows], inn_active[rows]
+
+        court_order_dates = np.asarray(columns['court_order_date'], dtype=object)[rows]
+        recent_order = has_court_order & np.not_equal(court_order_dates, None)
+        if recent_order.any():
+            # По дням, как calculate_score и scored_recent_order в BULK_UPDATE_LEADS
+            cutoff = np.datetime64(self.recent_order_since(), 'D')
+            order_days = pd.to_datetime(court_order_dates[recent_order]).to_numpy().astype('datetime64[D]')
+            recent_order[recent_order] = order_days >= cutoff
+
+        # Правила в том же порядке, что и в calculate_score
+        checks = [
+            (debt > rules['high_debt']['threshold'], rules['high_debt']['score'],
+             lambda mask: [f"Долг {value:.0f} руб." for value in debt[mask].tolist()]),
+            (bank_mfo, rules['bank_mfo_debt']['score'], "Долг перед банком/МФО"),
+            (~has_property, rules['no_property']['score'], "Нет недвижимости"),
+            (recent_order, rules['recent_court_order']['score'], "Судебный приказ (последние 3 мес.)"),
+            (~is_bankrupt, rules['no_bankruptcy']['score'], "Не банкрот"),
+            (inn_active, rules['active_inn']['score'], "Активный ИНН"),
+            (debt_count >= rules['multiple_debts']['threshold'], rules['multiple_debts']['score'],
+             lambda mask: [f"Множественные долги ({value})" for value in debt_count[mask].tolist()]),
+            ((debt > 0) & (debt < rules['low_debt']['threshold']), rules['low_debt']['score'], "Малый долг"),
+            (tax_utility, rules['tax_utility_only']['score'], "Только налоги/ЖКХ"),
+            (is_bankrupt, rules['is_bankrupt']['score'], "Банкрот"),
+            (~inn_active, rules['dead_inn']['score'], "Неактивный ИНН"),
+        ]
+
+        score = np.zeros(len(rows), dtype=np.int64)
+        reason_count = np.zeros(len(rows), dtype=np.int64)
+        reasons = [np.full(len(rows), None, dtype=object) for _ in range(3)]
+        for mask, points, reason in checks:
+            score += np.where(mask, points, 0)
+            for slot, slot_reasons in enumerate(reasons):
+                slot_mask = mask & (reason_count == slot)
+                if slot_mask.any():
+                    slot_reasons[slot_mask] = reason(slot_mask) if callable(reason) else reason
+            reason_count += mask
+
+        # Группа определяется по score до ограничения, как в _determine_group
+        group = np.select(
+            [
+                (debt > 500000) & has_court_order,
+                bank_mfo & ~has_property,
+                score >= 70,
+                score >= 50,
+            ],
+            ["high_debt_recent_court", "bank_only_no_property", "high_score", "medium_score"],
+            default="low_score"
+        ).astype(object)
+
+        threshold = filters.get('min_score_threshold', settings.MIN_SCORE_THRESHOLD)
+        result = {
+            'passed': passed,
+            'score': np.zeros(size, dtype=np.int64),
+            'is_target': np.zeros(size, dtype=bool),
+            'reason_1': np.full(size, None, dtype=object),
+            'reason_2': np.full(size, None, dtype=object),
+            'reason_3': np.full(size, None, dtype=object),
+            'group_name': np.full(size, None, dtype=object)
+        }
+        result['score'][rows] = np.clip(score, 0, 100)
+        result['is_target'][rows] = result['score'][rows] >= threshold
+        result['reason_1'][rows], result['reason_2'][rows], result['reason_3'][rows] = reasons
+        result['group_name'][rows] = group
+        return result
+
 class ScoringProcessor:
     def __init__(self):
         self.engine = ScoringEngine()
         self.batch_size = settings.BATCH_SIZE
+        self.lean_fetch = settings.SCORING_LEAN_FETCH
+        # Лиды без изменений, пропущенные последним process_all_leads (оценка)
+        self.skipped = 0
+
+    def _batches_to_score(self, db, needs_scoring):
+        """Источник батчей для скоринга"""
+        if self.lean_fetch:
+            # Только нужные скорингу колонки, без ORM-объектов, серверным курсором
+            columns = [Lead.lead_id] + [getattr(Lead, field) for field in SCORING_FIELDS]
+            return stream_batches(
+                select(*columns).where(needs_scoring),
+                Lead.lead_id,
+                self.batch_size
+            )
+        return iter_keyset_batches(
+            db,
+            select(Lead).where(needs_scoring),
+            Lead.lead_id,
+            self.batch_size,
+            scalars=True
+        )
 
     async def process_all_leads(self, filters: Dict):
-        """Обработка всех лидов в базе"""
+        """Обработка всех лидов в базе.
+
+        Оцененные лиды выходят из NEEDS_SCORING, поэтому после перезапуска
+        скоринг продолжается с неоцененных без отдельного чекпоинта.
+        """
         logger.info("Начато вычисление скоринга")
+        needs_scoring = NEEDS_SCORING.bindparams(**self.engine.version_params(filters))
         async with AsyncSessionLocal() as db:
-            # Получаем общее количество лидов для обработки
-            from sqlalchemy import select, func
-            result = await db.execute(
-                select(func.count()).select_from(Lead).where(Lead.score == None)
-            )
+            # Считаются только лиды для скоринга: подсчет всех лидов читал бы всю таблицу,
+            # общее число канонических лидов берется из статистики
+            count_query = select(func.count()).select_from(Lead).where(needs_scoring)
+            result = await db.execute(count_query)
             total_count = result.scalar()
+            canonical_total = (await db.execute(CANONICAL_LEADS_ESTIMATE)).scalar()
+            self.skipped = max(canonical_total - total_count, 0)
             if total_count == 0:
-                logger.info("Нет лидов для скоринга")
-                return
-            logger.info(f"Всего лидов для скоринга: {total_count}")
+                logger.info(f"Нет лидов для скоринга, без изменений пропущено около {self.skipped}")
+                return 0
+            logger.info(f"Всего лидов для скоринга: {total_count}, без изменений пропущено около {self.skipped}")
             # Разбиваем на батчи
             batch_count = (total_count // self.batch_size) + 1
             processed = 0
-            for i in range(batch_count):
-                offset = i * self.batch_size
-                result = await db.execute(
-                    select(Lead).where(Lead.score == None).order_by(Lead.lead_id).limit(self.batch_size).offset(offset)
-                )
-                leads = result.scalars().all()
-                if not leads:
-                    break
-                logger.info(f"Обработка батча {i+1}/{batch_count} ({len(leads)} лидов)")
+            i = 0
+            async for leads in self._batches_to_score(db, needs_scoring):
+                i += 1
+                logger.info(f"Обработка батча {i}/{batch_count} ({len(leads)} лидов)")
                 processed += await self.process_batch(leads, filters, db)
-        logger.info(f"Скоринг завершен. Обработано лидов: {processed}/{total_count}")
+        logger.info(
+            f"Скоринг завершен. Прошли фильтры: {processed}/{total_count}, "
+            f"пропущено без изменений около {self.skipped}"
+        )
         return processed
     
-    async def process_batch(self, leads: List[Lead], filters: Dict, db) -> int:
-        """Обработка батча лидов"""
-        processed_count = 0
+    async def process_lead_ids(self, lead_ids: List[str], filters: Dict, db) -> int:
+        """Скоринг лидов по списку lead_id (потоковый режим)"""
+        columns = [Lead.lead_id] + [getattr(Lead, field) for field in SCORING_FIELDS]
+        result = await db.execute(
+            select(*columns).where(Lead.lead_id.in_(lead_ids), Lead.canonical_lead_id == None)
+        )
+        leads = result.all()
+        if not leads:
+            return 0
+        return await self.process_batch(leads, filters, db)
+
+    async def process_batch(self, leads: list, filters: Dict, db) -> int:
+        """Обработка батча лидов (объекты Lead или строки выборки)"""
         scoring_data = []
         history_data = []
         
         try:
-            for lead in leads:
-                lead_dict = self._lead_to_dict(lead)
-                
-                # Применяем фильтры
-                if not self.engine.apply_filters(lead_dict, filters):
-                    continue
-                
-                # Рассчитываем скоринг
-                score, reasons, group = self.engine.calculate_score(lead_dict)
-                is_target = self.engine.is_target(score, filters)
+            # Фильтры и скоринг считаются сразу для всего батча
+            columns = self._leads_to_columns(leads)
+            result = self.engine.score_columns(columns, filters)
+            filters_used = json.dumps(filters)
+            
+            # Не прошедшие фильтры лиды тоже обновляются: старый скоринг
+            # сбрасывается, состояние скоринга сохраняется
+            for i in np.flatnonzero(~result['passed']):
+                scoring_data.append({
+                    'lead_id': columns['lead_id'][i],
+                    'score': None,
+                    'is_target': False,
+                    'reason_1': None,
+                    'reason_2': None,
+                    'reason_3': None,
+                    'group_name': None
+                })
+            
+            for i in np.flatnonzero(result['passed']):
+                lead_id = columns['lead_id'][i]
+                score = int(result['score'][i])
+                group = result['group_name'][i]
                 
                 # Формируем данные для обновления
                 scoring_data.append({
-                    'lead_id': lead.lead_id,
+                    'lead_id': lead_id,
                     'score': score,
-                    'is_target': is_target,
-                    'reason_1': reasons[0] if len(reasons) > 0 else None,
-                    'reason_2': reasons[1] if len(reasons) > 1 else None,
-                    'reason_3': reasons[2] if len(reasons) > 2 else None,
+                    'is_target': bool(result['is_target'][i]),
+                    'reason_1': result['reason_1'][i],
+                    'reason_2': result['reason_2'][i],
+                    'reason_3': result['reason_3'][i],
                     'group_name': group
                 })
                 
                 # Формируем историю скоринга
                 history_data.append({
-                    'lead_id': lead.lead_id,
+                    'lead_id': lead_id,
                     'score': score,
                     'group_name': group,
-                    'reason_1': reasons[0] if reasons else None,
-                    'filters_used': json.dumps(filters)
+                    'reason_1': result['reason_1'][i],
+                    'filters_used': filters_used
                 })
-                
-                processed_count += 1
             
             # Массовое обновление в БД
-            await self._bulk_update_leads(scoring_data, db)
+            await self._bulk_update_leads(scoring_data, db, self.engine.version_params(filters))
             
             # Сохранение истории скоринга
             if history_data:
                 await self._save_scoring_history(history_data, db)
             
             await db.commit()
-            return processed_count
+            return len(history_data)
         except Exception as e:
             await db.rollback()
             logger.error(f"Ошибка при обработке батча: {e}")
             return 0
     
-    async def _bulk_update_leads(self, leads_data: List[dict], db):
+    async def _bulk_update_leads(self, leads_data: List[dict], db, version_params: Dict):
         """Массовое обновление лидов в БД"""
         if not leads_data:
             return
-            
-        # Формируем CASE выражения для массового обновления
-        update_stmt = """
-            UPDATE leads SET
-                score = data.score,
-                is_target = data.is_target,
-                reason_1 = data.reason_1,
-                reason_2 = data.reason_2,
-                reason_3 = data.reason_3,
-                group_name = data.group_name
-            FROM (VALUES
-        """
-        
-        values = []
-        for data in leads_data:
-            values.append(
-                f"('{data['lead_id']}', {data['score']}, {data['is_target']}, "
-                f"'{data['reason_1'] or ''}', '{data['reason_2'] or ''}', "
-                f"'{data['reason_3'] or ''}', '{data['group_name']}')"
-            )
-        
-        update_stmt += ",\n".join(values)
-        update_stmt += """
-            ) AS data(lead_id, score, is_target, reason_1, reason_2, reason_3, group_name)
-            WHERE leads.lead_id = data.lead_id
-        """
-        
-        await db.execute(text(update_stmt))
+
+        # Данные передаются типизированными массивами: текст запроса не меняется,
+        # и PostgreSQL переиспользует подготовленный план
+        await db.execute(BULK_UPDATE_LEADS, {
+            'lead_ids': [data['lead_id'] for data in leads_data],
+            'scores': [float(data['score']) if data['score'] is not None else None for data in leads_data],
+            'is_targets': [bool(data['is_target']) for data in leads_data],
+            'reasons_1': [data['reason_1'] for data in leads_data],
+            'reasons_2': [data['reason_2'] for data in leads_data],
+            'reasons_3': [data['reason_3'] for data in leads_data],
+            'group_names': [data['group_name'] for data in leads_data],
+            **version_params
+        })
     
     async def _save_scoring_history(self, history_data: List[dict], db):
         """Сохранение истории скоринга"""
         stmt = insert(ScoringHistory).values(history_data)
         await db.execute(stmt)
     
+    def _leads_to_columns(self, leads: list) -> Dict[str, np.ndarray]:
+        """Конвертация батча лидов в колонки для ScoringEngine.score_columns"""
+        if leads and isinstance(leads[0], Row):
+            # Строки выборки транспонируются целиком
+            return {
+                field: np.array(values, dtype=object)
+                for field, values in zip(leads[0]._fields, zip(*leads))
+            }
+        return {
+            field: np.array([getattr(lead, field) for lead in leads], dtype=object)
+            for field in ['lead_id'] + SCORING_FIELDS
+        }
+    
     def _lead_to_dict(self, lead: Lead) -> Dict:
         """Конвертация объекта Lead в словарь"""
         return {
@@ -0,0 +1,222 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import AsyncSessionLocal, iter_keyset_batches
+from app.models import Lead
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimings:
+    """Время работы этапов относительно старта обработки.
+
+    Для каждого этапа хранится время первого и последнего батча,
+    суммарное время работы и число батчей: по пересечению интервалов
+    видно, насколько этапы идут одновременно.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages: Dict[str, dict] = {}
+
+    def record(self, stage: str, started: float, finished: float, items: int = 0):
+        entry = self.stages.setdefault(
+            stage, {'start': started, 'end': finished, 'busy': 0.0, 'batches': 0, 'items': 0}
+        )
+        entry['start'] = min(entry['start'], started)
+        entry['end'] = max(entry['end'], finished)
+        entry['busy'] += finished - started
+        entry['batches'] += 1
+        entry['items'] += items
+
+    def as_dict(self) -> Dict[str, dict]:
+        return {
+            stage: {
+                'start_s': round(entry['start'] - self.origin, 2),
+                'end_s': round(entry['end'] - self.origin, 2),
+                'busy_s': round(entry['busy'], 2),
+                'batches': entry['batches'],
+                'items': entry['items']
+            }
+            for stage, entry in self.stages.items()
+        }
+
+
+class StreamingPipeline:
+    """Потоковый режим: нормализация, обогащение и скоринг идут одновременно.
+
+    Нормализация работает в отдельном потоке и после загрузки каждого
+    батча передает его lead_id в ограниченную очередь обогащения; обогащенные
+    батчи уходят в очередь скоринга. Полные очереди останавливают
+    предыдущий этап. После нормализации обогащаются лиды, оставшиеся
+    необогащенными (ошибки обогащения, загрузка до перезапуска), и
+    оцениваются лиды, которые обогатили, но не оценили до перезапуска.
+    Перед обогащением батч проходит объединение лидов, дальше идут только
+    канонические лиды. Ошибка обогащения или скоринга останавливает
+    нормализацию и остальные этапы. С ENRICHMENT_CLAIM_LEASES батчи
+    арендуются так же, как в воркерах обогащения: лиды, взятые ими,
+    пропускаются, а в конце задание ждет, пока воркеры их допишут.
+    """
+
+    def __init__(self, filters: dict, checkpoints=None, timings: Optional[StageTimings] = None,
+                 on_progress=None):
+        from app.external_sources import ExternalDataEnricher
+        from app.identity import IdentityResolver
+        from app.jobs import default_worker_id
+        from app.leases import EnrichmentLeases
+        from app.normalization import DataNormalizer
+        from app.scoring import ScoringProcessor
+
+        self.filters = filters
+        self.normalizer = DataNormalizer(checkpoints)
+        self.normalizer.on_progress = on_progress
+        self.resolver = IdentityResolver() if settings.IDENTITY_RESOLUTION_ENABLED else None
+        self.enricher = ExternalDataEnricher()
+        self.leases = EnrichmentLeases(default_worker_id()) if settings.ENRICHMENT_CLAIM_LEASES else None
+        self.processor = ScoringProcessor()
+        self.timings = timings or StageTimings()
+        self.enrich_queue = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+        self.score_queue = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+        self.scored = 0
+        # Ставится при ошибке этапа: нормализация перестает ждать место в очереди
+        self.stopped = threading.Event()
+        self.normalizer.stop_event = self.stopped
+
+    def _normalize(self, loop: asyncio.AbstractEventLoop):
+        """Нормализация в рабочем потоке; загруженные батчи уходят в очередь обогащения"""
+        last = time.perf_counter()
+
+        def on_batch_loaded(lead_ids: List[str]):
+            nonlocal last
+            now = time.perf_counter()
+            self.timings.record('normalization', last, now, len(lead_ids))
+            future = asyncio.run_coroutine_threadsafe(self.enrich_queue.put(lead_ids), loop)
+            while True:
+                if self.stopped.is_set():
+                    future.cancel()
+                    raise RuntimeError("потоковая обработка остановлена после ошибки этапа")
+                try:
+                    future.result(timeout=1)
+                    break
+                except concurrent.futures.TimeoutError:
+                    continue
+            last = time.perf_counter()
+
+        self.normalizer.on_batch_loaded = on_batch_loaded
+        return self.normalizer.process_all_files(settings.INPUT_DATA_PATH)
+
+    async def _enrich_batch(self, lead_ids: List[str]):
+        if self.resolver:
+            started = time.perf_counter()
+            count = len(lead_ids)
+            lead_ids = await self.resolver.resolve_lead_ids(lead_ids)
+            self.timings.record('resolution', started, time.perf_counter(), count)
+        started = time.perf_counter()
+        if self.leases:
+            # Лиды, которые обогащают другие воркеры, оценит проход скоринга в конце
+            lead_ids = await self.leases.claim_ids(lead_ids)
+            if lead_ids:
+                await self.enricher.enrich_leased_batch(self.leases, lead_ids)
+        else:
+            await self.enricher.enrich_batch(lead_ids)
+        self.timings.record('enrichment', started, time.perf_counter(), len(lead_ids))
+        if lead_ids:
+            await self.score_queue.put(lead_ids)
+
+    async def _enrich_worker(self):
+        while True:
+            lead_ids = await self.enrich_queue.get()
+            if lead_ids is None:
+                break
+            await self._enrich_batch(lead_ids)
+
+    async def _enrich_remaining(self):
+        """Обогащение лидов, которые не прошли через очередь"""
+        if self.resolver:
+            await self.resolver.resolve_pending()
+        if self.leases:
+            started = time.perf_counter()
+            claimed = await self.enricher.enrich_claimed_leads(self.leases.worker_id, wait_for_others=True)
+            self.timings.record('enrichment', started, time.perf_counter(), claimed)
+            return
+        async with AsyncSessionLocal() as db:
+            async for rows in iter_keyset_batches(
+                db,
+                select(Lead.lead_id).where(Lead.debt_amount == None, Lead.canonical_lead_id == None),
+                Lead.lead_id,
+                self.enricher.batch_size
+            ):
+                await self._enrich_batch([row.lead_id for row in rows])
+
+    async def _score_worker(self):
+        while True:
+            lead_ids = await self.score_queue.get()
+            if lead_ids is None:
+                break
+            started = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                self.scored += await self.processor.process_lead_ids(lead_ids, self.filters, db)
+            self.timings.record('scoring', started, time.perf_counter(), len(lead_ids))
+
+    async def _finish_enrichment(self, enrich_workers: list):
+        for _ in enrich_workers:
+            await self.enrich_queue.put(None)
+        await asyncio.gather(*enrich_workers)
+        await self._enrich_remaining()
+        await self.score_queue.put(None)
+
+    async def _watch(self, awaitable, consumers: list):
+        """Ожидание шага, пока живы обработчики очередей; ошибка обработчика прерывает обработку"""
+        step = asyncio.ensure_future(awaitable)
+        pending = {step, *consumers}
+        try:
+            while not step.done():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not step and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+            return step.result()
+        finally:
+            if not step.done():
+                step.cancel()
+                await asyncio.gather(step, return_exceptions=True)
+
+    async def run(self) -> Dict[str, dict]:
+        """Запуск всех этапов, возвращает их тайминги"""
+        loop = asyncio.get_running_loop()
+        if self.leases:
+            await self.leases.reset_attempts()
+        enrich_workers = [
+            asyncio.create_task(self._enrich_worker())
+            for _ in range(settings.PIPELINE_ENRICH_WORKERS)
+        ]
+        score_worker = asyncio.create_task(self._score_worker())
+        consumers = enrich_workers + [score_worker]
+        normalization = asyncio.ensure_future(asyncio.to_thread(self._normalize, loop))
+        try:
+            await self._watch(asyncio.shield(normalization), consumers)
+            await self._watch(self._finish_enrichment(enrich_workers), consumers)
+            await score_worker
+            # Лиды, обогащенные до перезапуска, но не оцененные: скоринг инкрементальный
+            self.scored += await self.processor.process_all_leads(self.filters)
+        finally:
+            self.stopped.set()
+            for task in consumers:
+                task.cancel()
+            # Поток нормализации заметит остановку и завершится до закрытия обогащения
+            await asyncio.gather(normalization, *consumers, return_exceptions=True)
+            await self.enricher.close()
+
+        timings = self.timings.as_dict()
+        logger.info(
+            f"Потоковая обработка завершена: обогащено {self.enricher.total_enriched}, "
+            f"прошли фильтры {self.scored}. Этапы: {timings}"
+        )
+        return timings
@@ -2,20 +2,32 @@ import pandas as pd
 import logging
 from typing import List, Dict
 from pathlib import Path
-import csv
 from datetime import datetime
-from app.database import AsyncSessionLocal, engine
+from app.database import AsyncSessionLocal
 import os
 import json
 import asyncio
+import threading
 from sqlalchemy import text
-import aiofiles
 from app.config import settings
 from app.models import ErrorLog
-import shutil
 
 logger = logging.getLogger(__name__)
 
+async def run_stoppable(func, stop_event: threading.Event, *args, **kwargs):
+    """func в рабочем потоке; при отмене ставит stop_event и ждет, пока поток остановится.
+
+    Отмена asyncio.to_thread не прерывает сам поток: без флага нормализация
+    или экспорт отмененного задания продолжали бы писать в БД и файлы.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        stop_event.set()
+        await asyncio.gather(future, return_exceptions=True)
+        raise
+
 class FileManager:
     def __init__(self):
         self.ensure_directories()
@@ -26,43 +38,18 @@ class FileManager:
         Path(settings.OUTPUT_DATA_PATH).mkdir(parents=True, exist_ok=True)
         Path(settings.LOGS_PATH).mkdir(parents=True, exist_ok=True)
     
-    async def export_target_leads(self, filename: str = 'scoring_ready.csv') -> str:
-        """Экспорт целевых лидов в CSV с использованием потоковой выгрузки"""
-        output_path = Path(settings.OUTPUT_DATA_PATH) / filename
-        temp_path = output_path.with_suffix('.tmp')
+    async def export_target_leads(self, filename: str = None, export_format: str = None) -> str:
+        """Экспорт целевых лидов через COPY вне цикла событий"""
+        from app.export import EXPORT_FORMATS, TargetLeadsExporter
+        export_format = export_format or settings.EXPORT_FORMAT
+        output_path = Path(settings.OUTPUT_DATA_PATH) / (filename or EXPORT_FORMATS[export_format][0])
         
         try:
-            # Используем серверную выгрузку данных
-            with engine.connect() as conn:
-                result = conn.execute(
-                    text("""
-                    SELECT phone, fio, score, reason_1, reason_2, reason_3, group_name as group
-                    FROM leads 
-                    WHERE is_target = TRUE 
-                    ORDER BY score DESC
-                    """)
-                )
-                # Потоковая запись в CSV
-                async with aiofiles.open(temp_path, 'w', encoding='utf-8', newline='') as f:
-                    writer = csv.writer(f)
-                    await writer.writerow(['phone', 'fio', 'score', 'reason_1', 'reason_2', 'reason_3', 'group'])
-                    batch = []
-                    for row in result:
-                        batch.append(tuple(row))
-                        if len(batch) >= 10000:
-                            await writer.writerows(batch)
-                            batch = []
-                    if batch:
-                        await writer.writerows(batch)
-                
-            # Переименовываем после успешной записи
-            shutil.move(temp_path, output_path)
+            exporter = TargetLeadsExporter(export_format=export_format)
+            await run_stoppable(exporter.export, exporter.stop_event, output_path)
             return str(output_path)
-            
         except Exception as e:
             logger.error(f"Ошибка при экспорте данных: {e}")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
             return None
 
     def get_input_files_info(self) -> List[dict]:
@@ -158,6 +145,7 @@ class PipelineManager:
     def __init__(self):
         self.stages = {
             'normalization': self.run_normalization,
+            'resolution': self.run_resolution,
             'enrichment': self.run_enrichment,
             'scoring': self.run_scoring,
             'export': self.run_export
@@ -165,23 +153,39 @@ class PipelineManager:
         self.file_manager = FileManager()
         self.log_manager = LogManager()
     
-    def run_normalization(self):
+    def run_normalization(self, checkpoints=None, on_progress=None, stop_event=None):
+        """Синхронная нормализация; вызывается в рабочем потоке, не в цикле событий"""
         from app.normalization import DataNormalizer
-        normalizer = DataNormalizer()
+        normalizer = DataNormalizer(checkpoints)
+        normalizer.on_progress = on_progress
+        if stop_event is not None:
+            normalizer.stop_event = stop_event
         return normalizer.process_all_files(settings.INPUT_DATA_PATH)
     
+    async def run_resolution(self):
+        from app.identity import IdentityResolver
+        return await IdentityResolver().resolve_pending()
+    
     async def run_enrichment(self):
         from app.external_sources import ExternalDataEnricher
         enricher = ExternalDataEnricher()
-        await enricher.enrich_all_leads()
+        try:
+            await enricher.enrich_all_leads()
+        finally:
+            await enricher.close()
+    
+    async def run_streaming(self, filters: dict, checkpoints=None, timings=None, on_progress=None):
+        from app.streaming import StreamingPipeline
+        return await StreamingPipeline(filters, checkpoints, timings, on_progress).run()
     
     async def run_scoring(self, filters: dict):
         from app.scoring import ScoringProcessor
         processor = ScoringProcessor()
-        await processor.process_all_leads(filters)
+        scored = await processor.process_all_leads(filters)
+        return {'scored': scored, 'skipped': processor.skipped}
     
-    async def run_export(self):
-        return await self.file_manager.export_target_leads()
+    async def run_export(self, export_format: str = None):
+        return await self.file_manager.export_target_leads(export_format=export_format)
     
     async def get_database_stats(self) -> dict:
         """Получение статистики по базе данных"""
@@ -202,10 +206,15 @@ class PipelineManager:
             result = await db.execute(text("SELECT COUNT(*) FROM leads WHERE is_target = TRUE"))
             target_leads = result.scalar()
             
+            # Количество дублей, объединенных с каноническими лидами
+            result = await db.execute(text("SELECT COUNT(*) FROM leads WHERE canonical_lead_id IS NOT NULL"))
+            merged_leads = result.scalar()
+            
             return {
                 'total_leads': total_leads,
                 'enriched_leads': enriched_leads,
                 'scored_leads': scored_leads,
-                'target_leads': target_leads
+                'target_leads': target_leads,
+                'merged_leads': merged_leads
             }
             
\ No newline at end of file
@@ -0,0 +1,307 @@
+"""Воркер заданий обработки.
+
+Берет задания из очереди pipeline_jobs (FOR UPDATE SKIP LOCKED), выполняет
+этапы и пишет прогресс в таблицу вместе с heartbeat. Веб-приложение только
+ставит задания в очередь и показывает их статус. Воркеров можно запустить
+несколько, в процессах или контейнерах на одной БД: задание остановленного
+воркера подхватывает другой. Задания пишут общие скоринг и файл выгрузки,
+поэтому выполняются по одному (pg_advisory_lock), остальные ждут блокировку
+с heartbeat.
+С --enrichment воркер не берет задания, а обогащает лиды батчами
+вместе с этапом обогащения выполняемого задания.
+
+    python -m app.worker
+    python -m app.worker --once
+    python -m app.worker --enrichment
+"""
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import threading
+import time
+from typing import Optional
+
+from app.checkpoints import JobCheckpoints
+from app.config import settings
+from app.jobs import claim_job, default_worker_id, finish_job, heartbeat_job, job_lock, publish_worker_state
+from app.proxy_pool import proxy_pool
+from app.rate_limiter import rate_limiter
+from app.streaming import StageTimings
+from app.utils import PipelineManager, run_stoppable
+
+logger = logging.getLogger(__name__)
+
+
+class JobState:
+    """Прогресс выполняемого задания; в pipeline_jobs его пишет heartbeat воркера"""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.stage = job.stage or ""
+        self.progress = job.progress or 0
+        self.message = job.message or ""
+
+
+def stage_progress(state: JobState, stage_index: int, total_stages: int, stage_message: str):
+    """Колбэк прогресса нормализации: вызывается из рабочего потока, состояние меняется в цикле событий"""
+    loop = asyncio.get_running_loop()
+
+    def apply(done_bytes: int, total_bytes: int):
+        fraction = done_bytes / total_bytes if total_bytes else 1.0
+        state.progress = int((stage_index + fraction) / total_stages * 100)
+        state.message = (
+            f"{stage_message}: {fraction:.0%} "
+            f"({done_bytes / 1024 / 1024:.0f} из {total_bytes / 1024 / 1024:.0f} МБ)"
+        )
+
+    def on_progress(done_bytes: int, total_bytes: int):
+        loop.call_soon_threadsafe(apply, done_bytes, total_bytes)
+
+    return on_progress
+
+
+async def run_processing_pipeline(pipeline: PipelineManager, job, state: JobState) -> dict:
+    """Этапы задания с сохраненного этапа; результат для pipeline_jobs.result"""
+    filters = json.loads(job.filters) if job.filters else {}
+    export_format = job.export_format or settings.EXPORT_FORMAT
+    checkpoints = JobCheckpoints(job.id)
+    timings = StageTimings()
+    if job.kind == "export":
+        stages = [("export", "Экспорт результатов", {"export_format": export_format})]
+    elif settings.PIPELINE_STREAMING:
+        stages = [
+            ("streaming", "Потоковая обработка данных", {
+                "filters": filters, "checkpoints": checkpoints, "timings": timings
+            }),
+            ("export", "Экспорт результатов", {"export_format": export_format})
+        ]
+    else:
+        stages = [("normalization", "Нормализация данных", {"checkpoints": checkpoints})]
+        if settings.IDENTITY_RESOLUTION_ENABLED:
+            stages.append(("resolution", "Объединение лидов из разных источников", {}))
+        stages += [
+            ("enrichment", "Обогащение данных", {}),
+            ("scoring", "Расчет скоринга", {"filters": filters}),
+            ("export", "Экспорт результатов", {"export_format": export_format})
+        ]
+
+    total_stages = len(stages)
+    # Завершенные до перезапуска этапы пропускаются
+    stage_names = [stage_name for stage_name, _, _ in stages]
+    first_stage = stage_names.index(job.stage) if job.stage in stage_names else 0
+    state.progress = int((first_stage / total_stages) * 100)
+
+    for i, (stage_name, stage_message, stage_args) in enumerate(stages):
+        if i < first_stage:
+            continue
+        await checkpoints.set_stage(stage_name)
+        state.stage = stage_name
+        state.message = stage_message
+        state.progress = int((i / total_stages) * 100)
+
+        started = time.perf_counter()
+        func = getattr(pipeline, f"run_{stage_name}")
+        if stage_name in ("normalization", "streaming"):
+            stage_args = {**stage_args, "on_progress": stage_progress(state, i, total_stages, stage_message)}
+        if asyncio.iscoroutinefunction(func):
+            stage_result = await func(**stage_args)
+        else:
+            # Синхронные этапы идут в рабочем потоке, heartbeat задания не прерывается;
+            # при отмене задания поток останавливается флагом
+            stop_event = threading.Event()
+            stage_result = await run_stoppable(func, stop_event, stop_event=stop_event, **stage_args)
+        if stage_name != "streaming":
+            # Потоковый режим сам пишет тайминги своих этапов
+            timings.record(stage_name, started, time.perf_counter())
+
+        state.progress = int(((i + 1) / total_stages) * 100)
+
+    # Результат экспорта - путь к файлу выгрузки
+    output_file = stage_result
+    if not output_file:
+        raise Exception("Ошибка при экспорте результатов")
+
+    result = {
+        "output_file": output_file,
+        "export_format": export_format,
+        "exports": {export_format: output_file}
+    }
+    if job.kind == "export":
+        state.message = f"Выгрузка в формате {export_format} готова"
+        return result
+
+    stats = await pipeline.get_database_stats()
+    state.message = f"Обработка завершена. Найдено {stats['target_leads']} целевых лидов"
+    result.update({
+        "target_count": stats['target_leads'],
+        "stats": stats,
+        "stage_timings": timings.as_dict()
+    })
+    logger.info(f"Тайминги этапов задания {job.id}: {result['stage_timings']}")
+    return result
+
+
+class PipelineWorker:
+    """Цикл воркера: задание из очереди, выполнение с heartbeat, следующее задание"""
+
+    def __init__(self, worker_id: Optional[str] = None, pipeline: Optional[PipelineManager] = None):
+        self.worker_id = worker_id or default_worker_id()
+        self.pipeline = pipeline or PipelineManager()
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        """Остановка после сигнала: новые задания не берутся, текущее прерывается.
+
+        Прерванное задание остается в работе без heartbeat и через
+        PIPELINE_JOB_TIMEOUT продолжается другим воркером с чекпоинтов.
+        """
+        logger.info(f"Воркер {self.worker_id} останавливается")
+        self.stopping.set()
+
+    async def run(self, once: bool = False):
+        logger.info(f"Воркер {self.worker_id} запущен")
+        publisher = asyncio.create_task(self._publish_state())
+        try:
+            await self._run_jobs(once)
+        finally:
+            publisher.cancel()
+        logger.info(f"Воркер {self.worker_id} остановлен")
+
+    async def _run_jobs(self, once: bool):
+        while not self.stopping.is_set():
+            try:
+                job = await claim_job(self.worker_id)
+            except Exception as e:
+                logger.error(f"Ошибка при выборке задания из очереди: {e}")
+                job = None
+            if job is not None:
+                try:
+                    await self.run_job(job)
+                except Exception as e:
+                    # Задание без записанного итога продолжит другой воркер после PIPELINE_JOB_TIMEOUT
+                    logger.error(f"Ошибка воркера при выполнении задания {job.id}: {e}")
+            if once:
+                break
+            if job is None:
+                await self._sleep(settings.PIPELINE_POLL_INTERVAL)
+
+    async def run_enrichment(self):
+        """Только обогащение: батчи лидов из leads, пока воркер не остановят"""
+        from app.external_sources import ExternalDataEnricher
+        logger.info(f"Воркер обогащения {self.worker_id} запущен")
+        enricher = ExternalDataEnricher()
+        publisher = asyncio.create_task(self._publish_state())
+        try:
+            while not self.stopping.is_set():
+                try:
+                    claimed = await enricher.enrich_claimed_leads(
+                        self.worker_id, wait_for_others=False, stopping=self.stopping
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка воркера обогащения: {e}")
+                    claimed = 0
+                if not claimed:
+                    await self._sleep(settings.PIPELINE_POLL_INTERVAL)
+        finally:
+            publisher.cancel()
+            await enricher.close()
+        logger.info(f"Воркер обогащения {self.worker_id} остановлен, обогащено {enricher.total_enriched} лидов")
+
+    async def _publish_state(self):
+        """Лимиты частоты и прокси этого процесса в worker_states, для /rate-limits и /proxies"""
+        while not self.stopping.is_set():
+            rate_limits, proxies = rate_limiter.get_state(), proxy_pool.get_stats()
+            if rate_limits or proxies:
+                try:
+                    await publish_worker_state(self.worker_id, rate_limits, proxies)
+                except Exception as e:
+                    logger.error(f"Ошибка публикации состояния воркера {self.worker_id}: {e}")
+            await self._sleep(settings.PIPELINE_HEARTBEAT_INTERVAL)
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run_job(self, job):
+        logger.info(f"Воркер {self.worker_id} выполняет задание {job.id} ({job.kind}, попытка {job.attempts})")
+        state = JobState(job)
+        task = asyncio.create_task(self._run_locked(job, state))
+        stopping = asyncio.create_task(self.stopping.wait())
+        try:
+            while not task.done():
+                await asyncio.wait(
+                    {task, stopping},
+                    timeout=settings.PIPELINE_HEARTBEAT_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if task.done():
+                    break
+                if self.stopping.is_set():
+                    await self._cancel(task)
+                    return
+                if not await self._heartbeat(state):
+                    logger.warning(f"Задание {job.id} отменено или передано другому воркеру, выполнение прервано")
+                    await self._cancel(task)
+                    return
+        finally:
+            stopping.cancel()
+
+        try:
+            result = task.result()
+        except Exception as e:
+            logger.exception(f"Ошибка в задании {job.id}")
+            await finish_job(job.id, "error", str(e), message=f"Ошибка: {str(e)}")
+            return
+        await finish_job(job.id, "completed", message=state.message, result=result)
+        logger.info(f"Задание {job.id} завершено: {state.message}")
+
+    async def _run_locked(self, job, state: JobState) -> dict:
+        message = state.message
+        state.message = "Ожидание завершения другого задания"
+        async with job_lock():
+            state.message = message
+            return await run_processing_pipeline(self.pipeline, job, state)
+
+    async def _heartbeat(self, state: JobState) -> bool:
+        try:
+            return await heartbeat_job(state.job_id, self.worker_id, state.stage, state.progress, state.message)
+        except Exception as e:
+            # Сбой связи с БД не прерывает задание; без heartbeat его со временем заберет другой воркер
+            logger.error(f"Ошибка heartbeat задания {state.job_id}: {e}")
+            return True
+
+    @staticmethod
+    async def _cancel(task: asyncio.Task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-id', help='имя воркера в pipeline_jobs.worker_id, по умолчанию хост:pid')
+    parser.add_argument('--once', action='store_true', help='выполнить одно задание из очереди и выйти')
+    parser.add_argument(
+        '--enrichment', action='store_true',
+        help='не брать задания, а обогащать арендованные батчи лидов вместе с воркерами заданий'
+    )
+    args = parser.parse_args(argv)
+
+    async def serve():
+        worker = PipelineWorker(args.worker_id)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, worker.stop)
+        if args.enrichment:
+            await worker.run_enrichment()
+        else:
+            await worker.run(once=args.once)
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Сравнение загрузчиков лидов: INSERT ... VALUES и COPY через временную таблицу.
+
+Нужна локальная PostgreSQL из DATABASE_URL. Синтетические лиды
+удаляются после замера.
+
+    python -m benchmarks.bulk_load_benchmark --rows 200000
+"""
+import argparse
+import time
+
+from sqlalchemy import delete
+
+from app.database import SessionLocal
+from app.models import Lead
+from app.normalization import DataNormalizer
+from benchmarks.normalization_benchmark import make_chunk
+from benchmarks.schema import upgrade_schema
+
+
+def make_leads(rows: int, prefix: str) -> list:
+    normalizer = DataNormalizer()
+    leads = [row for row in normalizer.normalize_chunk(make_chunk(rows), 'fns') if row['fio']]
+    # Уникальные lead_id, чтобы замер не упирался в ON CONFLICT
+    for index, lead in enumerate(leads):
+        lead['lead_id'] = f"{prefix}{index:012d}"
+        lead['dob'] = None
+    return leads
+
+
+def run(loader, leads: list, batch_size: int) -> float:
+    started = time.perf_counter()
+    for i in range(0, len(leads), batch_size):
+        loader(leads[i:i + batch_size])
+    return time.perf_counter() - started
+
+
+def cleanup(prefix: str):
+    db = SessionLocal()
+    try:
+        db.execute(delete(Lead).where(Lead.lead_id.like(f"{prefix}%")))
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    upgrade_schema()
+    normalizer = DataNormalizer()
+
+    for name, loader, prefix in [
+        ('INSERT ... VALUES', normalizer.insert_leads, 'bench-insert-'),
+        ('COPY + INSERT ... SELECT', normalizer.copy_insert_leads, 'bench-copy-'),
+    ]:
+        leads = make_leads(args.rows, prefix)
+        cleanup(prefix)
+        try:
+            elapsed = run(loader, leads, args.batch_size)
+        finally:
+            cleanup(prefix)
+        print(f'{name:<26} {len(leads) / elapsed:,.0f} строк/с ({elapsed:.1f} с)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Фильтр Блума для отсева дублей при загрузке: ложные срабатывания и скорость.
+
+Заполняет BloomFilter lead_id уже загруженных лидов, затем проверяет
+поток батчей с заданной долей дублей (как при пересекающихся файлах
+источников). Выводит скорость заполнения и проверки, долю ложных
+срабатываний на новых lead_id (их проверяет запрос к БД) и долю батча,
+которая не дойдет до записи в БД. База не нужна.
+
+    python -m benchmarks.dedup_benchmark --existing 10000000 --size-mb 32
+"""
+import argparse
+import hashlib
+import time
+
+import numpy as np
+
+from app.dedup import BloomFilter
+
+
+def lead_ids(prefix: str, start: int, count: int) -> list:
+    return [hashlib.md5(f'{prefix}{i}'.encode('utf-8')).hexdigest() for i in range(start, start + count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--existing', type=int, default=10000000)
+    parser.add_argument('--incoming', type=int, default=2000000)
+    parser.add_argument('--duplicate-share', type=float, default=0.3)
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--hashes', type=int, default=7)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    bloom = BloomFilter(args.size_mb, args.hashes)
+    bits_per_key = bloom.words.size * 64 / args.existing
+    print(f"Фильтр {bloom.words.nbytes / 1024 / 1024:.0f} МБ, {bits_per_key:.1f} бит на ключ, k={args.hashes}")
+
+    elapsed = 0.0
+    step = 100000
+    for start in range(0, args.existing, step):
+        chunk = lead_ids('old', start, min(step, args.existing - start))
+        started = time.perf_counter()
+        bloom.add(chunk)
+        elapsed += time.perf_counter() - started
+    print(f"Заполнение: {args.existing / elapsed:,.0f} lead_id/с ({elapsed:.1f} с)")
+
+    duplicates = int(args.incoming * args.duplicate_share)
+    incoming = lead_ids('old', 0, duplicates) + lead_ids('new', 0, args.incoming - duplicates)
+    is_duplicate = np.r_[np.ones(duplicates, dtype=bool), np.zeros(args.incoming - duplicates, dtype=bool)]
+    order = np.random.default_rng(42).permutation(args.incoming)
+    incoming = [incoming[i] for i in order]
+    is_duplicate = is_duplicate[order]
+
+    found = np.zeros(args.incoming, dtype=bool)
+    started = time.perf_counter()
+    for start in range(0, args.incoming, args.batch_size):
+        batch = incoming[start:start + args.batch_size]
+        seen = bloom.contains(batch)
+        bloom.add([lead_id for lead_id, hit in zip(batch, seen) if not hit])
+        found[start:start + len(batch)] = seen
+    elapsed = time.perf_counter() - started
+
+    missed = int((is_duplicate & ~found).sum())
+    false_positives = int((~is_duplicate & found).sum())
+    new = args.incoming - duplicates
+    print(f"Проверка батчей: {args.incoming / elapsed:,.0f} lead_id/с")
+    print(f"Дублей найдено: {duplicates - missed}/{duplicates} (пропусков должно быть 0: {missed})")
+    print(
+        f"Ложные срабатывания: {false_positives}/{new} новых ({false_positives / max(new, 1):.3%}), "
+        f"проверяются запросом к БД"
+    )
+    print(f"Не дойдет до записи в БД: {duplicates / args.incoming:.1%} строк")
+
+
+if __name__ == '__main__':
+    main()
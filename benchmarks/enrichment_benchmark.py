@@ -0,0 +1,144 @@
+"""Нагрузочный замер ExternalDataEnricher против локальных источников.
+
+Запускает app.mock_sources отдельным процессом, заполняет leads
+синтетическими необогащенными лидами и прогоняет enrich_all_leads.
+Выводит лидов в секунду, запросы, 429, ошибки, повторы и объединенные
+дубли по источникам и перцентили задержки обогащения лида. Нужна
+PostgreSQL из DATABASE_URL; в базе не должно быть других необогащенных лидов.
+
+    python -m benchmarks.enrichment_benchmark --leads 20000 --latency-ms 80 --rate-429 0.01
+    python -m benchmarks.enrichment_benchmark --leads 20000 --distinct-inn 5000
+    python -m benchmarks.enrichment_benchmark --proxy 10 --proxy 300 --proxy 10:0.5 --dead-proxies 1
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+import urllib.request
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+from app.external_sources import ExternalDataEnricher
+from app.mock_sources import SOURCE_PATHS, proxy_urls, source_urls
+from app.proxy_pool import proxy_pool
+from benchmarks.schema import upgrade_schema
+
+PREFIX = 'bench-enrich-'
+
+
+def populate(leads: int, distinct_inn: int):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            INSERT INTO leads (lead_id, fio, phone, inn, source)
+            SELECT :prefix || lpad(g::text, 10, '0'),
+                   'Иванов' || g || ' Иван Иванович',
+                   '+7999' || lpad(g::text, 7, '0'),
+                   lpad((770000000000 + g % :distinct_inn)::text, 12, '0'),
+                   'bench'
+            FROM generate_series(1, :leads) AS g
+            ON CONFLICT (lead_id) DO NOTHING
+            """),
+            {'prefix': PREFIX, 'leads': leads, 'distinct_inn': distinct_inn}
+        )
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+def start_mock_sources(args) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'app.mock_sources',
+            '--host', args.host, '--port', str(args.port),
+            '--latency-ms', str(args.latency_ms), '--latency-sigma', str(args.latency_sigma),
+            '--rate-429', str(args.rate_429), '--error-rate', str(args.error_rate),
+            '--rps-limit', str(args.rps_limit),
+            *[f'--source-latency={item}' for item in args.source_latency],
+            *[f'--proxy={item}' for item in args.proxy]
+        ],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    # Сервер печатает по строке на источник и прокси после запуска
+    for _ in range(len(SOURCE_PATHS) + len(args.proxy)):
+        process.stdout.readline()
+    return process
+
+
+def mock_stats(args) -> dict:
+    stats = {}
+    for index, name in enumerate(SOURCE_PATHS):
+        with urllib.request.urlopen(f'http://{args.host}:{args.port + index}/_stats') as response:
+            stats[name] = json.loads(response.read())
+    return stats
+
+
+async def run() -> tuple:
+    enricher = ExternalDataEnricher()
+    started = time.perf_counter()
+    try:
+        await enricher.enrich_all_leads()
+    finally:
+        await enricher.close()
+    return enricher, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--leads', type=int, default=20000)
+    parser.add_argument('--distinct-inn', type=int, default=0, help='число разных ИНН, по умолчанию у каждого лида свой')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rps-limit', type=float, default=0.0)
+    parser.add_argument('--source-latency', action='append', default=[], metavar='SOURCE=MS')
+    parser.add_argument('--cache', action='store_true', help='не отключать кэш внешних источников')
+    parser.add_argument('--proxy', action='append', default=[], metavar='MS[:FAILURE_RATE]')
+    parser.add_argument('--dead-proxies', type=int, default=0, help='добавить недоступные прокси в пул')
+    args = parser.parse_args()
+
+    settings.SOURCE_URLS = source_urls(args.host, args.port)
+    settings.PROXY_LIST = proxy_urls(args.host, args.port, len(args.proxy)) + [
+        f'http://{args.host}:{9 + index}' for index in range(args.dead_proxies)
+    ]
+    settings.CACHE_ENABLED = args.cache
+
+    upgrade_schema()
+    process = start_mock_sources(args)
+    populate(args.leads, args.distinct_inn or args.leads)
+    try:
+        enricher, elapsed = asyncio.run(run())
+        server_stats = mock_stats(args)
+    finally:
+        cleanup()
+        process.terminate()
+        process.wait()
+
+    print(f'обогащено {enricher.total_enriched} лидов за {elapsed:.1f} с: '
+          f'{enricher.total_enriched / elapsed:,.1f} лидов/с')
+    print(f'задержка лида: {enricher.get_latency_stats()}')
+    print(f'{"источник":<10} {"запросы":>8} {"429":>6} {"ошибки":>7} {"повторы":>8} {"дубли":>6} {"сервер ok":>10}')
+    client_stats = enricher.get_request_stats()
+    for name in SOURCE_PATHS:
+        client = client_stats.get(name, {})
+        print(
+            f'{name:<10} {client.get("requests", 0):>8} {client.get("throttled", 0):>6} '
+            f'{client.get("errors", 0):>7} {client.get("retries", 0):>8} {client.get("deduplicated", 0):>6} '
+            f'{server_stats[name]["ok"]:>10}'
+        )
+    for url, stats in proxy_pool.get_stats().items():
+        print(f'прокси {url}: {stats}')
+
+
+if __name__ == '__main__':
+    main()
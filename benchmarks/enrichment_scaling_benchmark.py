@@ -0,0 +1,122 @@
+"""Масштабирование обогащения арендованными батчами по числу процессов.
+
+Запускает app.mock_sources, для каждого числа воркеров заново заполняет
+leads синтетическими лидами и запускает столько же процессов, которые
+берут батчи через EnrichmentLeases (FOR UPDATE SKIP LOCKED). Выводит
+лидов в секунду, ускорение относительно одного воркера и долю лидов,
+обогащенных дважды (должна быть 0). Лимит частоты запросов по умолчанию
+выключен, а одновременных запросов на процесс немного: один воркер
+упирается в задержку источников, а не в сервер-заглушку. Нужна
+PostgreSQL из DATABASE_URL со схемой после alembic upgrade head; в базе
+не должно быть других необогащенных лидов.
+
+    python -m benchmarks.enrichment_scaling_benchmark --leads 3000 --workers 1 --workers 2 --workers 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+from app.mock_sources import SOURCE_PATHS, source_urls
+from benchmarks.enrichment_benchmark import PREFIX, cleanup, populate, start_mock_sources
+
+
+def configure(args):
+    settings.SOURCE_URLS = source_urls(args.host, args.port)
+    settings.PROXY_LIST = []
+    settings.CACHE_ENABLED = False
+    settings.RATE_LIMIT_ENABLED = args.rate_limit
+    settings.MAX_CONCURRENT_REQUESTS = args.concurrency
+    settings.SOURCE_CONCURRENCY = {name: args.concurrency for name in SOURCE_PATHS}
+    settings.BATCH_SIZE = args.batch_size
+
+
+def run_worker(index: int, args, barrier, results):
+    configure(args)
+    from app.external_sources import ExternalDataEnricher
+
+    async def enrich():
+        enricher = ExternalDataEnricher()
+        try:
+            await enricher.enrich_claimed_leads(f'bench-worker-{index}', wait_for_others=True)
+        finally:
+            await enricher.close()
+        return enricher.total_enriched
+
+    barrier.wait()
+    enriched = asyncio.run(enrich())
+    results.put((enriched, time.time()))
+
+
+def enriched_twice() -> int:
+    """Лиды, взятые больше одного раза при отсутствии ошибок - двойная работа"""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT count(*) FROM leads WHERE lead_id LIKE :prefix AND enrich_attempts > 1"),
+            {'prefix': f'{PREFIX}%'}
+        ).scalar()
+
+
+def measure(args, workers: int) -> dict:
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, args=(i, args, barrier, results)) for i in range(workers)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    started = time.time()
+    finished = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    enriched = sum(count for count, _ in finished)
+    elapsed = max(finished_at for _, finished_at in finished) - started
+    return {'enriched': enriched, 'elapsed': elapsed, 'rate': enriched / elapsed, 'twice': enriched_twice()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--leads', type=int, default=3000)
+    parser.add_argument('--workers', type=int, action='append', default=[])
+    parser.add_argument('--concurrency', type=int, default=5, help='одновременных запросов к источнику на процесс')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--rate-limit', action='store_true', help='не отключать адаптивный лимит частоты')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency-ms', type=float, default=100.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.3)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rps-limit', type=float, default=0.0)
+    args = parser.parse_args()
+    args.source_latency, args.proxy = [], []
+    worker_counts = args.workers or [1, 2, 4]
+
+    configure(args)
+    process = start_mock_sources(args)
+    baseline = None
+    try:
+        for workers in worker_counts:
+            cleanup()
+            populate(args.leads, args.leads)
+            try:
+                result = measure(args, workers)
+            finally:
+                cleanup()
+            baseline = baseline or result['rate'] / workers
+            print(
+                f"воркеров {workers}: обогащено {result['enriched']} лидов за {result['elapsed']:.1f} с, "
+                f"{result['rate']:,.1f} лидов/с, ускорение {result['rate'] / baseline:.2f}x "
+                f"(линейное {workers}x), взяты повторно {result['twice']}"
+            )
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Экспорт целевых лидов: построчная запись csv.writer против COPY TO STDOUT.
+
+Сравнивает прежний способ (выборка через engine.connect() и csv.writer)
+с TargetLeadsExporter одним COPY и с шардированием по score и по группам.
+Выводит строк в секунду и проверяет, что все варианты выгрузили одни
+и те же лиды. Нужна PostgreSQL из DATABASE_URL; синтетические лиды
+удаляются после замера, другие целевые лиды в базе попадут в выгрузку.
+
+    python -m benchmarks.export_benchmark --rows 1000000 --shards 4
+"""
+import argparse
+import csv
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.export import EXPORT_HEADER, TargetLeadsExporter
+from benchmarks.schema import upgrade_schema
+
+PREFIX = 'bench-export-'
+
+
+def populate(rows: int):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            INSERT INTO leads (lead_id, fio, phone, source, score, is_target,
+                               reason_1, reason_2, reason_3, group_name)
+            SELECT :prefix || lpad(g::text, 10, '0'), 'Бенчмарков Лид Лидович',
+                   '+7' || lpad(g::text, 10, '0'), 'bench', 50 + g % 51, true,
+                   'Долг 300000 руб.', 'Долг перед банком/МФО', 'Нет недвижимости',
+                   (ARRAY['high_debt_recent_court', 'bank_only_no_property',
+                          'high_score', 'medium_score'])[1 + g % 4]
+            FROM generate_series(1, :rows) AS g
+            ON CONFLICT (lead_id) DO NOTHING
+            """),
+            {'prefix': PREFIX, 'rows': rows}
+        )
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+def legacy_export(path: Path) -> int:
+    """Прежний экспорт: строки через Python и csv.writer"""
+    rows = 0
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT phone, fio, score, reason_1, reason_2, reason_3, group_name as group
+            FROM leads
+            WHERE is_target = TRUE
+            ORDER BY score DESC
+        """))
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_HEADER)
+            for row in result:
+                writer.writerow(row)
+                rows += 1
+    return rows
+
+
+def phones(path: Path) -> set:
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return {row[0] for row in reader}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--shards', type=int, default=4)
+    args = parser.parse_args()
+
+    upgrade_schema()
+    populate(args.rows)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            variants = [
+                ('csv.writer', legacy_export),
+                ('COPY', TargetLeadsExporter(shard_by='').export),
+                (f'COPY score x{args.shards}', TargetLeadsExporter('score', args.shards).export),
+                (f'COPY group x{args.shards}', TargetLeadsExporter('group', args.shards).export),
+            ]
+            expected = None
+            for index, (name, export) in enumerate(variants):
+                path = Path(tmp) / f'export_{index}.csv'
+                started = time.perf_counter()
+                rows = export(path)
+                elapsed = time.perf_counter() - started
+                exported = phones(path)
+                if expected is None:
+                    expected = exported
+                status = 'совпадает' if exported == expected else 'РАСХОЖДЕНИЕ'
+                print(f'{name:<16} {rows / elapsed:12,.0f} строк/с ({rows} строк, {elapsed:.2f} с), {status}')
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Объединение лидов из разных источников на синтетических данных.
+
+Генерирует людей и их записи в источниках (ФНС и банк с ИНН, доставка
+только с телефоном и именем, страховая с датой рождения), часть людей
+делит телефон с родственником. Записи грузятся двумя волнами, как новые
+файлы, и объединяются IdentityResolver. Выводит долю дублей, точность
+и полноту относительно истинных людей и скорость в записях в секунду.
+Нужна PostgreSQL из DATABASE_URL со схемой после alembic upgrade head;
+синтетические лиды удаляются после замера.
+
+    python -m benchmarks.identity_benchmark --persons 200000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.identity import IdentityResolver
+
+PREFIX = 'bench-identity-'
+
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов']
+FIRST_NAMES = ['Иван', 'Петр', 'Сергей', 'Андрей', 'Алексей', 'Дмитрий', 'Олег', 'Николай']
+PATRONYMICS = ['Иванович', 'Петрович', 'Сергеевич', 'Андреевич', 'Олегович']
+
+# Источник: (доля людей с записью, поля записи)
+SOURCES = {
+    'fns': (0.6, ['fio', 'inn', 'dob']),
+    'bank': (0.4, ['fio', 'inn', 'phone']),
+    'delivery': (0.5, ['first_name', 'phone', 'address']),
+    'insurance': (0.3, ['fio', 'phone', 'dob']),
+    'leads': (0.5, ['fio', 'phone']),
+}
+WAVES = [['fns', 'bank'], ['delivery', 'insurance', 'leads']]
+
+
+def make_person(index: int, rng: random.Random) -> dict:
+    first_name = rng.choice(FIRST_NAMES)
+    return {
+        'fio': f"{rng.choice(LAST_NAMES)} {first_name} {rng.choice(PATRONYMICS)}",
+        'first_name': first_name,
+        'phone': f"+79{index:09d}",
+        'inn': f"{index:012d}",
+        'dob': date(1960, 1, 1) + timedelta(days=rng.randrange(15000)),
+        'address': f"г. Москва, ул. Тестовая, д. {index % 500}",
+    }
+
+
+def generate(persons: int, household_share: float, seed: int) -> list:
+    """Записи по волнам; lead_id содержит номер человека для проверки"""
+    rng = random.Random(seed)
+    people = [make_person(i, rng) for i in range(persons)]
+    # Родственник с тем же телефоном и другими ФИО - не должен объединиться
+    for i in rng.sample(range(persons), int(persons * household_share)):
+        relative = make_person(persons + i, rng)
+        relative['fio'] = 'Сидорова Анна Павловна'
+        relative['first_name'] = 'Анна'
+        relative['phone'] = people[i]['phone']
+        people.append(relative)
+
+    waves = [[] for _ in WAVES]
+    for person_id, person in enumerate(people):
+        for source, (share, fields) in SOURCES.items():
+            if rng.random() >= share:
+                continue
+            record = {'lead_id': f"{PREFIX}{person_id:09d}-{source}", 'source': source}
+            for field in fields:
+                if field == 'first_name':
+                    record['fio'] = person['first_name']
+                else:
+                    record[field] = person[field]
+            wave = next(i for i, sources in enumerate(WAVES) if source in sources)
+            waves[wave].append(record)
+    return waves
+
+
+def load(records: list):
+    columns = ['lead_id', 'source', 'fio', 'phone', 'inn', 'dob', 'address']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow([record.get(column, '\\N') for column in columns])
+    buffer.seek(0)
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY leads ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+def quality() -> dict:
+    """Точность и полнота объединения по номеру человека в lead_id"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT lead_id, coalesce(canonical_lead_id, lead_id) FROM leads WHERE lead_id LIKE :prefix"),
+            {'prefix': f'{PREFIX}%'}
+        ).all()
+    person = lambda lead_id: lead_id[len(PREFIX):].split('-')[0]
+    records = len(rows)
+    persons = len({person(lead_id) for lead_id, _ in rows})
+    merged = [(lead_id, canonical) for lead_id, canonical in rows if lead_id != canonical]
+    correct = sum(person(lead_id) == person(canonical) for lead_id, canonical in merged)
+    expected = records - persons
+    return {
+        'records': records,
+        'canonical': records - len(merged),
+        'precision': correct / len(merged) if merged else 1.0,
+        'recall': correct / expected if expected else 1.0,
+    }
+
+
+async def resolve(records: list, batch_size: int):
+    resolver = IdentityResolver()
+    lead_ids = sorted(record['lead_id'] for record in records)
+    started = time.perf_counter()
+    for i in range(0, len(lead_ids), batch_size):
+        await resolver.resolve_lead_ids(lead_ids[i:i + batch_size])
+    elapsed = time.perf_counter() - started
+    print(
+        f"  {len(lead_ids)} записей за {elapsed:.1f} с ({len(lead_ids) / elapsed:,.0f} записей/с), "
+        f"дублей {resolver.stats['merged']} ({resolver.get_merge_rate():.1%}), "
+        f"слияний канонических {resolver.stats['bridged']}, заново на обогащение {resolver.stats['reenriched']}"
+    )
+
+
+async def run_waves(waves: list, batch_size: int):
+    """Волны грузятся и объединяются по очереди, как новые файлы"""
+    for index, (sources, records) in enumerate(zip(WAVES, waves), 1):
+        load(records)
+        print(f"Волна {index} ({', '.join(sources)}):")
+        await resolve(records, batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--persons', type=int, default=200000)
+    parser.add_argument('--household-share', type=float, default=0.05)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    waves = generate(args.persons, args.household_share, args.seed)
+    cleanup()
+    try:
+        asyncio.run(run_waves(waves, args.batch_size))
+        result = quality()
+        print(
+            f"Итого {result['records']} записей -> {result['canonical']} канонических лидов, "
+            f"точность {result['precision']:.2%}, полнота {result['recall']:.2%}"
+        )
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
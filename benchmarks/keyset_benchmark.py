@@ -0,0 +1,102 @@
+"""Задержка батча при постраничном обходе: OFFSET против keyset.
+
+Заполняет leads синтетическими необогащенными лидами и замеряет время
+выборки батча в начале, середине и конце таблицы. Нужна PostgreSQL
+из DATABASE_URL; синтетические лиды удаляются после замера.
+
+    python -m benchmarks.keyset_benchmark --rows 1000000 --rows 10000000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select, text
+
+from app.database import AsyncSessionLocal, engine, iter_keyset_batches
+from app.models import Lead
+from benchmarks.schema import upgrade_schema
+
+PREFIX = 'bench-keyset-'
+
+
+def populate(rows: int):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+        conn.execute(
+            text("""
+            INSERT INTO leads (lead_id, fio, source)
+            SELECT :prefix || lpad(g::text, 10, '0'), 'Бенчмарк Лид', 'bench'
+            FROM generate_series(1, :rows) AS g
+            """),
+            {'prefix': PREFIX, 'rows': rows}
+        )
+        conn.execute(text("ANALYZE leads"))
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+def _base_query():
+    return select(Lead.lead_id).where(Lead.debt_amount == None, Lead.lead_id.like(f'{PREFIX}%'))
+
+
+async def offset_latency(db, batch_index: int, batch_size: int) -> float:
+    started = time.perf_counter()
+    result = await db.execute(
+        _base_query().order_by(Lead.lead_id).limit(batch_size).offset(batch_index * batch_size)
+    )
+    result.all()
+    return time.perf_counter() - started
+
+
+async def keyset_latencies(db, batch_size: int, sample: set) -> dict:
+    latencies = {}
+    batches = iter_keyset_batches(db, _base_query(), Lead.lead_id, batch_size)
+    index = 0
+    started = time.perf_counter()
+    async for _ in batches:
+        if index in sample:
+            latencies[index] = time.perf_counter() - started
+        index += 1
+        started = time.perf_counter()
+    return latencies
+
+
+async def measure(rows: int, batch_size: int):
+    batch_count = rows // batch_size
+    sample = {0, batch_count // 2, batch_count - 1}
+    async with AsyncSessionLocal() as db:
+        keyset = await keyset_latencies(db, batch_size, sample)
+        print(f'--- {rows:,} строк, батч {batch_size:,}')
+        for index in sorted(sample):
+            offset = await offset_latency(db, index, batch_size)
+            print(
+                f'батч {index + 1:>6}/{batch_count}: '
+                f'OFFSET {offset * 1000:8.1f} мс, keyset {keyset[index] * 1000:8.1f} мс'
+            )
+
+
+async def run_all(sizes: list, batch_size: int):
+    # Один цикл событий на все замеры: пул async_engine привязан к нему
+    for rows in sizes:
+        populate(rows)
+        try:
+            await measure(rows, batch_size)
+        finally:
+            cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, action='append')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    upgrade_schema()
+    asyncio.run(run_all(args.rows or [1000000, 10000000], args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
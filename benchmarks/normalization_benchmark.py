@@ -0,0 +1,106 @@
+"""Сравнение построчной и векторной нормализации.
+
+Перед замером проверяется, что normalize_chunk дает тот же результат,
+что и normalize_row для каждой строки.
+
+    python -m benchmarks.normalization_benchmark --rows 200000
+"""
+import argparse
+import math
+import random
+import time
+
+import pandas as pd
+
+from app.normalization import DataNormalizer
+
+FIRST_NAMES = ['иван', 'ПЕТР', 'Анна', 'мария-луиза', 'ёлка', 'o\'brien']
+LAST_NAMES = ['иванов', 'СИДОРОВА', 'петров-водкин', 'ким', 'ДЕ ЛА КРУЗ']
+PATRONYMICS = ['иванович', 'ПЕТРОВНА', '', 'оглы']
+
+
+def _random_phone(rnd: random.Random):
+    digits = ''.join(rnd.choice('0123456789') for _ in range(10))
+    return rnd.choice([
+        f'+7{digits}', f'8{digits}', f'7{digits}', digits,
+        f'8 ({digits[:3]}) {digits[3:6]}-{digits[6:8]}-{digits[8:]}',
+        digits[:7], '', None, 'нет телефона'
+    ])
+
+
+def _random_fio(rnd: random.Random):
+    parts = [rnd.choice(LAST_NAMES), rnd.choice(FIRST_NAMES), rnd.choice(PATRONYMICS)]
+    if rnd.random() < 0.1:
+        parts.append('младший')
+    separator = rnd.choice([' ', '  ', '\t', '  '])
+    return rnd.choice([
+        separator.join(parts), f'  {separator.join(parts)} ', rnd.choice(FIRST_NAMES), '   ', '', None
+    ])
+
+
+def _random_inn(rnd: random.Random):
+    return rnd.choice([
+        ''.join(rnd.choice('0123456789') for _ in range(12)),
+        ' 7707083893 ', None, 'нет'
+    ])
+
+
+def make_chunk(rows: int, seed: int = 42) -> pd.DataFrame:
+    rnd = random.Random(seed)
+    frame = pd.DataFrame({
+        'fio': [_random_fio(rnd) for _ in range(rows)],
+        'phone': [_random_phone(rnd) for _ in range(rows)],
+        'inn': [_random_inn(rnd) for _ in range(rows)],
+        'dob': [rnd.choice(['1980-01-01', None]) for _ in range(rows)],
+        'email': [rnd.choice(['a@mail.ru', None]) for _ in range(rows)],
+    })
+    # Так же, как pd.read_csv(dtype=str): пустые значения становятся NaN
+    return frame.replace({None: float('nan'), '': float('nan')}).astype(object)
+
+
+def _comparable(row: dict) -> dict:
+    return {
+        key: None if isinstance(value, float) and math.isnan(value) else value
+        for key, value in row.items()
+    }
+
+
+def check_parity(normalizer: DataNormalizer, chunk: pd.DataFrame, source: str):
+    expected = [_comparable(row) for row in normalizer._normalize_rows(chunk, source)]
+    actual = [_comparable(row) for row in normalizer.normalize_chunk(chunk, source)]
+    assert len(expected) == len(actual), 'Разное число строк'
+    for index, (left, right) in enumerate(zip(expected, actual)):
+        assert left == right, f'Расхождение в строке {index}: {left} != {right}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    normalizer = DataNormalizer()
+    chunk = make_chunk(args.rows)
+    check_parity(normalizer, chunk, 'fns')
+    check_parity(normalizer, chunk.drop(columns=['inn']), 'delivery')
+    print(f'Паритет подтвержден на {args.rows} строках')
+
+    chunks = [chunk.iloc[i:i + args.chunk_size] for i in range(0, len(chunk), args.chunk_size)]
+
+    started = time.perf_counter()
+    for part in chunks:
+        list(normalizer._normalize_rows(part, 'fns'))
+    row_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for part in chunks:
+        normalizer.normalize_chunk(part, 'fns')
+    vector_time = time.perf_counter() - started
+
+    print(f'iterrows:   {args.rows / row_time:,.0f} строк/с')
+    print(f'векторно:   {args.rows / vector_time:,.0f} строк/с')
+    print(f'ускорение:  {row_time / vector_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Планы запросов к leads с индексами миграции 0002 и без них.
+
+Заполняет leads синтетическими лидами (часть необогащенных, часть
+целевых), затем для каждого пути доступа выполняет EXPLAIN ANALYZE
+дважды: с индексами и в транзакции, где они удалены и затем
+восстановлены откатом. Выводит верхний узел плана, время и число
+прочитанных страниц. Нужна PostgreSQL из DATABASE_URL со схемой
+после alembic upgrade head; синтетические лиды удаляются после замера.
+
+    python -m benchmarks.query_plan_benchmark --rows 10000000
+"""
+import argparse
+import json
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.export import EXPORT_SELECT
+
+PREFIX = 'bench-plan-'
+
+INDEXES = ['ix_leads_not_enriched', 'ix_leads_target_score', 'ix_leads_inn', 'ix_leads_phone']
+
+
+def populate(rows: int):
+    """Каждый десятый лид не обогащен, каждый двадцатый целевой"""
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            INSERT INTO leads (lead_id, fio, phone, inn, source, debt_amount, score, is_target,
+                               reason_1, group_name)
+            SELECT :prefix || lpad(g::text, 10, '0'), 'Бенчмарков Лид Лидович',
+                   '+7' || lpad(g::text, 10, '0'), lpad(g::text, 12, '0'), 'bench',
+                   CASE WHEN g % 10 = 0 THEN NULL ELSE 100000 + g % 500000 END,
+                   CASE WHEN g % 10 = 0 THEN NULL ELSE g % 101 END,
+                   g % 20 = 1, 'Долг 300000 руб.', 'high_score'
+            FROM generate_series(1, :rows) AS g
+            ON CONFLICT (lead_id) DO NOTHING
+            """),
+            {'prefix': PREFIX, 'rows': rows}
+        )
+    # VACUUM обновляет карту видимости, без нее нет сканирования только индекса
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("VACUUM ANALYZE leads"))
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+def queries(rows: int) -> list:
+    middle = f"{PREFIX}{rows // 2:010d}"
+    return [
+        ('обогащение: батч', "SELECT lead_id FROM leads WHERE debt_amount IS NULL "
+                             "AND lead_id > :middle ORDER BY lead_id LIMIT 1000", {'middle': middle}),
+        ('обогащение: count', "SELECT count(*) FROM leads WHERE debt_amount IS NULL", {}),
+        ('экспорт', f"{EXPORT_SELECT} ORDER BY score DESC", {}),
+        ('поиск по ИНН', "SELECT lead_id FROM leads WHERE inn = :inn", {'inn': f'{rows // 3:012d}'}),
+        ('поиск по телефону', "SELECT lead_id FROM leads WHERE phone = :phone",
+         {'phone': f'+7{rows // 3:010d}'}),
+    ]
+
+
+def explain(conn, query: str, params: dict) -> dict:
+    plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}"), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]
+    node = root['Plan']
+    # Узел под Limit/Aggregate показывает способ доступа к таблице
+    while node.get('Plans') and node['Node Type'] in ('Limit', 'Aggregate', 'Gather', 'Gather Merge', 'Sort'):
+        node = node['Plans'][0]
+    pages = root['Plan'].get('Shared Hit Blocks', 0) + root['Plan'].get('Shared Read Blocks', 0)
+    return {'node': node['Node Type'], 'ms': root['Execution Time'], 'pages': pages}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000000)
+    args = parser.parse_args()
+
+    populate(args.rows)
+    try:
+        print(f"{'запрос':<20} {'с индексами':>40} {'без индексов':>40}")
+        for name, query, params in queries(args.rows):
+            with engine.connect() as conn:
+                indexed = explain(conn, query, params)
+                conn.rollback()
+                # DROP INDEX откатывается вместе с транзакцией
+                for index in INDEXES:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+                plain = explain(conn, query, params)
+                conn.rollback()
+            cells = [
+                f"{result['node']}, {result['ms']:.1f} мс, {result['pages']} стр."
+                for result in (indexed, plain)
+            ]
+            print(f"{name:<20} {cells[0]:>40} {cells[1]:>40}")
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
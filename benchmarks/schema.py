@@ -0,0 +1,19 @@
+"""Схема базы для бенчмарков: те же миграции alembic, что и в рабочей базе.
+
+create_all дал бы таблицы без секционирования, частичных и покрывающих
+индексов, поэтому бенчмарки перед замером обновляют базу до head.
+"""
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+
+MIGRATIONS_PATH = Path(__file__).resolve().parent.parent / 'migrations'
+
+
+def upgrade_schema():
+    """alembic upgrade head для базы из DATABASE_URL"""
+    # Без alembic.ini: env.py не перенастраивает логирование бенчмарка
+    config = Config()
+    config.set_main_option('script_location', str(MIGRATIONS_PATH))
+    command.upgrade(config, 'head')
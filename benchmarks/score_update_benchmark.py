@@ -0,0 +1,122 @@
+"""Запись результатов скоринга: UPDATE ... FROM (VALUES ...) строкой против unnest массивов.
+
+Нужна PostgreSQL из DATABASE_URL; синтетические лиды удаляются после замера.
+
+    python -m benchmarks.score_update_benchmark --rows 200000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal, engine
+from app.scoring import ScoringProcessor
+from benchmarks.schema import upgrade_schema
+
+PREFIX = 'bench-update-'
+
+
+def populate(rows: int):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            INSERT INTO leads (lead_id, fio, source)
+            SELECT :prefix || lpad(g::text, 10, '0'), 'Бенчмарк Лид', 'bench'
+            FROM generate_series(1, :rows) AS g
+            ON CONFLICT (lead_id) DO NOTHING
+            """),
+            {'prefix': PREFIX, 'rows': rows}
+        )
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+def make_scoring_data(rows: int) -> list:
+    rnd = random.Random(1)
+    return [
+        {
+            'lead_id': f'{PREFIX}{i:010d}',
+            'score': rnd.randint(0, 100),
+            'is_target': rnd.random() < 0.3,
+            'reason_1': f'Долг {rnd.randint(100000, 900000)} руб.',
+            'reason_2': 'Долг перед банком/МФО',
+            'reason_3': rnd.choice(['Нет недвижимости', None]),
+            'group_name': rnd.choice(['high_score', 'medium_score', 'low_score'])
+        }
+        for i in range(1, rows + 1)
+    ]
+
+
+async def legacy_update(leads_data: list, db):
+    """Прежняя реализация: VALUES собирается форматированием строки"""
+    values = [
+        f"('{data['lead_id']}', {data['score']}, {data['is_target']}, "
+        f"'{data['reason_1'] or ''}', '{data['reason_2'] or ''}', "
+        f"'{data['reason_3'] or ''}', '{data['group_name']}')"
+        for data in leads_data
+    ]
+    await db.execute(text(
+        """
+        UPDATE leads SET
+            score = data.score,
+            is_target = data.is_target,
+            reason_1 = data.reason_1,
+            reason_2 = data.reason_2,
+            reason_3 = data.reason_3,
+            group_name = data.group_name
+        FROM (VALUES
+        """
+        + ",\n".join(values)
+        + """
+        ) AS data(lead_id, score, is_target, reason_1, reason_2, reason_3, group_name)
+        WHERE leads.lead_id = data.lead_id
+        """
+    ))
+
+
+async def timed(update, scoring_data: list, batch_size: int) -> float:
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        for i in range(0, len(scoring_data), batch_size):
+            await update(scoring_data[i:i + batch_size], db)
+            await db.commit()
+        return time.perf_counter() - started
+
+
+async def run(rows: int, batch_size: int):
+    scoring_data = make_scoring_data(rows)
+    processor = ScoringProcessor()
+    version_params = processor.engine.version_params({})
+
+    async def unnest_update(leads_data: list, db):
+        await processor._bulk_update_leads(leads_data, db, version_params)
+
+    for name, update in [
+        ('VALUES строкой', legacy_update),
+        ('unnest массивов', unnest_update),
+    ]:
+        elapsed = await timed(update, scoring_data, batch_size)
+        print(f'{name:<16} {rows / elapsed:,.0f} строк/с ({elapsed:.1f} с)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    upgrade_schema()
+    populate(args.rows)
+    try:
+        asyncio.run(run(args.rows, args.batch_size))
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Сравнение построчного и колоночного скоринга.
+
+Перед замером проверяется, что ScoringEngine.score_columns совпадает
+с apply_filters + calculate_score для каждой строки.
+
+    python -m benchmarks.scoring_benchmark --rows 200000
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from app.scoring import SCORING_FIELDS, ScoringEngine
+
+FILTER_SETS = [
+    {},
+    {'min_debt_amount': 250000, 'exclude_bankrupts': True, 'exclude_no_debt': True, 'only_active_inn': True},
+    {'only_with_property': True, 'only_bank_mfo_debt': True, 'min_score_threshold': 30},
+    {'only_recent_court_orders': True, 'min_debt_amount': 0},
+]
+
+
+def make_leads(rows: int, seed: int = 7) -> list:
+    rnd = random.Random(seed)
+    today = date.today()
+    return [
+        {
+            'debt_amount': rnd.choice([0.0, 50000.0, 99999.5, 100000.0, 250000.0, 250000.5, 600000.0,
+                                       rnd.uniform(0, 2000000)]),
+            'debt_type': rnd.choice(['bank', 'mfo', 'tax', 'utility', 'unknown', None]),
+            'has_property': rnd.choice([True, False, None]),
+            'has_court_order': rnd.choice([True, False]),
+            # Как в колонке Date таблицы leads
+            'court_order_date': rnd.choice([None, today - timedelta(days=rnd.randint(0, 200))]),
+            'is_bankrupt': rnd.random() < 0.1,
+            'inn_active': rnd.choice([True, True, False, None]),
+            'debt_count': rnd.randint(0, 5),
+        }
+        for _ in range(rows)
+    ]
+
+
+def scalar(engine: ScoringEngine, leads: list, filters: dict) -> list:
+    results = []
+    for lead in leads:
+        if not engine.apply_filters(lead, filters):
+            results.append(None)
+            continue
+        score, reasons, group = engine.calculate_score(lead)
+        reasons = reasons + [None] * (3 - len(reasons))
+        results.append((score, engine.is_target(score, filters), *reasons, group))
+    return results
+
+
+def columnar(engine: ScoringEngine, columns: dict, filters: dict) -> list:
+    result = engine.score_columns(columns, filters)
+    return [
+        (int(result['score'][i]), bool(result['is_target'][i]), result['reason_1'][i],
+         result['reason_2'][i], result['reason_3'][i], result['group_name'][i])
+        if result['passed'][i] else None
+        for i in range(len(result['passed']))
+    ]
+
+
+def to_columns(leads: list) -> dict:
+    return {field: np.array([lead[field] for lead in leads], dtype=object) for field in SCORING_FIELDS}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    engine = ScoringEngine()
+    leads = make_leads(args.rows)
+    columns = to_columns(leads)
+    for filters in FILTER_SETS:
+        expected = scalar(engine, leads, filters)
+        actual = columnar(engine, columns, filters)
+        for index, (left, right) in enumerate(zip(expected, actual)):
+            assert left == right, f'Расхождение в строке {index} ({filters}): {left} != {right}'
+    print(f'Паритет подтвержден на {args.rows} строках и {len(FILTER_SETS)} наборах фильтров')
+
+    filters = FILTER_SETS[1]
+    batches = [leads[i:i + args.batch_size] for i in range(0, len(leads), args.batch_size)]
+    column_batches = [to_columns(batch) for batch in batches]
+
+    started = time.perf_counter()
+    for batch in batches:
+        scalar(engine, batch, filters)
+    scalar_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for batch_columns in column_batches:
+        engine.score_columns(batch_columns, filters)
+    columnar_time = time.perf_counter() - started
+
+    print(f'построчно:  {args.rows / scalar_time:,.0f} лидов/с')
+    print(f'колоночно:  {args.rows / columnar_time:,.0f} лидов/с')
+    print(f'ускорение:  {scalar_time / columnar_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
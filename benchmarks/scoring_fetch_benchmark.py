@@ -0,0 +1,103 @@
+"""Чтение батча для скоринга: ORM-объекты Lead против колонок из серверного курсора.
+
+Для каждого режима выводится среднее время и пик памяти на батч
+(tracemalloc), включая подготовку колонок для score_columns.
+Нужна PostgreSQL из DATABASE_URL; синтетические лиды удаляются после замера.
+
+    python -m benchmarks.scoring_fetch_benchmark --rows 200000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal, engine
+from app.scoring import NEEDS_SCORING, ScoringProcessor
+from benchmarks.schema import upgrade_schema
+
+PREFIX = 'bench-fetch-'
+
+
+def populate(rows: int):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            INSERT INTO leads (lead_id, fio, phone, inn, address, source,
+                               debt_amount, debt_type, debt_count, has_property,
+                               has_court_order, is_bankrupt, inn_active)
+            SELECT :prefix || lpad(g::text, 10, '0'), 'Бенчмарков Лид Лидович',
+                   '+79990000000', '770708389301', repeat('г. Москва, ул. Тверская, д. 1 ', 8),
+                   'bench', (g % 1000) * 1000.0, 'bank', g % 4, g % 2 = 0,
+                   false, false, true
+            FROM generate_series(1, :rows) AS g
+            ON CONFLICT (lead_id) DO NOTHING
+            """),
+            {'prefix': PREFIX, 'rows': rows}
+        )
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE lead_id LIKE :prefix"), {'prefix': f'{PREFIX}%'})
+
+
+async def measure(processor: ScoringProcessor) -> tuple:
+    batches = 0
+    elapsed = 0.0
+    peak = 0
+    async with AsyncSessionLocal() as db:
+        needs_scoring = NEEDS_SCORING.bindparams(**processor.engine.version_params({}))
+        source = processor._batches_to_score(db, needs_scoring)
+        while True:
+            tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                leads = await source.__anext__()
+            except StopAsyncIteration:
+                tracemalloc.stop()
+                break
+            processor._leads_to_columns(leads)
+            elapsed += time.perf_counter() - started
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            batches += 1
+            del leads
+            db.expunge_all()
+    return batches, elapsed, peak
+
+
+async def run():
+    results = {}
+    for lean in (False, True):
+        processor = ScoringProcessor()
+        processor.lean_fetch = lean
+        results[lean] = await measure(processor)
+
+    for lean, (batches, elapsed, peak) in results.items():
+        name = 'колонки + курсор' if lean else 'ORM select(Lead)'
+        print(f'{name:<18} {elapsed / batches * 1000:8.1f} мс/батч, пик {peak / 1024 / 1024:7.1f} МБ/батч')
+
+    orm, lean = results[False], results[True]
+    print(
+        f'экономия на батч: {(orm[1] / orm[0] - lean[1] / lean[0]) * 1000:.1f} мс, '
+        f'{(orm[2] - lean[2]) / 1024 / 1024:.1f} МБ'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    upgrade_schema()
+    populate(args.rows)
+    try:
+        asyncio.run(run())
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Отзывчивость цикла событий во время нормализации.
+
+Нормализует синтетический CSV двумя способами: прямым вызовом в цикле
+событий (как раньше делал run_processing_pipeline) и в рабочем потоке
+через asyncio.to_thread. Параллельно корутина каждые 10 мс замеряет
+задержку пробуждения - столько же ждал бы ответ /status. Выводит p50,
+p99 и максимум задержки. Нужна PostgreSQL из DATABASE_URL; загруженные
+лиды удаляются после каждого прогона.
+
+    python -m benchmarks.status_latency_benchmark --rows 500000
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import text
+
+from app.database import engine
+from app.normalization import DataNormalizer
+
+FIO_PREFIX = 'Задержкин Бенчмарк'
+
+
+def write_csv(path: Path, rows: int):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('ФИО,Телефон,ИНН,Дата рождения\n')
+        for i in range(rows):
+            f.write(f'{FIO_PREFIX} {i},+79{i:09d},{i:012d},1980-01-01\n')
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM leads WHERE fio LIKE :prefix"), {'prefix': f'{FIO_PREFIX}%'})
+
+
+async def probe(lags: list, stop: asyncio.Event, interval: float = 0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def measure(input_path: str, in_thread: bool) -> dict:
+    lags, stop = [], asyncio.Event()
+    prober = asyncio.create_task(probe(lags, stop))
+    await asyncio.sleep(0.05)
+    normalizer = DataNormalizer()
+    started = time.perf_counter()
+    if in_thread:
+        await asyncio.to_thread(normalizer.process_all_files, input_path)
+    else:
+        normalizer.process_all_files(input_path)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+    lags_ms = np.array(lags or [0.0]) * 1000
+    return {
+        'elapsed': elapsed,
+        'p50': np.percentile(lags_ms, 50),
+        'p99': np.percentile(lags_ms, 99),
+        'max': lags_ms.max(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_csv(Path(tmp) / 'fns_latency.csv', args.rows)
+        for name, in_thread in [('в цикле событий', False), ('asyncio.to_thread', True)]:
+            cleanup()
+            try:
+                result = asyncio.run(measure(tmp, in_thread))
+            finally:
+                cleanup()
+            print(
+                f"{name:<18} нормализация {result['elapsed']:.1f} с, задержка цикла событий: "
+                f"p50 {result['p50']:.1f} мс, p99 {result['p99']:.1f} мс, max {result['max']:.0f} мс"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from logging.config import fileConfig
+from app.config import settings
 from app.models import Base
 
 from sqlalchemy import engine_from_config
@@ -6,13 +7,13 @@ from sqlalchemy import pool
 
 from alembic import context
 
-
-config.set_main_option("sqlalchemy.url", str(settings.DATABASE_URL_SYNC))
-
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# Адрес базы берется из настроек приложения (.env), а не из alembic.ini
+config.set_main_option("sqlalchemy.url", str(settings.DATABASE_URL))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,48 @@
+"""Построение индексов leads в миграциях.
+
+Индексы строятся CONCURRENTLY, чтобы не блокировать запись в leads,
+поэтому вызовы идут внутри op.get_context().autocommit_block().
+"""
+from typing import Dict, Iterable
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+def concurrently() -> str:
+    """CONCURRENTLY недоступен для секционированной leads (миграция 0003)"""
+    if context.is_offline_mode():
+        return "CONCURRENTLY"
+    partitioned = op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'leads'::regclass)"
+    )).scalar()
+    return "" if partitioned else "CONCURRENTLY"
+
+
+def drop_invalid_indexes(names: Iterable[str], concurrently: str):
+    """Индекс, построение которого CONCURRENTLY прервалось, остается INVALID:
+    CREATE INDEX IF NOT EXISTS его пропустил бы, поэтому он удаляется и строится заново"""
+    if context.is_offline_mode():
+        return
+    invalid = op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(:names) AND NOT i.indisvalid"
+    ), {'names': list(names)}).scalars().all()
+    for name in invalid:
+        op.execute(f"DROP INDEX {concurrently} IF EXISTS {name}")
+
+
+def create_leads_indexes(indexes: Dict[str, str]):
+    """Индексы leads по словарю имя -> определение после ON leads"""
+    mode = concurrently()
+    with op.get_context().autocommit_block():
+        drop_invalid_indexes(indexes, mode)
+        for name, definition in indexes.items():
+            op.execute(f"CREATE INDEX {mode} IF NOT EXISTS {name} ON leads {definition}")
+
+
+def drop_leads_indexes(names: Iterable[str]):
+    mode = concurrently()
+    with op.get_context().autocommit_block():
+        for name in names:
+            op.execute(f"DROP INDEX {mode} IF EXISTS {name}")
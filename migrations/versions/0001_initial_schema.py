@@ -0,0 +1,133 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_table(name: str) -> bool:
+    # В режиме --sql базы нет, SQL генерируется для пустой схемы
+    if context.is_offline_mode():
+        return False
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    # Раньше таблицы создавались create_all при старте приложения:
+    # существующие таблицы не пересоздаются, в leads добавляются новые колонки
+    if not _has_table('leads'):
+        op.create_table(
+            'leads',
+            sa.Column('lead_id', sa.String(50), primary_key=True),
+            sa.Column('fio', sa.String(255), nullable=False),
+            sa.Column('phone', sa.String(20)),
+            sa.Column('inn', sa.String(12)),
+            sa.Column('dob', sa.Date),
+            sa.Column('address', sa.Text),
+            sa.Column('source', sa.String(50)),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('tags', sa.String(255)),
+            sa.Column('email', sa.String(255)),
+            sa.Column('debt_amount', sa.Float),
+            sa.Column('debt_type', sa.String(50)),
+            sa.Column('creditor', sa.String(255)),
+            sa.Column('debt_count', sa.Integer),
+            sa.Column('has_property', sa.Boolean),
+            sa.Column('has_court_order', sa.Boolean),
+            sa.Column('court_order_date', sa.Date),
+            sa.Column('is_bankrupt', sa.Boolean),
+            sa.Column('bankruptcy_date', sa.Date),
+            sa.Column('inn_active', sa.Boolean),
+            sa.Column('tax_debt_amount', sa.Float),
+            sa.Column('score', sa.Float),
+            sa.Column('is_target', sa.Boolean),
+            sa.Column('reason_1', sa.String(255)),
+            sa.Column('reason_2', sa.String(255)),
+            sa.Column('reason_3', sa.String(255)),
+            sa.Column('group_name', sa.String(50)),
+            sa.Column('processed_at', sa.DateTime),
+            sa.Column('last_updated', sa.DateTime),
+        )
+    else:
+        # NULL в debt_amount означает необогащенного лида
+        op.execute("ALTER TABLE leads ALTER COLUMN debt_amount DROP DEFAULT")
+
+    if not _has_table('scoring_history'):
+        op.create_table(
+            'scoring_history',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('lead_id', sa.String(50)),
+            sa.Column('scoring_date', sa.DateTime),
+            sa.Column('score', sa.Float),
+            sa.Column('group_name', sa.String(50)),
+            sa.Column('reason_1', sa.String(255)),
+            sa.Column('filters_used', sa.Text),
+            sa.Column('processing_time_ms', sa.Integer),
+        )
+
+    if not _has_table('error_logs'):
+        op.create_table(
+            'error_logs',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('timestamp', sa.DateTime),
+            sa.Column('source', sa.String(50)),
+            sa.Column('error_type', sa.String(50)),
+            sa.Column('error_message', sa.Text),
+            sa.Column('lead_id', sa.String(50)),
+            sa.Column('retry_count', sa.Integer),
+        )
+
+    if not _has_table('external_cache'):
+        op.create_table(
+            'external_cache',
+            sa.Column('source', sa.String(50), primary_key=True),
+            sa.Column('query_key', sa.String(512), primary_key=True),
+            sa.Column('payload', sa.Text),
+            sa.Column('fetched_at', sa.DateTime),
+        )
+
+    if not _has_table('pipeline_jobs'):
+        op.create_table(
+            'pipeline_jobs',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('status', sa.String(20)),
+            sa.Column('stage', sa.String(50)),
+            sa.Column('filters', sa.Text),
+            sa.Column('error_message', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('updated_at', sa.DateTime),
+            sa.Column('finished_at', sa.DateTime),
+        )
+
+    if not _has_table('file_checkpoints'):
+        op.create_table(
+            'file_checkpoints',
+            sa.Column('job_id', sa.Integer, primary_key=True),
+            sa.Column('file_name', sa.String(255), primary_key=True),
+            sa.Column('file_size', sa.BigInteger),
+            sa.Column('byte_offset', sa.BigInteger),
+            sa.Column('completed', sa.Boolean),
+            sa.Column('updated_at', sa.DateTime),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('file_checkpoints')
+    op.drop_table('pipeline_jobs')
+    op.drop_table('external_cache')
+    op.drop_table('error_logs')
+    op.drop_table('scoring_history')
+    op.drop_table('leads')
@@ -0,0 +1,39 @@
+"""Partial and covering indexes on leads
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 10:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from migrations.leads_indexes import create_leads_indexes, drop_leads_indexes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LEADS_INDEXES = {
+    # Keyset-обход и подсчет необогащенных лидов (debt_amount IS NULL)
+    'ix_leads_not_enriched': "(lead_id) WHERE debt_amount IS NULL",
+    # Экспорт целевых лидов по убыванию score сканированием только индекса
+    'ix_leads_target_score': (
+        "(score DESC) INCLUDE (phone, fio, reason_1, reason_2, reason_3, group_name) "
+        "WHERE is_target = TRUE"
+    ),
+    'ix_leads_inn': "(inn) WHERE inn IS NOT NULL",
+    'ix_leads_phone': "(phone) WHERE phone IS NOT NULL",
+}
+
+
+def upgrade() -> None:
+    create_leads_indexes(LEADS_INDEXES)
+
+
+def downgrade() -> None:
+    drop_leads_indexes(LEADS_INDEXES)
@@ -0,0 +1,88 @@
+"""Optional hash partitioning of leads by lead_id
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 10:20:00.000000
+
+Секционирование включается явно, число секций задается аргументом:
+
+    alembic -x leads_partitions=16 upgrade head
+
+Без аргумента миграция ничего не меняет. Данные переносятся в новую
+таблицу одной транзакцией под эксклюзивной блокировкой, поэтому на
+больших таблицах ее запускают в окно обслуживания. Индексы на
+секционированной таблице нельзя создавать CONCURRENTLY.
+
+Аргумент действует только при первом проходе через 0003: на базе,
+уже обновленной дальше, upgrade эту миграцию не выполняет, а откат до
+0002 удалил бы колонки следующих миграций. Такую базу секционируют
+скриптом с тем же переносом данных и всеми текущими индексами leads:
+
+    python -m app.partition_leads --partitions 16
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LEADS_INDEXES = {
+    'ix_leads_not_enriched': "(lead_id) WHERE debt_amount IS NULL",
+    'ix_leads_target_score': (
+        "(score DESC) INCLUDE (phone, fio, reason_1, reason_2, reason_3, group_name) "
+        "WHERE is_target = TRUE"
+    ),
+    'ix_leads_inn': "(inn) WHERE inn IS NOT NULL",
+    'ix_leads_phone': "(phone) WHERE phone IS NOT NULL",
+}
+
+
+def _is_partitioned() -> bool:
+    return op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'leads'::regclass)"
+    )).scalar()
+
+
+def _rebuild_leads(partitions: int):
+    """Пересоздание leads (секционированной при partitions > 0) с переносом данных"""
+    op.execute("LOCK TABLE leads IN ACCESS EXCLUSIVE MODE")
+    op.execute("ALTER TABLE leads RENAME TO leads_old")
+    op.execute("ALTER INDEX leads_pkey RENAME TO leads_old_pkey")
+    for name in LEADS_INDEXES:
+        op.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_old")
+
+    partition_clause = " PARTITION BY HASH (lead_id)" if partitions else ""
+    op.execute(f"CREATE TABLE leads (LIKE leads_old INCLUDING DEFAULTS){partition_clause}")
+    for remainder in range(partitions):
+        op.execute(
+            f"CREATE TABLE leads_p{remainder} PARTITION OF leads "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        )
+
+    # Индексы строятся после переноса: так быстрее, чем обновлять их по строке
+    op.execute("INSERT INTO leads SELECT * FROM leads_old")
+    op.execute("ALTER TABLE leads ADD CONSTRAINT leads_pkey PRIMARY KEY (lead_id)")
+    for name, definition in LEADS_INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON leads {definition}")
+    op.execute("DROP TABLE leads_old")
+    op.execute("ANALYZE leads")
+
+
+def upgrade() -> None:
+    partitions = int(context.get_x_argument(as_dictionary=True).get('leads_partitions', 0))
+    # В режиме --sql базы нет, проверка секционирования пропускается
+    if partitions < 2 or (not context.is_offline_mode() and _is_partitioned()):
+        return
+    _rebuild_leads(partitions)
+
+
+def downgrade() -> None:
+    # Секции удаляются вместе с leads_old
+    if context.is_offline_mode() or _is_partitioned():
+        _rebuild_leads(0)
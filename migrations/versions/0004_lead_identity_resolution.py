@@ -0,0 +1,42 @@
+"""Identity resolution columns and blocking indexes on leads
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.leads_indexes import create_leads_indexes, drop_leads_indexes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LEADS_INDEXES = {
+    # Лиды, еще не прошедшие объединение
+    'ix_leads_unresolved': "(lead_id) WHERE resolved_at IS NULL",
+    # Блок ФИО + дата рождения (телефон и ИНН - индексы из 0002)
+    'ix_leads_fio_dob': "(lower(fio), dob) WHERE dob IS NOT NULL",
+    'ix_leads_canonical': "(canonical_lead_id) WHERE canonical_lead_id IS NOT NULL",
+}
+
+
+def upgrade() -> None:
+    op.add_column('leads', sa.Column('canonical_lead_id', sa.String(50)))
+    op.add_column('leads', sa.Column('resolved_at', sa.DateTime))
+    op.add_column('leads', sa.Column('identity_sources', sa.Text))
+    create_leads_indexes(LEADS_INDEXES)
+
+
+def downgrade() -> None:
+    drop_leads_indexes(LEADS_INDEXES)
+    op.drop_column('leads', 'identity_sources')
+    op.drop_column('leads', 'resolved_at')
+    op.drop_column('leads', 'canonical_lead_id')
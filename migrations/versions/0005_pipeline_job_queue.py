@@ -0,0 +1,42 @@
+"""Job queue columns on pipeline_jobs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('pipeline_jobs', sa.Column('kind', sa.String(20), server_default='scoring'))
+    op.add_column('pipeline_jobs', sa.Column('export_format', sa.String(20)))
+    op.add_column('pipeline_jobs', sa.Column('progress', sa.Integer, server_default='0'))
+    op.add_column('pipeline_jobs', sa.Column('message', sa.Text))
+    op.add_column('pipeline_jobs', sa.Column('result', sa.Text))
+    op.add_column('pipeline_jobs', sa.Column('worker_id', sa.String(100)))
+    op.add_column('pipeline_jobs', sa.Column('attempts', sa.Integer, server_default='0'))
+    op.add_column('pipeline_jobs', sa.Column('started_at', sa.DateTime))
+    op.add_column('pipeline_jobs', sa.Column('heartbeat_at', sa.DateTime))
+    # Выборка очереди воркером: ожидающие и выполняемые задания
+    op.create_index(
+        'ix_pipeline_jobs_pending', 'pipeline_jobs', ['id'],
+        postgresql_where=sa.text("status IN ('queued', 'running')")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pipeline_jobs_pending', table_name='pipeline_jobs')
+    for column in ['heartbeat_at', 'started_at', 'attempts', 'worker_id', 'result',
+                   'message', 'progress', 'export_format', 'kind']:
+        op.drop_column('pipeline_jobs', column)
@@ -0,0 +1,40 @@
+"""Enrichment lease columns on leads
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.leads_indexes import create_leads_indexes, drop_leads_indexes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LEADS_INDEXES = {
+    # Проверка, что другие воркеры еще обогащают арендованные батчи
+    'ix_leads_enrich_lease': "(enrich_lease_until) WHERE debt_amount IS NULL AND enrich_lease_until IS NOT NULL",
+}
+
+
+def upgrade() -> None:
+    op.add_column('leads', sa.Column('enrich_worker', sa.String(100)))
+    op.add_column('leads', sa.Column('enrich_lease_until', sa.DateTime))
+    # Константное значение по умолчанию не переписывает таблицу (PostgreSQL 11+)
+    op.add_column('leads', sa.Column('enrich_attempts', sa.Integer, server_default='0', nullable=False))
+    create_leads_indexes(LEADS_INDEXES)
+
+
+def downgrade() -> None:
+    drop_leads_indexes(LEADS_INDEXES)
+    op.drop_column('leads', 'enrich_attempts')
+    op.drop_column('leads', 'enrich_lease_until')
+    op.drop_column('leads', 'enrich_worker')
@@ -0,0 +1,33 @@
+"""Worker rate limit and proxy state
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Воркеры публикуют состояние лимитов частоты и прокси, веб-приложение его читает
+    op.create_table(
+        'worker_states',
+        sa.Column('worker_id', sa.String(100), primary_key=True),
+        sa.Column('rate_limits', sa.Text),
+        sa.Column('proxies', sa.Text),
+        sa.Column('updated_at', sa.DateTime),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('worker_states')
@@ -0,0 +1,46 @@
+"""Stored scoring state on leads
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.leads_indexes import create_leads_indexes, drop_leads_indexes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LEADS_INDEXES = {
+    # Лиды, у которых обогащение или объединение изменили данные после скоринга
+    'ix_leads_scoring_dirty': "(lead_id) WHERE scoring_dirty AND canonical_lead_id IS NULL",
+    # Лиды, оцененные другой версией правил: scoring_version < :v OR > :v идет по индексу
+    'ix_leads_scoring_version': "(scoring_version) WHERE canonical_lead_id IS NULL",
+    # Лиды, у которых судебный приказ был свежим при скоринге и может устареть
+    'ix_leads_scored_recent_order': "(court_order_date) WHERE scored_recent_order AND canonical_lead_id IS NULL",
+}
+
+
+def upgrade() -> None:
+    # Первый запуск после миграции оценит все лиды заново
+    op.add_column('leads', sa.Column('scoring_dirty', sa.Boolean, server_default=sa.true(), nullable=False))
+    op.add_column('leads', sa.Column('scoring_version', sa.String(32)))
+    op.add_column('leads', sa.Column('scored_recent_order', sa.Boolean, server_default=sa.false(), nullable=False))
+    # Колонка осталась в базах, обновленных ранней версией 0001
+    op.execute("ALTER TABLE leads DROP COLUMN IF EXISTS scoring_fingerprint")
+    create_leads_indexes(LEADS_INDEXES)
+
+
+def downgrade() -> None:
+    drop_leads_indexes(LEADS_INDEXES)
+    op.drop_column('leads', 'scored_recent_order')
+    op.drop_column('leads', 'scoring_version')
+    op.drop_column('leads', 'scoring_dirty')
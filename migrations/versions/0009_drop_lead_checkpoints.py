@@ -0,0 +1,29 @@
+"""Drop per-stage lead checkpoints from pipeline_jobs
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Обогащение и скоринг продолжают по состоянию лидов; колонки остались
+    # в базах, обновленных ранней версией 0001
+    op.execute("ALTER TABLE pipeline_jobs DROP COLUMN IF EXISTS last_enriched_lead_id")
+    op.execute("ALTER TABLE pipeline_jobs DROP COLUMN IF EXISTS last_scored_lead_id")
+
+
+def downgrade() -> None:
+    # Колонки ничем не используются, восстанавливать нечего
+    pass
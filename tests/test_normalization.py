@@ -0,0 +1,103 @@
+"""Векторная нормализация normalize_chunk против построчной normalize_row.
+
+normalize_chunk намеренно повторяет особенности normalize_row и
+_generate_lead_id: пропуск ИНН становится строкой 'nan', пустые ФИО и
+телефон попадают в основу md5 как 'None'. Без этого у уже загруженных
+лидов поменялись бы lead_id.
+"""
+import hashlib
+import io
+import math
+
+import pandas as pd
+import pytest
+
+from app.normalization import DataNormalizer
+
+
+@pytest.fixture
+def normalizer():
+    return DataNormalizer()
+
+
+def _read_csv(content: str) -> pd.DataFrame:
+    # Так же, как при загрузке файлов: все колонки строками, пустые значения - NaN
+    return pd.read_csv(io.StringIO(content), dtype=str)
+
+
+def _comparable(row: dict) -> dict:
+    return {
+        key: None if isinstance(value, float) and math.isnan(value) else value
+        for key, value in row.items()
+    }
+
+
+def _assert_parity(normalizer: DataNormalizer, chunk: pd.DataFrame, source: str = 'fns'):
+    expected = [
+        _comparable(normalizer.normalize_row(row.to_dict(), source))
+        for _, row in chunk.iterrows()
+    ]
+    actual = [_comparable(row) for row in normalizer.normalize_chunk(chunk, source)]
+    assert actual == expected
+    return actual
+
+
+def test_missing_inn_becomes_nan_string(normalizer):
+    chunk = _read_csv("fio,phone,inn\nиванов иван,89161234567,\n")
+    row, = _assert_parity(normalizer, chunk)
+    assert row['inn'] == 'nan'
+    assert row['lead_id'] == hashlib.md5('Иванов Иван+79161234567nan'.encode('utf-8')).hexdigest()
+
+
+def test_missing_fio_and_phone_hash_as_none(normalizer):
+    chunk = _read_csv("fio,phone,inn\n,,7707083893\n")
+    row, = _assert_parity(normalizer, chunk)
+    assert row['fio'] is None and row['phone'] is None
+    assert row['lead_id'] == hashlib.md5('NoneNone7707083893'.encode('utf-8')).hexdigest()
+
+
+def test_missing_columns_hash_as_none(normalizer):
+    chunk = _read_csv("fio,phone\nпетров петр,9161234567\n")
+    row, = _assert_parity(normalizer, chunk, 'delivery')
+    assert row['inn'] is None
+    assert row['lead_id'] == hashlib.md5('Петров Петр+79161234567None'.encode('utf-8')).hexdigest()
+
+
+@pytest.mark.parametrize('phone, expected', [
+    ('89161234567', '+79161234567'),
+    ('79161234567', '+79161234567'),
+    ('+7 (916) 123-45-67', '+79161234567'),
+    ('9161234567', '+79161234567'),
+    ('8 916 123 45 67', '+79161234567'),
+    ('1234567', None),
+    ('69161234567', None),
+    ('нет телефона', None),
+])
+def test_phone_formats(normalizer, phone, expected):
+    chunk = pd.DataFrame({'fio': ['сидоров сидор'], 'phone': [phone], 'inn': ['7707083893']}, dtype=object)
+    row, = _assert_parity(normalizer, chunk)
+    assert row['phone'] == expected
+
+
+@pytest.mark.parametrize('fio, expected', [
+    ('', None),
+    ('   ', ''),
+    ('иван', 'Иван'),
+    ('  петров-водкин\tкузьма  сергеевич младший ', 'Петров-Водкин Кузьма Сергеевич'),
+])
+def test_fio_edge_cases(normalizer, fio, expected):
+    chunk = pd.DataFrame({'fio': [fio], 'phone': ['9161234567'], 'inn': [None]}, dtype=object)
+    row, = _assert_parity(normalizer, chunk)
+    assert row['fio'] == expected
+
+
+def test_mixed_chunk_parity(normalizer):
+    chunk = _read_csv(
+        "fio,phone,inn,dob,email\n"
+        "иванов иван иванович,8 (916) 123-45-67, 7707083893 ,1980-01-01,a@mail.ru\n"
+        ",,,,\n"
+        "  ким  ,7916,нет,,\n"
+        "ДЕ ЛА КРУЗ,+79161234567,123456789012,1990-05-05,\n"
+    )
+    rows = _assert_parity(normalizer, chunk)
+    assert [row['inn'] for row in rows] == ['7707083893', 'nan', 'нет', '123456789012']
@@ -0,0 +1,117 @@
+"""Колоночный скоринг score_columns против apply_filters + calculate_score.
+
+court_order_date в leads - колонка Date, поэтому данные для проверки
+идут датами, как из базы. Граница свежести судебного приказа та же,
+что у scored_recent_order в BULK_UPDATE_LEADS: приказ от recent_since
+и позже считается свежим.
+"""
+import itertools
+import random
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.scoring import SCORING_FIELDS, ScoringEngine
+
+FILTER_SETS = [
+    {},
+    {'min_debt_amount': 250000, 'exclude_bankrupts': True, 'exclude_no_debt': True, 'only_active_inn': True},
+    {'only_with_property': True, 'only_bank_mfo_debt': True, 'min_score_threshold': 30},
+    {'only_recent_court_orders': True, 'min_debt_amount': 0},
+]
+
+RECENT_ORDER = "Судебный приказ (последние 3 мес.)"
+
+
+@pytest.fixture
+def engine():
+    return ScoringEngine()
+
+
+def _lead(**fields) -> dict:
+    lead = {
+        'debt_amount': 300000.0, 'debt_type': 'bank', 'has_property': True, 'has_court_order': True,
+        'court_order_date': None, 'is_bankrupt': False, 'inn_active': True, 'debt_count': 1,
+    }
+    lead.update(fields)
+    return lead
+
+
+def _scalar(engine: ScoringEngine, leads: list, filters: dict) -> list:
+    results = []
+    for lead in leads:
+        if not engine.apply_filters(lead, filters):
+            results.append(None)
+            continue
+        score, reasons, group = engine.calculate_score(lead)
+        reasons = reasons + [None] * (3 - len(reasons))
+        results.append((score, engine.is_target(score, filters), *reasons, group))
+    return results
+
+
+def _columnar(engine: ScoringEngine, leads: list, filters: dict) -> list:
+    columns = {field: np.array([lead[field] for lead in leads], dtype=object) for field in SCORING_FIELDS}
+    result = engine.score_columns(columns, filters)
+    return [
+        (int(result['score'][i]), bool(result['is_target'][i]), result['reason_1'][i],
+         result['reason_2'][i], result['reason_3'][i], result['group_name'][i])
+        if result['passed'][i] else None
+        for i in range(len(result['passed']))
+    ]
+
+
+def _random_leads(rows: int, seed: int = 7) -> list:
+    rnd = random.Random(seed)
+    today = date.today()
+    return [
+        _lead(
+            debt_amount=rnd.choice([None, 0.0, 50000.0, 99999.5, 100000.0, 250000.0, 600000.0,
+                                    rnd.uniform(0, 2000000)]),
+            debt_type=rnd.choice(['bank', 'mfo', 'tax', 'utility', 'unknown', None]),
+            has_property=rnd.choice([True, False, None]),
+            has_court_order=rnd.choice([True, False]),
+            court_order_date=rnd.choice([None, today - timedelta(days=rnd.randint(0, 200))]),
+            is_bankrupt=rnd.random() < 0.1,
+            inn_active=rnd.choice([True, True, False, None]),
+            debt_count=rnd.randint(0, 5),
+        )
+        for _ in range(rows)
+    ]
+
+
+@pytest.mark.parametrize('filters', FILTER_SETS)
+def test_columnar_matches_scalar(engine, filters):
+    leads = [lead for lead in _random_leads(5000) if lead['debt_amount'] is not None]
+    assert _columnar(engine, leads, filters) == _scalar(engine, leads, filters)
+
+
+def test_unenriched_leads_do_not_pass(engine):
+    assert _columnar(engine, [_lead(debt_amount=None)], {}) == [None]
+
+
+@pytest.mark.parametrize('days_ago, recent', [(0, True), (89, True), (90, True), (91, False), (200, False)])
+def test_recent_court_order_boundary(engine, days_ago, recent):
+    order_date = date.today() - timedelta(days=days_ago)
+    leads = [_lead(court_order_date=order_date)]
+    scalar, = _scalar(engine, leads, {})
+    columnar, = _columnar(engine, leads, {})
+    assert columnar == scalar
+    assert (RECENT_ORDER in scalar[2:5]) is recent
+    # Та же граница, что у scored_recent_order в BULK_UPDATE_LEADS
+    assert (order_date >= engine.version_params({})['recent_since']) is recent
+
+
+def test_datetime_court_order_compared_by_day(engine):
+    boundary = datetime.combine(date.today() - timedelta(days=90), datetime.min.time())
+    leads = [_lead(court_order_date=boundary), _lead(court_order_date=boundary - timedelta(seconds=1))]
+    assert [RECENT_ORDER in row[2:5] for row in _scalar(engine, leads, {})] == [True, False]
+    assert _columnar(engine, leads, {}) == _scalar(engine, leads, {})
+
+
+def test_mixed_court_order_types(engine):
+    today = date.today()
+    values = [None, today, today - timedelta(days=90), datetime.now() - timedelta(days=10)]
+    leads = [_lead(court_order_date=value, has_court_order=flag)
+             for value, flag in itertools.product(values, [True, False])]
+    assert _columnar(engine, leads, {}) == _scalar(engine, leads, {})